@@ -0,0 +1,318 @@
+import hashlib
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1").lower() not in {"0", "false", "no"}
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "8"))
+ADMISSION_PER_USER_CONCURRENCY = int(os.getenv("ADMISSION_PER_USER_CONCURRENCY", "2"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+ADMISSION_PER_USER_QUEUE = int(os.getenv("ADMISSION_PER_USER_QUEUE", "4"))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "20"))
+# Refuse new questions up front when the LLM quota is already this far behind.
+ADMISSION_MAX_LLM_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_LLM_WAIT_SECONDS", "15"))
+
+# OpenAI quota per model; LLM_RPM_LIMIT_<MODEL> / LLM_TPM_LIMIT_<MODEL> override
+# the defaults for one model (e.g. LLM_TPM_LIMIT_GPT_4O_MINI). 0 disables a bucket.
+LLM_RPM_LIMIT = float(os.getenv("LLM_RPM_LIMIT", "500"))
+LLM_TPM_LIMIT = float(os.getenv("LLM_TPM_LIMIT", "30000"))
+# Tokens reserved before a call; corrected with the real usage afterwards.
+LLM_ESTIMATED_TOKENS_PER_CALL = int(os.getenv("LLM_ESTIMATED_TOKENS_PER_CALL", "3000"))
+
+
+class Saturated(Exception):
+    """Raised when a request can't be admitted; `retry_after` is a whole number of seconds."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, bursting up to `capacity`. Balance may go negative."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Take `amount` tokens now and return how long the caller must wait before using them."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= amount
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def credit(self, amount: float) -> None:
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+    def wait_time(self, amount: float = 0.0) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            deficit = amount - self._tokens
+            return 0.0 if deficit <= 0 else deficit / self.rate
+
+
+_metrics_lock = threading.Lock()
+_metrics = {
+    "admitted": 0,
+    "queued": 0,
+    "rejected_queue_full": 0,
+    "rejected_timeout": 0,
+    "rejected_llm_quota": 0,
+    "queue_wait_ms_total": 0.0,
+    "queue_wait_ms_max": 0.0,
+    "llm_calls": 0,
+    "llm_throttled_calls": 0,
+    "llm_throttle_wait_ms_total": 0.0,
+}
+
+
+def _env_model_limit(prefix: str, model: str, default: float) -> float:
+    key = f"{prefix}_{re.sub(r'[^A-Za-z0-9]+', '_', model).upper()}"
+    return float(os.getenv(key, default))
+
+
+class LLMQuota:
+    """
+    One model's RPM and TPM buckets. utils wraps it in a LangChain rate limiter
+    so every chat model call reserves from it before the request goes out, and
+    bursts are smoothed to the quota instead of turning into 429s and retries.
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+        rpm = _env_model_limit("LLM_RPM_LIMIT", model, LLM_RPM_LIMIT)
+        tpm = _env_model_limit("LLM_TPM_LIMIT", model, LLM_TPM_LIMIT)
+        self.requests = TokenBucket(rpm / 60.0, max(1.0, rpm / 6.0)) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm / 60.0, max(float(LLM_ESTIMATED_TOKENS_PER_CALL), tpm / 6.0)) if tpm > 0 else None
+
+    def expected_wait(self) -> float:
+        waits = [0.0]
+        if self.requests:
+            waits.append(self.requests.wait_time(1))
+        if self.tokens:
+            waits.append(self.tokens.wait_time(LLM_ESTIMATED_TOKENS_PER_CALL))
+        return max(waits)
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if not blocking and self.expected_wait() > 0:
+            return False
+        wait = 0.0
+        if self.requests:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens:
+            wait = max(wait, self.tokens.reserve(LLM_ESTIMATED_TOKENS_PER_CALL))
+        with _metrics_lock:
+            _metrics["llm_calls"] += 1
+            if wait > 0:
+                _metrics["llm_throttled_calls"] += 1
+                _metrics["llm_throttle_wait_ms_total"] += wait * 1000
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+    def settle(self, total_tokens: int) -> None:
+        """Adjust the token bucket by the difference between the estimate and the real usage."""
+        if self.tokens and total_tokens:
+            self.tokens.credit(LLM_ESTIMATED_TOKENS_PER_CALL - total_tokens)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_llm_quota(model: str) -> LLMQuota:
+    with _limiters_lock:
+        quota = _limiters.get(model)
+        if quota is None:
+            quota = _limiters[model] = LLMQuota(model)
+        return quota
+
+
+def llm_backlog_seconds() -> float:
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return max((quota.expected_wait() for quota in limiters), default=0.0)
+
+
+class _Ticket:
+    __slots__ = ("user", "granted", "enqueued_at")
+
+    def __init__(self, user):
+        self.user = user
+        self.granted = False
+        self.enqueued_at = time.monotonic()
+
+
+class FairScheduler:
+    """
+    Admission for whole questions: at most `max_concurrent` in flight, at most
+    `per_user` per user, and a bounded queue served round-robin across users so
+    one user's burst can't starve everyone else.
+    """
+
+    def __init__(self, max_concurrent, per_user, max_queue, queue_timeout, per_user_queue=None):
+        self.max_concurrent = max_concurrent
+        self.per_user = per_user
+        self.max_queue = max_queue
+        self.per_user_queue = per_user_queue or max_queue
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._active = 0
+        self._active_by_user = {}
+        self._queues = OrderedDict()
+        self._queued = 0
+        self._service_seconds = 5.0
+
+    def _can_run(self, user) -> bool:
+        return self._active < self.max_concurrent and self._active_by_user.get(user, 0) < self.per_user
+
+    def _grant(self, user) -> None:
+        self._active += 1
+        self._active_by_user[user] = self._active_by_user.get(user, 0) + 1
+
+    def _dispatch(self) -> None:
+        """Hand free slots to queued users in round-robin order."""
+        progressed = True
+        while progressed and self._active < self.max_concurrent and self._queues:
+            progressed = False
+            for user in list(self._queues):
+                if not self._can_run(user):
+                    continue
+                queue = self._queues.pop(user)
+                ticket = queue.popleft()
+                if queue:
+                    self._queues[user] = queue  # back of the rotation
+                self._queued -= 1
+                self._grant(user)
+                ticket.granted = True
+                progressed = True
+                if self._active >= self.max_concurrent:
+                    break
+        self._cond.notify_all()
+
+    def retry_after(self) -> float:
+        return self._service_seconds * (self._queued + 1) / max(1, self.max_concurrent)
+
+    def acquire(self, user) -> float:
+        """Block until admitted; returns the seconds spent queued. Raises Saturated."""
+        with self._cond:
+            # Queued users that could run have already been dispatched, so a free
+            # slot goes straight to a user with nothing waiting.
+            if user not in self._queues and self._can_run(user):
+                self._grant(user)
+                return 0.0
+            if self._queued >= self.max_queue or len(self._queues.get(user, ())) >= self.per_user_queue:
+                _count("rejected_queue_full")
+                raise Saturated("Too many questions are being answered right now.", self.retry_after())
+            ticket = _Ticket(user)
+            self._queues.setdefault(user, deque()).append(ticket)
+            self._queued += 1
+            _count("queued")
+            self._dispatch()
+            deadline = ticket.enqueued_at + self.queue_timeout
+            while not ticket.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    queue = self._queues.get(user)
+                    if queue and ticket in queue:
+                        queue.remove(ticket)
+                        if not queue:
+                            del self._queues[user]
+                        self._queued -= 1
+                    _count("rejected_timeout")
+                    raise Saturated("Timed out waiting for a free slot.", self.retry_after())
+                self._cond.wait(remaining)
+            return time.monotonic() - ticket.enqueued_at
+
+    def release(self, user, service_seconds: float = None) -> None:
+        with self._cond:
+            self._active -= 1
+            left = self._active_by_user.get(user, 1) - 1
+            if left:
+                self._active_by_user[user] = left
+            else:
+                self._active_by_user.pop(user, None)
+            if service_seconds is not None:
+                # Moving average of how long a question holds a slot, for Retry-After.
+                self._service_seconds = 0.8 * self._service_seconds + 0.2 * service_seconds
+            self._dispatch()
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {"active": self._active, "queued": self._queued, "avg_service_seconds": round(self._service_seconds, 2)}
+
+
+def _count(key: str) -> None:
+    with _metrics_lock:
+        _metrics[key] += 1
+
+
+_scheduler = FairScheduler(
+    ADMISSION_MAX_CONCURRENT,
+    ADMISSION_PER_USER_CONCURRENCY,
+    ADMISSION_MAX_QUEUE,
+    ADMISSION_QUEUE_TIMEOUT_SECONDS,
+    per_user_queue=ADMISSION_PER_USER_QUEUE,
+)
+
+
+def user_key(auth_header: str) -> str:
+    return hashlib.sha256((auth_header or "").encode("utf-8")).hexdigest()[:16]
+
+
+class admit:
+    """
+    Context manager around one question's LLM + DB work:
+
+        with admit(auth_header):
+            ...
+
+    Raises Saturated (-> HTTP 429 with Retry-After) when the LLM quota backlog
+    is too long or no slot frees up within ADMISSION_QUEUE_TIMEOUT_SECONDS.
+    """
+
+    def __init__(self, auth_header: str):
+        self.user = user_key(auth_header)
+        self.started_at = None
+
+    def __enter__(self):
+        if not ADMISSION_ENABLED:
+            return self
+        backlog = llm_backlog_seconds()
+        if backlog > ADMISSION_MAX_LLM_WAIT_SECONDS:
+            _count("rejected_llm_quota")
+            raise Saturated("The assistant is at its model quota.", backlog)
+        waited = _scheduler.acquire(self.user)
+        with _metrics_lock:
+            _metrics["admitted"] += 1
+            _metrics["queue_wait_ms_total"] += waited * 1000
+            _metrics["queue_wait_ms_max"] = max(_metrics["queue_wait_ms_max"], waited * 1000)
+        self.started_at = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.started_at is not None:
+            _scheduler.release(self.user, time.monotonic() - self.started_at)
+        return False
+
+
+def get_admission_metrics() -> dict:
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    metrics["queue_wait_ms_avg"] = round(metrics["queue_wait_ms_total"] / metrics["admitted"], 1) if metrics["admitted"] else 0.0
+    metrics.update(_scheduler.snapshot())
+    metrics["llm_backlog_seconds"] = round(llm_backlog_seconds(), 2)
+    return metrics
@@ -1,15 +1,30 @@
-from utils import Assistant, create_tool_node_with_fallback
+from utils import Assistant, create_tool_node_with_fallback, best_partial_answer
+from budget import AgentBudget
+from intent_router import route_question
+from prompt_helper import is_query_sensitive
 from typing import Annotated
 from langgraph.graph.message import AnyMessage, add_messages
 from typing_extensions import TypedDict
 from langgraph.graph import END, START, StateGraph
-from tools_and_primary_agent import Primary_agent, get_primary_agent_tools, route_primary_assistant
+from tools_and_primary_agent import get_primary_agent, get_routing_agent, get_primary_agent_tools, route_primary_assistant, triage_question, READ_ONLY_TOOL_NAMES
 from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.errors import GraphRecursionError
 
-from dotenv import load_dotenv
+from config import load_env
 import json
+import logging
+import os
+import threading
 
-load_dotenv()
+load_env()
+
+logger = logging.getLogger(__name__)
+
+# Triage costs one fast-model round trip (and its prompt tokens) on every
+# question the fast path misses, and saves the full agent run on casual
+# messages. Turn it off where almost every question needs data;
+# benchmarks/bench_triage.py measures the difference offline.
+TRIAGE_ENABLED = os.getenv("TRIAGE_ENABLED", "1").lower() not in {"0", "false", "no"}
 
 class State(TypedDict):
     messages: Annotated[list[AnyMessage], add_messages]
@@ -17,8 +32,8 @@ class State(TypedDict):
 
 def build_graph():
     builder = StateGraph(State)
-    builder.add_node("primary_agent", Assistant(Primary_agent))
-    builder.add_node("primary_agent_tools", create_tool_node_with_fallback(get_primary_agent_tools()))
+    builder.add_node("primary_agent", Assistant(get_primary_agent("sql"), routing_runnable=get_routing_agent()))
+    builder.add_node("primary_agent_tools", create_tool_node_with_fallback(get_primary_agent_tools(), concurrent_tools=READ_ONLY_TOOL_NAMES))
     builder.add_edge("primary_agent_tools", "primary_agent")
     builder.add_conditional_edges(
         "primary_agent",
@@ -33,6 +48,27 @@ def build_graph():
     return builder.compile()
 
 
+_graphs = {}
+_graphs_lock = threading.Lock()
+
+
+def get_graph():
+    """
+    The compiled agent graph, built once and reused across requests. It is
+    rebuilt only when its runnables change (another chat model, or the
+    routing turn switched on/off by schema availability).
+    """
+    primary_agent = get_primary_agent("sql")
+    routing_agent = get_routing_agent()
+    key = (id(primary_agent), id(routing_agent))
+    with _graphs_lock:
+        graph = _graphs.get(key)
+        if graph is None:
+            _graphs.clear()
+            graph = _graphs[key] = build_graph()
+        return graph
+
+
 def get_sql_query_from_tool_calls(response):
     messages = response.get("messages", [])
     for message in reversed(messages):
@@ -48,10 +84,48 @@ def get_sql_query_from_tool_calls(response):
                         return ""  # if invalid JSON
     return ""
 
+def run_agent(graph, messages, budget: AgentBudget) -> dict:
+    """
+    Stream the graph so the latest state survives a recursion-limit or
+    deadline stop; the last state is then closed off with a partial answer.
+    """
+    config = {"configurable": {"budget": budget}, "recursion_limit": budget.recursion_limit}
+    state = {"messages": messages}
+    try:
+        for state in graph.stream({"messages": messages}, config, stream_mode="values"):
+            pass
+    except GraphRecursionError:
+        reason = budget.exhaust("max_llm_turns")
+        state = {**state, "messages": state["messages"] + [best_partial_answer(state["messages"], reason)]}
+    return state
+
+
 def get_sql_and_human_readable_output(question):
-    graph = build_graph()
+    # Same guard as the legacy path, before any LLM call is spent on the question.
+    if is_query_sensitive(question):
+        return "SENSITIVE_QUERY_ERROR", "User is not allowed this."
+
+    fast_path = route_question(question)
+    if fast_path:
+        return fast_path.sql, fast_path.text
+
+    budget = AgentBudget()
+    if TRIAGE_ENABLED:
+        try:
+            casual_reply = triage_question(question, budget)
+        except Exception as e:
+            logger.warning("Triage failed, continuing with the full agent: %s", e)
+            casual_reply = None
+        if casual_reply:
+            logger.info("Model usage: %s", budget.usage_by_step)
+            return "", casual_reply
+
+    graph = get_graph()
     messages = [HumanMessage(content=question)]
-    response = graph.invoke({"messages": messages})
+    response = run_agent(graph, messages, budget)
+    if budget.exhausted_reason:
+        logger.warning("Agent budget exhausted (%s): %s", budget.exhausted_reason, budget.summary())
+    logger.info("Model usage: %s", budget.usage_by_step)
     sql_query = get_sql_query_from_tool_calls(response=response)
     # print("response is:- ", response)
     ai_messages = [
@@ -61,4 +135,4 @@ def get_sql_and_human_readable_output(question):
         ai_messages[-1].content if ai_messages else "No response generated"
     )
     # print(last_ai_message)
-    return sql_query, last_ai_message
\ No newline at end of file
+    return sql_query, last_ai_message
@@ -1,20 +1,36 @@
 import logging
 import os
 import requests
-import traceback
 import pyodbc
-import pandas as pd
 import json
 import re
+import threading
+from datetime import datetime, timezone
 from decimal import Decimal
-from flask import Flask, request, jsonify, send_from_directory, url_for
-from config import configure_cors
-from logging.handlers import RotatingFileHandler
+from email.utils import parsedate_to_datetime
+from flask import Blueprint, Flask, Response, g, redirect, request, jsonify, send_from_directory, stream_with_context, url_for
+from config import configure_cors, load_env
 from werkzeug.exceptions import HTTPException
-from db import run_sql_query
-from prompt_helper import get_sql_and_text_response
-from chart_generator import generate_chart
-from agent_graph import get_sql_and_human_readable_output
+
+# Must run before the imports below, which read their settings from the environment.
+load_env()
+
+from cache import get_cache, get_cache_metrics
+from chart_store import (
+    CHART_CACHE_CONTROL, CHART_PRESIGN_SECONDS, chart_etag, get_chart_store, get_chart_store_metrics, is_chart_name, record_served,
+)
+from query_guard import QueryRejected
+from single_flight import get_coalescing_metrics, run_once
+from admission import Saturated, admit, get_admission_metrics
+from export import EXPORT_FORMATS, export_stream, get_export_metrics, lookup_answer, remember_answer
+from digest import get_digest_metrics, precomputed_answer, recent_reports, run_now, set_answer_function
+from freshness import start_poller
+from health import WARMUP_ON_START, get_health_metrics, liveness, readiness, start_warmup
+from logging_setup import bind_request, configure_logging, get_logging_metrics, new_request_id, request_id_var, unbind_request
+
+# Heavy modules (pandas, matplotlib, sqlalchemy, sqlglot and the langchain /
+# langgraph / openai stack) are imported inside the routes that use them, so
+# importing this module and creating the app stays cheap. See create_app.
 
 class CustomJSONEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -22,22 +38,8 @@ class CustomJSONEncoder(json.JSONEncoder):
             return float(obj)
         return super(CustomJSONEncoder, self).default(obj)
 
-app = Flask(__name__, static_url_path='', static_folder='static')
-
-
-app.json_provider_class.JSONEncoder = CustomJSONEncoder
-
-os.environ["CORS_ENV"] = "prod"
-configure_cors(app)
-
-LOG_FILE_PATH = os.getenv("LOG_FILE_PATH", "logs/app.log")
-os.makedirs(os.path.dirname(LOG_FILE_PATH), exist_ok=True)
-handler = RotatingFileHandler(LOG_FILE_PATH, maxBytes=1_000_000, backupCount=3)
-handler.setFormatter(logging.Formatter('[%(asctime)s] %(levelname)s: %(message)s'))
+bp = Blueprint("api", __name__)
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-logger.addHandler(handler)
-
 
 AUTH_API_URL = "http://posapi.iconnectgroup.com/Api/GetAuthToken"
 WMS_LOGIN_API_URL = "http://posapi.iconnectgroup.com/Api/Wms/UserLogin"
@@ -45,24 +47,46 @@ SAVE_CHAT_API_URL = "http://posapi.iconnectgroup.com/Api/Chat/saveChatMessageInf
 GET_CHAT_API_URL = "http://posapi.iconnectgroup.com/Api/Chat/getChatMessageInfo"
 AUTH_CODE_MAP = { "tnr": "turNER", "act": "AshleYcT", "act1": "Ashleyct1", "act2":"afhstXDev" }
 SQL_COL_Generated = ""
+TOKEN_CACHE_TTL_SECONDS = int(os.getenv("TOKEN_CACHE_TTL_SECONDS", "600"))
+_tokens = get_cache("tokens", TOKEN_CACHE_TTL_SECONDS)
+
 
-@app.route('/api/token', methods=['GET'])
+def _token_ttl(expires) -> float:
+    """Cache a token for TOKEN_CACHE_TTL_SECONDS, but never past a minute before its `.expires`."""
+    ttl = TOKEN_CACHE_TTL_SECONDS
+    if expires:
+        try:
+            remaining = (parsedate_to_datetime(expires) - datetime.now(timezone.utc)).total_seconds()
+            ttl = min(ttl, remaining - 60)
+        except (TypeError, ValueError):
+            pass
+    return ttl
+
+@bp.route('/api/token', methods=['GET'])
 def get_login_token():
     code = request.args.get("Code")
     if not code: return jsonify({"error": "Missing 'Code' parameter"}), 400
     auth_code = AUTH_CODE_MAP.get(code.strip().lower())
-    logger.info(f"Auth code resolved for {code}: {auth_code}")
+    logger.info("Auth code resolved for %s", code)
     if not auth_code: return jsonify({"error": f"Invalid code '{code}'"}), 400
+    # Every user of a code gets the same upstream token, so workers share it until shortly before it expires.
+    cached = _tokens.get(auth_code)
+    if cached:
+        return jsonify(cached), 200
     try:
         response = requests.post(AUTH_API_URL, data={"grant_type": "password", "AuthCode": auth_code})
         response.raise_for_status()
         data = response.json()
-        return jsonify({ "access_token": data.get("access_token"), "token_type": data.get("token_type", "Bearer"), "expires": data.get(".expires") }), 200
+        token = { "access_token": data.get("access_token"), "token_type": data.get("token_type", "Bearer"), "expires": data.get(".expires") }
+        ttl = _token_ttl(token["expires"])
+        if token["access_token"] and ttl > 0:
+            _tokens.set(auth_code, token, ttl)
+        return jsonify(token), 200
     except requests.exceptions.RequestException as e:
         logger.error("Token API Error: %s", str(e))
         return jsonify({"error": "Failed to get token"}), 502
 
-@app.route('/api/login', methods=['POST'])
+@bp.route('/api/login', methods=['POST'])
 def login_proxy():
     auth_header = request.headers.get("Authorization")
     if not auth_header or not auth_header.startswith("Bearer "):
@@ -127,10 +151,9 @@ def login_proxy():
         return jsonify({"error": e.response.text if e.response else "Unknown error"}), 502
 
 
-@app.route('/api/query', methods=['GET'])
+@bp.route('/api/query', methods=['GET'])
 def query():
     auth_header = request.headers.get("Authorization")
-    SQL_COL_Generated = ""
 
     if not auth_header:
         return jsonify({"error": "Authorization token required"}), 401
@@ -142,81 +165,358 @@ def query():
     question = data["question"].strip()
     if not question:
         return jsonify({"error": "Question is required."}), 400
+    # preview: answer aggregates from a sample first; the exact answer is polled from /api/query/exact/<id>.
+    preview = str(data.get("preview", request.args.get("preview", "0"))).lower() in {"1", "true", "yes"}
+
+    logger.info("Question received", extra={"question": question, "preview": preview})
+    # Scheduled digest questions are answered off-peak after each load.
+    precomputed = None if preview else precomputed_answer(question)
+    if precomputed is not None:
+        logger.info("Served a precomputed digest answer.")
+        chart_filename = precomputed.pop("chart_filename", None)
+        if chart_filename:
+            precomputed["chart_url"] = _chart_url(chart_filename)
+        if precomputed.get("sql") and precomputed.get("table"):
+            precomputed["answer_id"] = remember_answer(precomputed["sql"], auth_header)
+        return jsonify(precomputed), 200
+    # Identical questions arriving together share one agent run and one SQL execution;
+    # only that run goes through admission control.
+    key = f"{question}\x00preview" if preview else question
+    try:
+        (body, status), shared = run_once(key, auth_header, lambda: _admitted_answer(question, auth_header, preview))
+    except Saturated as busy:
+        logger.warning("Question rejected by admission control: %s", busy)
+        return _too_many_requests(busy)
+    if shared:
+        logger.info("Coalesced /api/query with an in-flight identical question.")
+        if body.get("exact_job_id"):
+            from preview import share_exact
+
+            # The leader's exact job is only visible to its token; give this caller a handle of its own.
+            job_id = share_exact(body["exact_job_id"], auth_header)
+            body = {**body, "exact_job_id": job_id, "exact_url": url_for('api.exact_answer', job_id=job_id, _external=True)}
+    if status == 200 and body.get("sql") and body.get("table"):
+        body = {**body, "answer_id": remember_answer(body["sql"], auth_header)}
+    return jsonify(body), status
+
+
+@bp.route('/api/query/exact/<job_id>', methods=['GET'])
+def exact_answer(job_id):
+    """
+    The exact answer behind a preview. 202 while it is still running (pass
+    ?wait=N to block up to N seconds for it), then the same body /api/query
+    would have returned.
+    """
+    from preview import exact_job
+
+    auth_header = request.headers.get("Authorization")
+    if not auth_header:
+        return jsonify({"error": "Authorization token required"}), 401
+    entry = exact_job(job_id, auth_header, wait=request.args.get("wait", 0, type=float))
+    if entry is None:
+        return jsonify({"error": "Answer not found or expired. Please ask the question again."}), 404
+    if entry["status"] != "done":
+        response = jsonify({"status": "pending", "exact_job_id": job_id})
+        response.headers["Retry-After"] = "1"
+        return response, 202
+    body = entry["body"]
+    # Minted per poll, like /api/query does per caller: the job may be shared by coalesced callers.
+    if entry["code"] == 200 and body.get("sql") and body.get("table"):
+        body = {**body, "answer_id": remember_answer(body["sql"], auth_header)}
+    return jsonify(body), entry["code"]
+
+
+@bp.route('/api/query/batch', methods=['GET', 'POST'])
+def query_batch():
+    """
+    Answer up to BATCH_MAX_QUESTIONS questions at once, e.g. a dashboard's
+    fixed set: {"questions": ["...", ...]}. The questions share one schema
+    snapshot and one execution per distinct SQL, and are streamed back as
+    NDJSON in completion order: one line per question ({"index", "question",
+    "status", ...the /api/query body}), then a summary line. Each question is
+    admitted on its own, like a single /api/query; one that can't be comes
+    back with status 429 and "retry_after".
+    """
+    from admission import ADMISSION_ENABLED, ADMISSION_PER_USER_CONCURRENCY
+    from batch import BATCH_CONCURRENCY, BATCH_MAX_QUESTIONS, BatchRun
+    from db import run_sql_query
+
+    auth_header = request.headers.get("Authorization")
+    if not auth_header:
+        return jsonify({"error": "Authorization token required"}), 401
+
+    data = request.get_json(silent=True) or {}
+    questions = data.get("questions")
+    if not isinstance(questions, list) or not questions:
+        return jsonify({"error": "questions must be a non-empty list."}), 400
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        return jsonify({"error": f"At most {BATCH_MAX_QUESTIONS} questions per batch."}), 400
+    questions = [q.strip() if isinstance(q, str) else "" for q in questions]
+    if not all(questions):
+        return jsonify({"error": "Every question must be a non-empty string."}), 400
+
+    logger.info("Batch received", extra={"questions": len(questions)})
+
+    chart_url_base = url_for('api.serve_chart', filename='_', _external=True)[:-1]
+
+    def answer_one(question, run_sql):
+        return _admitted_or_busy(question, auth_header, run_sql, chart_url_base)
+
+    # More workers than the per-user limit would only queue behind it (or overflow its queue).
+    concurrency = min(BATCH_CONCURRENCY, ADMISSION_PER_USER_CONCURRENCY) if ADMISSION_ENABLED else BATCH_CONCURRENCY
+    run = BatchRun(questions, answer_one, run_sql_query, concurrency=concurrency)
+
+    def lines():
+        for indices, (body, status) in run:
+            if status == 200 and body.get("sql") and body.get("table"):
+                body = {**body, "answer_id": remember_answer(body["sql"], auth_header)}
+            for index in indices:
+                yield json.dumps({"index": index, "question": questions[index], "status": status, **body}, cls=CustomJSONEncoder) + "\n"
+        yield json.dumps(run.summary()) + "\n"
+
+    return Response(stream_with_context(lines()), mimetype="application/x-ndjson")
+
+
+@bp.route('/api/digests/reports', methods=['GET'])
+def digest_reports():
+    """Recent scheduled digest runs with per-question durations (newest first); ?digest=<name> filters."""
+    if not request.headers.get("Authorization"):
+        return jsonify({"error": "Authorization token required"}), 401
+    return jsonify({"reports": recent_reports(request.args.get("digest") or None)}), 200
+
+
+@bp.route('/api/digests/run', methods=['POST'])
+def run_digests():
+    """
+    Run digests now, outside the off-peak window: {"digests": [names]} (all
+    when omitted). Questions are admitted as the caller; 409 while digests are
+    already running on this worker.
+    """
+    auth_header = request.headers.get("Authorization")
+    if not auth_header:
+        return jsonify({"error": "Authorization token required"}), 401
+    data = request.get_json(silent=True) or {}
+    started = run_now(data.get("digests") or None, auth_header=auth_header)
+    if started is None:
+        return jsonify({"error": "Digests are already running. Please try again when they finish."}), 409
+    if not started:
+        return jsonify({"error": "No matching digest is configured."}), 404
+    return jsonify({"started": started}), 202
+
+
+def _too_many_requests(busy):
+    response = jsonify({"error": "The assistant is busy right now. Please try again shortly."})
+    response.headers["Retry-After"] = str(busy.retry_after)
+    return response, 429
+
+
+def _admitted_answer(question, auth_header, preview=False):
+    with admit(auth_header):
+        return _answer_question(question, auth_header=auth_header, preview=preview)
 
-    print("the question is:- ", question)
+
+def _admitted_or_busy(question, auth_header, run_sql, chart_url_base):
+    """One question of a batch or digest: admitted on its own, (body, 429) when it can't be."""
+    try:
+        with admit(auth_header):
+            return _answer_question(question, auth_header=auth_header, run_sql=run_sql, chart_url_base=chart_url_base)
+    except Saturated as busy:
+        logger.warning("Question rejected by admission control: %s", busy)
+        return {"error": "The assistant is busy right now. Please try again shortly.", "retry_after": busy.retry_after}, 429
+
+
+def _chart_url(chart_filename, chart_url_base=None):
+    # Straight to the CDN/public bucket when there is one, otherwise through serve_chart.
+    # An empty base leaves just the file name, for answers stored before anyone asks.
+    public_url = get_chart_store().public_url(chart_filename)
+    if public_url:
+        return public_url
+    if chart_url_base is not None:
+        return chart_url_base + chart_filename
+    return url_for('api.serve_chart', filename=chart_filename, _external=True)
+
+
+def _answer_body(sql, explanation, chart_title, df, sql_columns, chart_url_base=None):
+    """The /api/query body for an executed query; usable outside the request (background exact answers)."""
+    from chart_generator import generate_chart
+
+    if df.empty:
+        return {"error": "No record found"}, 404
+
+    chart_url = None
+    chart_filename = generate_chart(df, title=chart_title)
+    if chart_filename:
+        chart_url = _chart_url(chart_filename, chart_url_base)
+        logger.debug("Generated chart", extra={"chart_url": chart_url})
+
+    table_data = json.loads(df.to_json(orient="records", date_format="iso"))
+
+    return {
+        "sql": sql,
+        "table": table_data,
+        "columns": list(df.columns),
+        "chart_url": chart_url,
+        "text": explanation,
+        "chart_title": chart_title,
+        "sql_query_columns": sql_columns,
+        "row_count": len(df),
+        # The row cap (QUERY_DEFAULT_ROW_CAP) cut the result short; the export endpoint returns all rows.
+        "truncated": bool(df.attrs.get("truncated", False)),
+    }, 200
+
+
+def _error_answer(e, sql):
+    """Map an exception raised while answering to (body, status)."""
+    if isinstance(e, QueryRejected):
+        logger.warning("Query rejected by cost guard: %s", e, extra={"sql": sql})
+        return {"error": "This question would scan too much data. Please narrow it down, for example to a date range, store or region."}, 400
+
+    if isinstance(e, pyodbc.Error):
+        error_message = str(e)
+        logger.error("Database error: %s", error_message, extra={"sql": sql})
+
+        if "Invalid column name" in error_message or "Invalid object name" in error_message:
+            return {"error": "I couldn't find the data you asked for. Please try rephrasing your question."}, 400
+        else:
+            return {"error": "An error occurred while querying the database."}, 500
+
+    logger.error("A critical error occurred in /api/query", exc_info=e)
+
+    if isinstance(e, UnboundLocalError):
+        return {"error": "The data is not available, please provide data"}, 500
+    else:
+        return {"error": f"An internal server error occurred: {str(e)}"}, 500
+
+
+def _preview_answer(sql, explanation, chart_title, sql_columns, auth_header):
+    """
+    An approximate body from a sampled run of `sql`, with the exact answer
+    submitted in the background; None when the query can't be previewed.
+    """
+    from db import run_sql_query
+    from preview import run_preview, submit_exact
+
+    estimate = run_preview(sql)
+    if estimate is None:
+        return None
+    chart_url_base = url_for('api.serve_chart', filename='_', _external=True)[:-1]
+
+    def exact():
+        try:
+            body, status = _answer_body(sql, explanation, chart_title, run_sql_query(sql), sql_columns, chart_url_base)
+        except Exception as e:
+            return _error_answer(e, sql)
+        return body, status
+
+    job_id = submit_exact(exact, auth_header)
+    return {
+        "sql": sql,
+        "table": json.loads(estimate.df.to_json(orient="records", date_format="iso")),
+        "columns": list(estimate.df.columns),
+        "chart_url": None,
+        "text": explanation,
+        "chart_title": chart_title,
+        "sql_query_columns": sql_columns,
+        **estimate.describe(),
+        "exact_job_id": job_id,
+        "exact_url": url_for('api.exact_answer', job_id=job_id, _external=True),
+    }
+
+
+def _answer_question(question, auth_header=None, preview=False, run_sql=None, chart_url_base=None):
+    """
+    Answer one question; returns (response body, status) so the result can be shared between callers.
+    `run_sql` replaces db.run_sql_query (a batch shares executions through it).
+    """
+    from agent_graph import get_sql_and_human_readable_output
+    from db import run_sql_query
+
+    run_sql = run_sql or run_sql_query
+
+    SQL_COL_Generated = ""
+    sql = ""
     try:
         sql, explanation = get_sql_and_human_readable_output(question)
-        print("the answer is:- ",explanation)
+        logger.debug("Answer generated", extra={"answer": explanation})
         # return ans
         # sql, C, chart_title = get_sql_and_text_response(question)
         chart_title = "my chart"
 
         if sql == "SENSITIVE_QUERY_ERROR":
-            return jsonify({"error": explanation}), 403
+            return {"error": explanation}, 403
 
         if sql == "SQL_PARSE_ERROR":
-            return jsonify({"error": "The AI response was not in the correct format."}), 500
+            return {"error": "The AI response was not in the correct format."}, 500
 
         if not sql.lower().strip().startswith("select"):
-            return jsonify({
+            return {
                 "text": explanation,
                 "table": [],
                 "columns": [],
                 "chart_url": None,
                 "chart_title": None
-            })
+            }, 200
 
-        print(f"\nExecuting SQL Query:\n---\n{sql}\n---\n")
+        logger.debug("Executing SQL", extra={"sql": sql})
 
         try:
             columnName = extract_base_columns(sql)
             SQL_COL_Generated = ", ".join(columnName)
         except Exception as e:
-            logger.warning(f"Column extraction failed for SQL: {sql} | Error: {str(e)}")
+            logger.warning("Column extraction failed: %s", e, extra={"sql": sql})
             SQL_COL_Generated = ""
 
-        df = run_sql_query(sql)
-        if df.empty:
-            return jsonify({"error": "No record found"}), 404
+        if preview:
+            body = _preview_answer(sql, explanation, chart_title, SQL_COL_Generated, auth_header)
+            if body is not None:
+                return body, 200
 
-        chart_url = None
-        chart_filename = generate_chart(df, title=chart_title)
-        if chart_filename:
-            chart_url = url_for('serve_chart', filename=chart_filename, _external=True)
-            print(f"Generated Chart URL: {chart_url}")
+        return _answer_body(sql, explanation, chart_title, run_sql(sql), SQL_COL_Generated, chart_url_base)
 
-        table_data = json.loads(df.to_json(orient="records", date_format="iso"))
+    except Exception as e:
+        return _error_answer(e, sql)
 
-        return jsonify({
-            "sql": sql,
-            "table": table_data,
-            "columns": list(df.columns),
-            "chart_url": chart_url,
-            "text": explanation,
-            "chart_title": chart_title,
-            "sql_query_columns": SQL_COL_Generated
-        })
 
-    except pyodbc.Error as db_error:
-        error_message = str(db_error)
-        logger.error(f"Database error for SQL: {sql} | Error: {error_message}")
+@bp.route('/api/query/export', methods=['GET'])
+def export_query():
+    """
+    Stream the full result of a completed answer as CSV or Parquet.
+    Query args: answer_id (from /api/query), format=csv|parquet, gzip=1, row_cap (0 = no cap).
+    """
+    auth_header = request.headers.get("Authorization")
+    if not auth_header:
+        return jsonify({"error": "Authorization token required"}), 401
 
-        if "Invalid column name" in error_message or "Invalid object name" in error_message:
-            return jsonify({"error": "I couldn't find the data you asked for. Please try rephrasing your question."}), 400
-        else:
-            return jsonify({"error": "An error occurred while querying the database."}), 500
+    answer_id = request.args.get("answer_id", "")
+    fmt = request.args.get("format", "csv").lower()
+    compress = request.args.get("gzip", "0").lower() in {"1", "true", "yes"}
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"Unsupported format '{fmt}'. Use one of: {', '.join(EXPORT_FORMATS)}."}), 400
+    try:
+        row_cap = request.args.get("row_cap", type=int)
+    except ValueError:
+        return jsonify({"error": "row_cap must be an integer."}), 400
 
-    except Exception as e:
-        error_traceback = traceback.format_exc()
-        logger.error(f"A critical error occurred in /api/query:\n{error_traceback}")
+    sql = lookup_answer(answer_id, auth_header)
+    if not sql:
+        return jsonify({"error": "Answer not found or expired. Please ask the question again."}), 404
 
-        if isinstance(e, UnboundLocalError):
-            return jsonify({"error": "The data is not available, please provide data"}), 500
-        else:
-            return jsonify({"error": f"An internal server error occurred: {str(e)}"}), 500
+    try:
+        chunks = export_stream(sql, fmt=fmt, compress=compress, row_cap=row_cap)
+    except QueryRejected as rejected:
+        logger.warning("Export rejected by cost guard: %s", rejected, extra={"sql": sql})
+        return jsonify({"error": str(rejected)}), 400
+    except pyodbc.Error as db_error:
+        logger.error("Database error exporting SQL: %s", db_error, extra={"sql": sql})
+        return jsonify({"error": "An error occurred while querying the database."}), 500
 
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    filename = f"answer-{answer_id[:8]}.{extension}" + (".gz" if compress else "")
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    return Response(stream_with_context(chunks), mimetype="application/gzip" if compress else mimetype, headers=headers)
 
-# @app.route('/api/query-get', methods=['GET'])
+
+# @bp.route('/api/query-get', methods=['GET'])
 # def query_get():
 #     """
 #     Simple GET endpoint which uses a hardcoded auth token and a hardcoded question.
@@ -283,7 +583,7 @@ def query():
 #         return jsonify({"error": f"Internal server error: {str(e)}"}), 500
 
 
-@app.route('/api/chat/save', methods=['POST'])
+@bp.route('/api/chat/save', methods=['POST'])
 def save_chat_message():
     auth_header = request.headers.get("Authorization")
     if not auth_header: return jsonify({"error": "Authorization token required"}), 401
@@ -305,14 +605,15 @@ def save_chat_message():
        "attributes": sql_query_attributes
     }
     
-    print(f"Payload for saving chat message: {payload}")
     headers = { "Content-Type": "application/json", "Authorization": auth_header }
 
     try:
-        logger.info(f"Saving chat message for user {user_id}: {payload}")
+        logger.info("Saving chat message for user %s", user_id)
+        logger.debug("Save chat payload", extra={"payload": payload})
         response = requests.post(SAVE_CHAT_API_URL, json=payload, headers=headers)
         response.raise_for_status()
-        logger.info(f"Save chat API successful. Status: {response.status_code}, Response: {response.text}")
+        logger.info("Save chat API successful. Status: %s", response.status_code)
+        logger.debug("Save chat API response", extra={"response_body": response.text})
         return jsonify(response.json()), response.status_code
     except requests.exceptions.RequestException as e:
         logger.error(f"Save Chat API Request failed. Error: {str(e)}")
@@ -321,7 +622,7 @@ def save_chat_message():
             logger.error(f"--> Response Body: {e.response.text}")
         return jsonify({"error": "Failed to save chat message."}), 502
 
-@app.route('/api/chat/history/<int:user_id>', methods=['GET'])
+@bp.route('/api/chat/history/<int:user_id>', methods=['GET'])
 def get_chat_history(user_id):
     auth_header = request.headers.get("Authorization")
     if not auth_header:
@@ -341,11 +642,90 @@ def get_chat_history(user_id):
         logger.error(f"Get Chat History API Error: {e}")
         return jsonify({"error": "Failed to fetch chat history."}), 502
 
-@app.route("/static/charts/<path:filename>")
+@bp.route('/api/metrics', methods=['GET'])
+def metrics():
+    from budget import get_budget_metrics
+    from db import get_db_metrics
+    from freshness import get_freshness_metrics
+    from incremental import get_incremental_metrics
+    from preview import get_preview_metrics
+    from batch import get_batch_metrics
+    from intent_router import get_fast_path_metrics
+    from query_guard import get_query_guard_metrics
+    from sql_parse import get_parameterization_metrics, get_parse_cache_metrics
+    from utils import get_model_usage_metrics
+    from value_index import get_value_index_metrics
+
+    return jsonify({
+        "agent_budget": get_budget_metrics(),
+        "fast_path": get_fast_path_metrics(),
+        "model_usage": get_model_usage_metrics(),
+        "query_guard": get_query_guard_metrics(),
+        "sql_parse_cache": get_parse_cache_metrics(),
+        "sql_parameterization": get_parameterization_metrics(),
+        "db": get_db_metrics(),
+        "export": get_export_metrics(),
+        "value_index": get_value_index_metrics(),
+        "coalescing": get_coalescing_metrics(),
+        "admission": get_admission_metrics(),
+        "health": get_health_metrics(),
+        "logging": get_logging_metrics(),
+        "cache": get_cache_metrics(),
+        "charts": get_chart_store_metrics(),
+        "freshness": get_freshness_metrics(),
+        "incremental": get_incremental_metrics(),
+        "preview": get_preview_metrics(),
+        "batch": get_batch_metrics(),
+        "digest": get_digest_metrics(),
+    }), 200
+
+@bp.route('/healthz', methods=['GET'])
+def healthz():
+    # Liveness only: the process is up and serving. Never touches a dependency.
+    return jsonify(liveness()), 200
+
+@bp.route('/readyz', methods=['GET'])
+def readyz():
+    # Readiness for the load balancer: 503 until this worker is warmed up and
+    # SQL Server, the schema cache and the agent graph are all usable.
+    body, ready = readiness()
+    return jsonify(body), 200 if ready else 503
+
+@bp.route("/static/charts/<path:filename>")
 def serve_chart(filename):
-    return send_from_directory("static/charts", filename)
+    # Any node can answer: local files are served with immutable caching and an
+    # ETag; object-store charts are a redirect to a pre-signed (or CDN) URL, so
+    # this app never streams their bytes.
+    if not is_chart_name(filename):
+        return jsonify({"error": "Chart not found"}), 404
+    etag = chart_etag(filename)
+    if request.if_none_match.contains(etag):
+        record_served("not_modified")
+        response = Response(status=304)
+    else:
+        store = get_chart_store()
+        target = store.redirect_url(filename)
+        if target:
+            record_served("redirected")
+            response = redirect(target, code=302)
+            # The redirect must not outlive the pre-signed URL it points to.
+            response.headers["Cache-Control"] = f"private, max-age={max(0, CHART_PRESIGN_SECONDS - 60)}"
+            return response
+        if not store.exists(filename):
+            return jsonify({"error": "Chart not found"}), 404
+        record_served("served")
+        response = send_from_directory(store.root, filename, mimetype="image/png", conditional=True, etag=False)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = CHART_CACHE_CONTROL
+    return response
 
 def extract_base_columns(sql_query):
+    from sql_parse import parse_sql
+
+    parsed = parse_sql(sql_query)
+    if parsed.ok:
+        return parsed.base_columns()
+
     all_bracketed = re.findall(r'\[([^\]]+)\]', sql_query, re.IGNORECASE)
     
     sql_keywords = {'SELECT', 'FROM', 'WHERE', 'TOP', 'ORDER BY', 'GROUP BY', 
@@ -366,15 +746,131 @@ def extract_base_columns(sql_query):
     
     return base_columns
 
-@app.errorhandler(Exception)
+@bp.app_errorhandler(Exception)
 def handle_exception(e):
     code = 500
     if isinstance(e, HTTPException): code = e.code
-    logger.error(f"Unhandled Exception: {traceback.format_exc()}")
+    logger.exception("Unhandled Exception")
     return jsonify({"error": "An internal server error occurred"}), code
 
+# Modules that are pure code plus compiled regexes / constant tables. They are
+# safe to import in a parent process and share with forked workers.
+PRELOAD_MODULES = (
+    "pandas", "sql_parse", "prompt_helper", "intent_router", "db", "columnar",
+    "utils", "tools_and_primary_agent", "agent_graph", "chart_generator",
+)
+
+
+def preload():
+    """
+    Import the heavy modules up front, e.g. in a pre-forking server's master
+    (gunicorn --preload) so workers share them copy-on-write.
+
+    Only code is loaded here. Everything holding sockets, threads or clients is
+    per worker and created lazily on first use, and dropped in a forked child
+    by os.register_at_fork hooks: the SQL Server engine pools (db), the tool
+    thread pool and the OpenAI chat model clients (utils), the value-index
+    refresh thread (value_index). Admission, coalescing and cache state is
+    also per process.
+    """
+    import importlib
+
+    for name in PRELOAD_MODULES:
+        importlib.import_module(name)
+
+
+_background_pid = None
+
+
+def _start_background():
+    """
+    On each process's first request (a forked worker's included): start the
+    freshness poller and, with WARMUP_ON_START, warm-up. Neither runs when the
+    app is only imported or created, e.g. in a pre-forking master.
+    """
+    global _background_pid
+    if _background_pid == os.getpid():
+        return
+    _background_pid = os.getpid()
+    start_poller()
+    if WARMUP_ON_START:
+        start_warmup()
+
+
+def _bind_request_id():
+    g.log_tokens = bind_request(new_request_id(request.headers.get("X-Request-Id")))
+
+
+def _add_request_id_header(response):
+    response.headers["X-Request-Id"] = request_id_var.get() or ""
+    return response
+
+
+def _unbind_request_id(exc=None):
+    tokens = g.pop("log_tokens", None)
+    if tokens:
+        unbind_request(tokens)
+
+
+def _digest_answer(question, run_sql, auth_header):
+    """
+    Answer a digest question through the /api/query pipeline, outside any
+    request. There is no host to link charts to yet, so a stored answer keeps
+    the chart's file name and query() builds the link for whoever asks.
+    """
+    body, status = _admitted_or_busy(question, auth_header, run_sql, chart_url_base="")
+    chart_url = body.get("chart_url") if status == 200 else None
+    if chart_url and "://" not in chart_url:
+        body = {**body, "chart_url": None, "chart_filename": chart_url}
+    return body, status
+
+
+def create_app(preload_modules=None):
+    """
+    Application factory, e.g. `waitress-serve --call app:create_app` or
+    `gunicorn "app:create_app()"`. Heavy imports and clients are deferred to
+    first use; pass preload_modules=True (or set APP_PRELOAD=1) to import them now.
+    Background threads (poller, warm-up) start with each process's first request.
+    """
+    load_env()
+    app = Flask(__name__, static_url_path='', static_folder='static')
+    app.json_provider_class.JSONEncoder = CustomJSONEncoder
+
+    os.environ["CORS_ENV"] = "prod"
+    configure_cors(app)
+    configure_logging()
+    app.before_request(_bind_request_id)
+    app.after_request(_add_request_id_header)
+    app.teardown_request(_unbind_request_id)
+    app.before_request(_start_background)
+    app.register_blueprint(bp)
+    set_answer_function(_digest_answer)
+
+    if preload_modules is None:
+        preload_modules = os.getenv("APP_PRELOAD", "0").lower() in {"1", "true", "yes"}
+    if preload_modules:
+        preload()
+    return app
+
+
+_app = None
+_app_lock = threading.Lock()
+
+
+def __getattr__(name):
+    # `app:app` (gunicorn, waitress, flask run) builds the app on first access,
+    # so a plain `import app` (scripts, a --preload master) creates nothing.
+    global _app
+    if name != "app":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _app_lock:
+        if _app is None:
+            _app = create_app()
+    return _app
+
+
 if __name__ == '__main__':
-    app.run(host="127.0.0.1", port=5000)
+    create_app().run(host="127.0.0.1", port=5000)
 
 
 # if __name__ == "__main__":  
@@ -0,0 +1,145 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+
+from config import load_env
+from single_flight import normalize_question
+
+load_env()
+
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "20"))
+# Questions of one batch answered at the same time; /api/query/batch admits each one on its own.
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+_metrics_lock = threading.Lock()
+_metrics = {
+    "batches": 0,
+    "questions": 0,
+    "duplicate_questions": 0,
+    "sql_executions": 0,
+    "sql_shared": 0,
+    "errors": 0,
+}
+
+
+def get_batch_metrics() -> dict:
+    with _metrics_lock:
+        return dict(_metrics)
+
+
+def _count(key: str, amount: int = 1) -> None:
+    with _metrics_lock:
+        _metrics[key] += amount
+
+
+def _reset_after_fork():
+    global _metrics_lock
+    _metrics_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def normalize_sql(sql: str) -> str:
+    return " ".join(sql.split()).rstrip(";").strip()
+
+
+class SharedSQL:
+    """
+    Runs each distinct statement of a batch once. Questions that end up with
+    the same SQL (even after the first run finished) get a copy of its result.
+    """
+
+    def __init__(self, runner):
+        self.runner = runner
+        self.executions = 0
+        self.shared = 0
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def run(self, sql: str):
+        key = normalize_sql(sql)
+        with self._lock:
+            future = self._results.get(key)
+            owner = future is None
+            if owner:
+                future = self._results[key] = Future()
+                self.executions += 1
+            else:
+                self.shared += 1
+        if owner:
+            try:
+                future.set_result(self.runner(sql))
+            except BaseException as e:
+                future.set_exception(e)
+        # Every question gets its own frame; charts and serialization may touch it.
+        return future.result().copy()
+
+
+class BatchRun:
+    """
+    Answers a list of questions concurrently under one pinned schema snapshot
+    and one SharedSQL. Iterating yields (indices, (body, status)) as each
+    distinct question completes; `indices` are the positions it was asked at.
+    `answer_one(question, run_sql)` answers a single question.
+    """
+
+    def __init__(self, questions, answer_one, run_sql, concurrency: int = None):
+        self.questions = list(questions)
+        self.answer_one = answer_one
+        self.sql = SharedSQL(run_sql)
+        self.concurrency = concurrency or BATCH_CONCURRENCY
+        self.groups = OrderedDict()
+        for i, question in enumerate(self.questions):
+            self.groups.setdefault(normalize_question(question), []).append(i)
+        self.started_at = None
+        self.finished_at = None
+
+    def __iter__(self):
+        from tools_and_primary_agent import pinned_schema
+
+        _count("batches")
+        _count("questions", len(self.questions))
+        _count("duplicate_questions", len(self.questions) - len(self.groups))
+        self.started_at = time.monotonic()
+        workers = max(1, min(self.concurrency, len(self.groups)))
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch")
+        try:
+            with pinned_schema():
+                futures = {
+                    # Each task runs in its own copy of this context: request ID and pinned schema.
+                    executor.submit(contextvars.copy_context().run, self.answer_one, self.questions[indices[0]], self.sql.run): indices
+                    for indices in self.groups.values()
+                }
+                for future in as_completed(futures):
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        _count("errors")
+                        logger.exception("Batch question failed")
+                        result = {"error": f"An internal server error occurred: {e}"}, 500
+                    yield futures[future], result
+        finally:
+            # A client that disconnects stops the questions that haven't started.
+            executor.shutdown(wait=False, cancel_futures=True)
+            self.finished_at = time.monotonic()
+            _count("sql_executions", self.sql.executions)
+            _count("sql_shared", self.sql.shared)
+
+    def summary(self) -> dict:
+        end = self.finished_at or time.monotonic()
+        return {
+            "done": True,
+            "questions": len(self.questions),
+            "distinct_questions": len(self.groups),
+            "sql_executions": self.sql.executions,
+            "sql_shared": self.sql.shared,
+            "elapsed_ms": round((end - (self.started_at or end)) * 1000),
+        }
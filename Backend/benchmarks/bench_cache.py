@@ -0,0 +1,141 @@
+"""
+Shared cache backends: round trip of a query-result DataFrame (Arrow IPC)
+and a small pickled value through each backend, plus the serialization cost
+compared with pickling the DataFrame.
+
+The Redis backend runs against a minimal in-process RESP stand-in (GET, SET
+PX, DEL, INCR) unless CACHE_REDIS_URL points at a real server.
+
+    python benchmarks/bench_cache.py [rows]
+"""
+import os
+import pickle
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+
+import cache
+
+
+class _RespStandIn(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _RespHandler)
+        self.data = {}
+        self.lock = threading.Lock()
+
+
+class _RespHandler(socketserver.StreamRequestHandler):
+    def _command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            size = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(size + 2)[:-2])
+        return args
+
+    def handle(self):
+        store, lock = self.server.data, self.server.lock
+        while True:
+            args = self._command()
+            if args is None:
+                return
+            name = args[0].upper()
+            with lock:
+                if name == b"GET":
+                    value, expires_at = store.get(args[1], (None, None))
+                    if value is not None and expires_at and expires_at <= time.time():
+                        value = store.pop(args[1])[0] and None
+                    reply = b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+                elif name == b"SET":
+                    ttl = int(args[4]) / 1000 if len(args) > 4 and args[3].upper() == b"PX" else None
+                    store[args[1]] = (args[2], time.time() + ttl if ttl else None)
+                    reply = b"+OK\r\n"
+                elif name == b"DEL":
+                    reply = b":%d\r\n" % (store.pop(args[1], None) is not None)
+                elif name == b"INCR":
+                    value = int(store.get(args[1], (b"0", None))[0]) + 1
+                    store[args[1]] = (str(value).encode(), None)
+                    reply = b":%d\r\n" % value
+                else:
+                    reply = b"-ERR unknown command\r\n"
+            self.wfile.write(reply)
+
+
+def sample_frame(rows: int) -> pd.DataFrame:
+    rng = np.random.default_rng(7)
+    return pd.DataFrame({
+        "From_Date": pd.date_range("2023-01-01", periods=rows, freq="h"),
+        "Region_Name": rng.choice(["North", "South", "East", "West"], rows),
+        "Profitcenter_Name": rng.choice([f"Store {i}" for i in range(200)], rows),
+        "Net_Sales": rng.random(rows) * 1000,
+        "Units": rng.integers(0, 50, rows),
+    })
+
+
+def timed(fn, repeat: int = 20) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main(rows: int = 20_000) -> None:
+    df = sample_frame(rows)
+    small = {"text": "schema " * 500, "built_at": time.time()}
+
+    # pandas < 3 (the pinned version) keeps strings as Python objects; pandas 3 stores them in Arrow already.
+    object_strings = df.astype({"Region_Name": object, "Profitcenter_Name": object})
+    for label, frame in (("native strings", df), ("object strings", object_strings)):
+        arrow_bytes = cache.dumps(frame)
+        pickle_bytes = pickle.dumps(frame, protocol=pickle.HIGHEST_PROTOCOL)
+        print(f"{rows} rows, {label}: Arrow IPC ({cache.CACHE_DATAFRAME_COMPRESSION}) {len(arrow_bytes) / 1024:.0f} KiB, pickle {len(pickle_bytes) / 1024:.0f} KiB")
+        print(f"  dumps  arrow {timed(lambda: cache.dumps(frame)):6.2f} ms   pickle {timed(lambda: pickle.dumps(frame, protocol=5)):6.2f} ms")
+        print(f"  loads  arrow {timed(lambda: cache.loads(arrow_bytes)):6.2f} ms   pickle {timed(lambda: pickle.loads(pickle_bytes)):6.2f} ms")
+
+    server = None
+    redis_url = os.getenv("CACHE_REDIS_URL")
+    if not redis_url:
+        server = _RespStandIn()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        redis_url = "redis://127.0.0.1:%d/0" % server.server_address[1]
+
+    backends = {
+        "memory": cache.MemoryBackend(),
+        "sqlite": cache.SQLiteBackend(os.path.join(tempfile.mkdtemp(), "cache.sqlite3")),
+        "redis": cache.RedisBackend(redis_url),
+    }
+    print(f"\n{'backend':8s} {'df set':>9s} {'df get':>9s} {'small get':>10s}")
+    for name, backend in backends.items():
+        cache.set_backend(backend)
+        results = cache.get_cache(f"bench_{name}", 60)
+        results.set("df", df)
+        assert results.get("df").shape == df.shape
+        results.set("small", small)
+        set_ms = timed(lambda: results.set("df", df))
+        get_ms = timed(lambda: results.get("df"))
+        small_ms = timed(lambda: results.get("small"), repeat=200)
+        results.invalidate()
+        assert results.get("df") is None
+        print(f"{name:8s} {set_ms:7.2f}ms {get_ms:7.2f}ms {small_ms * 1000:8.0f}us")
+
+    if server:
+        server.shutdown()
+    print("\n", cache.get_cache_metrics())
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20_000)
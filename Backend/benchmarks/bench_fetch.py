@@ -0,0 +1,104 @@
+"""
+Benchmark: row-object fetch (fetchall + DataFrame.from_records) vs. the
+columnar fetchmany -> Arrow -> pandas path in db.fetch_dataframe, on a
+synthetic result shaped like ConsolidateData_PBI answers. Rows are built up
+front, so the driver's own per-row allocation isn't part of either timing.
+
+    python benchmarks/bench_fetch.py [rows]
+"""
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+from columnar import arrow_to_pandas, fetch_arrow_table
+
+DESCRIPTION = [
+    ("Store_Name", str, None, 100, 100, 0, True),
+    ("Region_Name", str, None, 50, 50, 0, True),
+    ("From_Date", date, None, 10, 10, 0, True),
+    ("Traffic_Count", int, None, 10, 10, 0, True),
+    ("Net_Sales", Decimal, None, 18, 18, 2, True),
+    ("Gross_Margin", Decimal, None, 18, 18, 4, True),
+]
+
+
+class FakeCursor:
+    """Hands out pre-built rows the way pyodbc does (one tuple per row, Decimal cells)."""
+
+    description = DESCRIPTION
+
+    def __init__(self, rows):
+        self._rows = rows
+        self._pos = 0
+
+    def fetchall(self):
+        rows, self._pos = self._rows[self._pos:], len(self._rows)
+        return rows
+
+    def fetchmany(self, size):
+        rows = self._rows[self._pos:self._pos + size]
+        self._pos += len(rows)
+        return rows
+
+
+def make_rows(count: int):
+    rng = random.Random(7)
+    start = date(2024, 1, 1)
+    stores = [f"Store {i:03d}" for i in range(120)]
+    regions = ["East", "West", "North", "South", "Central"]
+    return [
+        (
+            rng.choice(stores),
+            rng.choice(regions),
+            start + timedelta(days=i % 540),
+            rng.randint(0, 900),
+            Decimal(rng.randint(0, 5_000_000)) / 100,
+            Decimal(rng.randint(0, 10_000)) / 10_000,
+        )
+        for i in range(count)
+    ]
+
+
+def legacy(cur):
+    rows = cur.fetchall()
+    return pd.DataFrame.from_records(rows, columns=[c[0] for c in cur.description])
+
+
+def columnar(cur):
+    return arrow_to_pandas(fetch_arrow_table(cur))
+
+
+def measure(fn, rows, repeat=3):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        df = fn(FakeCursor(rows))
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    # /api/query serializes every answer frame; object-dtype Decimal columns are the slow part.
+    started = time.perf_counter()
+    df.to_json(orient="records", date_format="iso")
+    to_json = time.perf_counter() - started
+    return best, to_json, df.memory_usage(deep=True).sum()
+
+
+def main(count: int = 100_000) -> None:
+    rows = make_rows(count)
+    results = {name: measure(fn, rows) for name, fn in (("fetchall+from_records", legacy), ("columnar", columnar))}
+    print(f"{count:,} rows")
+    for name, (seconds, to_json, frame) in results.items():
+        print(f"{name:22s} fetch {seconds * 1000:7.1f} ms   to_json {to_json * 1000:7.1f} ms   frame {frame / 2**20:6.1f} MiB")
+    (l_s, l_json, l_frame), (c_s, c_json, c_frame) = results.values()
+    print(f"fetch {l_s / c_s:.1f}x, fetch+to_json {(l_s + l_json) / (c_s + c_json):.1f}x, frame {l_frame / c_frame:.1f}x smaller")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
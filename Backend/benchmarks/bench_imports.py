@@ -0,0 +1,49 @@
+"""
+Import-time benchmark for worker startup: wall time and peak RSS of a fresh
+interpreter that imports the app lazily (the default) vs. one that preloads
+every heavy module (what importing app.py used to cost).
+
+    python benchmarks/bench_imports.py [runs]
+"""
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import resource, time
+started = time.perf_counter()
+{body}
+elapsed = time.perf_counter() - started
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+SCENARIOS = {
+    "flask only": "import flask, flask_cors, requests, dotenv",
+    "create_app (lazy)": "import app; app.create_app()",
+    "create_app + preload": "import app; app.create_app(preload_modules=True)",
+}
+
+
+def run(body: str):
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE.format(body=body)],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+        # Import cost only; the background warm-up would otherwise race the measurement.
+        env={**os.environ, "WARMUP_ON_START": "0"},
+    ).stdout.strip().splitlines()[-1]
+    elapsed, rss_kb = out.split()
+    return float(elapsed), int(rss_kb) / 1024
+
+
+def main(runs: int = 3) -> None:
+    for name, body in SCENARIOS.items():
+        samples = [run(body) for _ in range(runs)]
+        best = min(s[0] for s in samples)
+        rss = min(s[1] for s in samples)
+        print(f"{name:22s} {best * 1000:8.0f} ms   peak RSS {rss:6.0f} MiB")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 3)
@@ -0,0 +1,69 @@
+"""
+Caller-side cost of one log call: the old synchronous RotatingFileHandler vs.
+the queue-based pipeline in logging_setup (enqueue on the caller, format,
+redact and write on the listener thread).
+
+    python benchmarks/bench_logging.py [records] [threads]
+"""
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SQL = "SELECT TOP 100 [Region_Name], SUM([Net_Sales]) FROM [dbo].[ConsolidateData_PBI] WHERE [From_Date] >= '2024-01-01' GROUP BY [Region_Name]"
+
+
+def hammer(logger, records: int, threads: int) -> float:
+    """Per-call latency in microseconds, measured on the calling threads only."""
+    per_thread = records // threads
+    elapsed = []
+
+    def work():
+        started = time.perf_counter()
+        for i in range(per_thread):
+            logger.info("Executing SQL %d", i, extra={"sql": SQL})
+        elapsed.append(time.perf_counter() - started)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return sum(elapsed) / (per_thread * threads) * 1e6
+
+
+def main(records: int = 50_000, threads: int = 8) -> None:
+    tmp = tempfile.mkdtemp()
+
+    sync_logger = logging.getLogger("bench.sync")
+    sync_logger.propagate = False
+    handler = RotatingFileHandler(os.path.join(tmp, "sync.log"), maxBytes=1_000_000, backupCount=3)
+    handler.setFormatter(logging.Formatter("[%(asctime)s] %(levelname)s: %(message)s"))
+    sync_logger.addHandler(handler)
+    sync_logger.setLevel(logging.INFO)
+    sync_us = hammer(sync_logger, records, threads)
+
+    os.environ["LOG_FILE_PATH"] = os.path.join(tmp, "queued.log")
+    os.environ["LOG_QUEUE_SIZE"] = str(records + 1)
+    import logging_setup
+
+    logging_setup.configure_logging()
+    queued_us = hammer(logging.getLogger("bench.queued"), records, threads)
+    drained = time.perf_counter()
+    logging_setup.shutdown_logging()
+    drain_ms = (time.perf_counter() - drained) * 1000
+
+    print(f"{records} records, {threads} threads")
+    print(f"sync RotatingFileHandler (1 MB)  {sync_us:7.1f} us/call on the caller")
+    print(f"queued JSON pipeline             {queued_us:7.1f} us/call on the caller  (+{drain_ms:.0f} ms to drain)")
+    print(logging_setup.get_logging_metrics())
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    main(*args)
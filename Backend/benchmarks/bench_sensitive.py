@@ -0,0 +1,52 @@
+"""
+Micro-benchmark: legacy per-keyword re.search loop vs. the precompiled
+alternation in prompt_helper.match_sensitive_rule.
+
+    python benchmarks/bench_sensitive.py
+"""
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prompt_helper import SENSITIVE_KEYWORDS, SENSITIVE_PATTERNS, match_sensitive_rule
+
+LEGACY_PATTERNS = [re.compile(p, re.IGNORECASE) for p in SENSITIVE_PATTERNS]
+
+QUESTIONS = [
+    "What are my total sales for last month?",
+    "Top 5 stores by sales this year compared with last year",
+    "Which region had the highest traffic count in June 2025?",
+    "show me the average ticket sale and gross margin for Thomasville by week",
+    "what tables do you have",
+    "list all columns",
+]
+
+
+def legacy_is_query_sensitive(question: str) -> bool:
+    lower_question = question.lower()
+    for keyword in SENSITIVE_KEYWORDS:
+        if re.search(r'\b' + re.escape(keyword) + r'\b', lower_question):
+            return True
+    for pattern in LEGACY_PATTERNS:
+        if pattern.search(lower_question):
+            return True
+    return False
+
+
+def main(number: int = 20000) -> None:
+    for q in QUESTIONS:
+        assert legacy_is_query_sensitive(q) == (match_sensitive_rule(q) is not None), q
+
+    legacy = timeit.timeit(lambda: [legacy_is_query_sensitive(q) for q in QUESTIONS], number=number)
+    compiled = timeit.timeit(lambda: [match_sensitive_rule(q) for q in QUESTIONS], number=number)
+    calls = number * len(QUESTIONS)
+    print(f"legacy loop:        {legacy / calls * 1e6:8.2f} us/question")
+    print(f"precompiled regex:  {compiled / calls * 1e6:8.2f} us/question")
+    print(f"speedup:            {legacy / compiled:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
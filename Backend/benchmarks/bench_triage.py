@@ -0,0 +1,130 @@
+"""
+Offline harness for per-step model selection: drives triage, the routing
+turn and SQL synthesis through agent_graph with scripted fake chat models
+(set_chat_model_factory), checks which step and model tier each call went
+to, and reports what the triage round trip adds per question.
+
+Nothing talks to OpenAI or SQL Server: the schema lookup and query tool are
+replaced with local stand-ins. FAKE_LATENCY_MS simulates a model round trip.
+
+    python benchmarks/bench_triage.py [fake_latency_ms]
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "offline")
+
+import pandas as pd
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+import agent_graph
+import tools_and_primary_agent as agent_tools
+from utils import get_model_usage_metrics, model_for_step, set_chat_model_factory
+
+SCHEMA = "Table ConsolidateData_PBI: [Sales] decimal, [Profitcenter_Name] varchar, [From_Date] date"
+SQL = "SELECT TOP 1 [Profitcenter_Name] FROM [dbo].[ConsolidateData_PBI] GROUP BY [Profitcenter_Name] ORDER BY SUM([Sales]) DESC"
+CASUAL = {"hi there!", "thanks, that's all"}
+CALLS = []  # (step, model) of every fake model call
+
+
+class ScriptedChatModel(BaseChatModel):
+    """Answers like the real model would for its step, and records every call."""
+
+    step: str
+    model: str
+    latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def _reply(self, messages) -> AIMessage:
+        question = next(m.content for m in messages if m.type == "human")
+        if self.step == "classify":
+            return AIMessage("Hello! How can I help with your store data?" if question in CASUAL else "DATA")
+        if not any(isinstance(m, ToolMessage) for m in messages):
+            if self.step == "route":
+                return AIMessage("", tool_calls=[{"name": "get_table_info", "args": {}, "id": "route-1"}])
+            return AIMessage("", tool_calls=[{"name": "run_sql_query", "args": {"query": SQL}, "id": "sql-1"}])
+        last = [m for m in messages if m.type != "system"][-1]  # the prompt ends with the current time
+        if isinstance(last, ToolMessage) and last.name == "get_table_info":
+            return AIMessage("", tool_calls=[{"name": "run_sql_query", "args": {"query": SQL}, "id": "sql-2"}])
+        return AIMessage("Store 7 had the highest sales.")
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        message = self._reply(messages)
+        tokens = sum(len(str(m.content)) for m in messages) // 4
+        message.usage_metadata = {"input_tokens": tokens, "output_tokens": 10, "total_tokens": tokens + 10}
+        if message.tool_calls:
+            # OpenAI-style raw tool calls, which get_sql_query_from_tool_calls reads.
+            message.additional_kwargs["tool_calls"] = [
+                {"id": tc["id"], "type": "function", "function": {"name": tc["name"], "arguments": json.dumps(tc["args"])}}
+                for tc in message.tool_calls
+            ]
+        CALLS.append((self.step, self.model))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+
+def install(latency: float) -> None:
+    set_chat_model_factory(lambda step, model: ScriptedChatModel(step=step, model=model, latency=latency))
+
+
+def schema_down():
+    raise ConnectionError("SQL Server unreachable (offline harness)")
+
+
+def run(question: str) -> tuple:
+    del CALLS[:]
+    started = time.perf_counter()
+    sql, text = agent_graph.get_sql_and_human_readable_output(question)
+    return sql, text, [step for step, _ in CALLS], (time.perf_counter() - started) * 1000
+
+
+def main(latency_ms: float = 0.0) -> None:
+    install(latency_ms / 1000)
+    agent_tools.run_cached_sql_query = lambda query: pd.DataFrame({"Profitcenter_Name": ["Store 7"]})
+    agent_graph.route_question = lambda question: None  # exercise the model steps, not the SQL templates
+
+    # Schema unavailable: the fast tier takes the routing turn and looks the schema up.
+    agent_tools.describe_tables = schema_down
+    assert agent_tools.get_routing_agent() is not None
+    sql, text, steps, _ = run("Which store sold the most last week?")
+    assert steps == ["classify", "route", "sql", "sql"], steps
+    assert sql == SQL and "Store 7" in text, (sql, text)
+
+    # Schema in the prompt: no routing turn; SQL goes straight to the strong tier.
+    agent_tools.describe_tables = lambda: SCHEMA
+    agent_tools.get_schema_context(refresh=True)
+    assert agent_tools.get_routing_agent() is None
+    sql, text, steps, with_triage = run("Which store sold the most last week?")
+    assert steps == ["classify", "sql", "sql"], steps
+    assert sql == SQL
+
+    # Casual messages end at triage.
+    for question in CASUAL:
+        sql, text, steps, _ = run(question)
+        assert steps == ["classify"] and sql == "" and text.startswith("Hello"), (steps, sql, text)
+
+    agent_graph.TRIAGE_ENABLED = False
+    _, _, steps, without_triage = run("Which store sold the most last week?")
+    assert steps == ["sql", "sql"], steps
+    agent_graph.TRIAGE_ENABLED = True
+
+    for step in ("classify", "route", "sql"):
+        print(f"{step:9s} -> {model_for_step(step)}")
+    print(f"\ndata question with triage    {with_triage:8.1f} ms")
+    print(f"data question without triage {without_triage:8.1f} ms  (triage adds one fast-model round trip)")
+    print("\n", get_model_usage_metrics())
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 50.0)
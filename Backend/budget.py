@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+BUDGET_LIMITS = ("max_llm_turns", "max_tool_calls", "max_total_tokens", "deadline")
+
+_metrics_lock = threading.Lock()
+_metrics = {
+    "requests": 0,
+    "exhausted_requests": 0,
+    "exhausted_by_limit": {limit: 0 for limit in BUDGET_LIMITS},
+    "llm_turns": 0,
+    "tool_calls": 0,
+    "total_tokens": 0,
+}
+
+
+def get_budget_metrics() -> dict:
+    with _metrics_lock:
+        return {
+            **_metrics,
+            "exhausted_by_limit": dict(_metrics["exhausted_by_limit"]),
+        }
+
+
+class AgentBudget:
+    """
+    Per-request limits for one agent run: LLM turns, tool calls, total tokens
+    and a wall-clock deadline. Defaults come from AGENT_MAX_LLM_TURNS,
+    AGENT_MAX_TOOL_CALLS, AGENT_MAX_TOTAL_TOKENS and AGENT_DEADLINE_SECONDS.
+    """
+
+    def __init__(self, max_llm_turns=None, max_tool_calls=None, max_total_tokens=None, deadline_seconds=None):
+        self.max_llm_turns = max_llm_turns if max_llm_turns is not None else _env_int("AGENT_MAX_LLM_TURNS", 8)
+        self.max_tool_calls = max_tool_calls if max_tool_calls is not None else _env_int("AGENT_MAX_TOOL_CALLS", 12)
+        self.max_total_tokens = (
+            max_total_tokens if max_total_tokens is not None else _env_int("AGENT_MAX_TOTAL_TOKENS", 60000)
+        )
+        self.deadline_seconds = (
+            deadline_seconds if deadline_seconds is not None else _env_float("AGENT_DEADLINE_SECONDS", 90.0)
+        )
+
+        self.started_at = time.monotonic()
+        self.llm_turns = 0
+        self.tool_calls = 0
+        self.total_tokens = 0
+        self.usage_by_step = {}
+        self.exhausted_reason = None
+
+        with _metrics_lock:
+            _metrics["requests"] += 1
+
+    @property
+    def recursion_limit(self) -> int:
+        # Every agent turn is at most two graph steps (assistant + tools).
+        return 2 * self.max_llm_turns + 4
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def remaining_seconds(self) -> float:
+        return max(0.0, self.deadline_seconds - self.elapsed())
+
+    def check(self):
+        """Return the name of the first exhausted limit, or None while within budget."""
+        if self.exhausted_reason:
+            return self.exhausted_reason
+        if self.llm_turns >= self.max_llm_turns:
+            return self._exhaust("max_llm_turns")
+        if self.tool_calls >= self.max_tool_calls:
+            return self._exhaust("max_tool_calls")
+        if self.total_tokens >= self.max_total_tokens:
+            return self._exhaust("max_total_tokens")
+        if self.remaining_seconds() <= 0:
+            return self._exhaust("deadline")
+        return None
+
+    def record_llm_turn(self, message, step: str = None, model: str = None) -> None:
+        usage = getattr(message, "usage_metadata", None) or {}
+        tokens = usage.get("total_tokens") or 0
+        self.llm_turns += 1
+        self.total_tokens += tokens
+        if step:
+            entry = self.usage_by_step.setdefault(step, {"model": model, "calls": 0, "total_tokens": 0})
+            entry["calls"] += 1
+            entry["total_tokens"] += tokens
+        with _metrics_lock:
+            _metrics["llm_turns"] += 1
+            _metrics["total_tokens"] += tokens
+
+    def charge_tool_calls(self, count: int) -> bool:
+        """Reserve `count` tool calls; returns False (and marks exhaustion) if that would exceed the limit."""
+        if self.tool_calls + count > self.max_tool_calls:
+            self._exhaust("max_tool_calls")
+            return False
+        self.tool_calls += count
+        with _metrics_lock:
+            _metrics["tool_calls"] += count
+        return True
+
+    def exhaust(self, reason: str) -> str:
+        return self._exhaust(reason)
+
+    def _exhaust(self, reason: str) -> str:
+        if not self.exhausted_reason:
+            self.exhausted_reason = reason
+            with _metrics_lock:
+                _metrics["exhausted_requests"] += 1
+                _metrics["exhausted_by_limit"][reason] = _metrics["exhausted_by_limit"].get(reason, 0) + 1
+        return self.exhausted_reason
+
+    def summary(self) -> dict:
+        return {
+            "llm_turns": self.llm_turns,
+            "tool_calls": self.tool_calls,
+            "total_tokens": self.total_tokens,
+            "usage_by_step": self.usage_by_step,
+            "elapsed_seconds": round(self.elapsed(), 3),
+            "exhausted_reason": self.exhausted_reason,
+        }
+
+
+def get_budget(config) -> "AgentBudget | None":
+    if not config:
+        return None
+    return (config.get("configurable") or {}).get("budget")
@@ -0,0 +1,533 @@
+import hashlib
+import logging
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+
+from config import load_env
+
+load_env()
+
+logger = logging.getLogger(__name__)
+
+# memory - in-process LRU (one worker only)
+# sqlite - a SQLite file shared by every worker on the host
+# redis  - anything speaking the Redis protocol (Redis, Valkey, KeyDB, a local stand-in), shared across hosts
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+CACHE_KEY_PREFIX = os.getenv("CACHE_KEY_PREFIX", "furniture-agent")
+CACHE_MEMORY_MAX_ENTRIES = int(os.getenv("CACHE_MEMORY_MAX_ENTRIES", "4096"))
+CACHE_MEMORY_MAX_BYTES = int(os.getenv("CACHE_MEMORY_MAX_BYTES", str(256 * 1024 * 1024)))
+CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", "cache/shared_cache.sqlite3")
+CACHE_SQLITE_MAX_ENTRIES = int(os.getenv("CACHE_SQLITE_MAX_ENTRIES", "20000"))
+CACHE_SQLITE_TIMEOUT_SECONDS = float(os.getenv("CACHE_SQLITE_TIMEOUT_SECONDS", "2"))
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://127.0.0.1:6379/0")
+CACHE_REDIS_TIMEOUT_SECONDS = float(os.getenv("CACHE_REDIS_TIMEOUT_SECONDS", "0.5"))
+# After a backend error, skip the shared cache for this long instead of paying a timeout per call.
+CACHE_ERROR_BACKOFF_SECONDS = float(os.getenv("CACHE_ERROR_BACKOFF_SECONDS", "5"))
+# Values bigger than this are not cached at all.
+CACHE_MAX_VALUE_BYTES = int(os.getenv("CACHE_MAX_VALUE_BYTES", str(32 * 1024 * 1024)))
+# Arrow IPC buffer compression for DataFrames: zstd | lz4 | none. Small frames are never compressed.
+CACHE_DATAFRAME_COMPRESSION = os.getenv("CACHE_DATAFRAME_COMPRESSION", "lz4").lower()
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", str(256 * 1024)))
+# How long a worker trusts its copy of a namespace version before re-reading it.
+CACHE_VERSION_CHECK_SECONDS = float(os.getenv("CACHE_VERSION_CHECK_SECONDS", "2"))
+
+# Serialized values start with a one-byte tag. Values come from our own
+# workers; like any pickle-based cache, the store must not be writable by others.
+TAG_PICKLE = b"P"
+TAG_ARROW = b"A"
+
+_metrics_lock = threading.Lock()
+_metrics = {"errors": 0, "skipped_too_large": 0, "skipped_stale": 0, "namespaces": {}}
+
+
+def _count(namespace: str, key: str, amount=1) -> None:
+    with _metrics_lock:
+        counters = _metrics["namespaces"].setdefault(
+            namespace, {"hits": 0, "misses": 0, "sets": 0, "bytes_written": 0, "invalidations": 0}
+        )
+        counters[key] += amount
+
+
+def get_cache_metrics() -> dict:
+    with _metrics_lock:
+        namespaces = {name: dict(c) for name, c in _metrics["namespaces"].items()}
+        metrics = {key: _metrics[key] for key in ("errors", "skipped_too_large", "skipped_stale")}
+    for counters in namespaces.values():
+        lookups = counters["hits"] + counters["misses"]
+        counters["hit_rate"] = round(counters["hits"] / lookups, 3) if lookups else 0.0
+    metrics["backend"] = get_backend().name
+    metrics["namespaces"] = namespaces
+    return metrics
+
+
+# ---------------------------------------------------------------- serialization
+
+def _is_dataframe(value) -> bool:
+    return type(value).__name__ == "DataFrame" and type(value).__module__.startswith("pandas")
+
+
+def dumps(value) -> bytes:
+    """DataFrames go through Arrow IPC (typed, columnar, compressed); everything else through pickle."""
+    if _is_dataframe(value):
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(value, preserve_index=None)
+        codec = CACHE_DATAFRAME_COMPRESSION if CACHE_DATAFRAME_COMPRESSION in {"zstd", "lz4"} else None
+        if codec and (table.nbytes < CACHE_COMPRESS_MIN_BYTES or not pa.Codec.is_available(codec)):
+            codec = None
+        sink = pa.BufferOutputStream()
+        sink.write(TAG_ARROW)
+        with pa.ipc.new_stream(sink, table.schema, options=pa.ipc.IpcWriteOptions(compression=codec)) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+    return TAG_PICKLE + pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def loads(data: bytes):
+    tag, body = data[:1], memoryview(data)[1:]
+    if tag == TAG_ARROW:
+        import pyarrow as pa
+
+        return pa.ipc.open_stream(body).read_all().to_pandas()
+    if tag == TAG_PICKLE:
+        return pickle.loads(body)
+    raise ValueError(f"Unknown cache payload tag {tag!r}")
+
+
+# ---------------------------------------------------------------- backends
+
+class MemoryBackend:
+    """In-process LRU bounded by entry count and total bytes."""
+
+    name = "memory"
+
+    def __init__(self, max_entries=CACHE_MEMORY_MAX_ENTRIES, max_bytes=CACHE_MEMORY_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _pop(self, key) -> None:
+        value, _ = self._data.pop(key)
+        self._bytes -= len(value)
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                self._pop(key)
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl=None) -> None:
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+            self._bytes += len(value)
+            while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                self._pop(next(iter(self._data)))
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            current = int(self._data[key][0]) if key in self._data else 0
+            value = str(current + 1).encode()
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = (value, None)
+            self._bytes += len(value)
+            return current + 1
+
+
+class SQLiteBackend:
+    """
+    A SQLite file in WAL mode shared by every worker process on the host.
+    Each thread (per process) keeps its own connection.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path=CACHE_SQLITE_PATH, max_entries=CACHE_SQLITE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_expires_at ON cache (expires_at)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=CACHE_SQLITE_TIMEOUT_SECONDS, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str):
+        row = self._connect().execute(
+            "SELECT value FROM cache WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())
+        ).fetchone()
+        return bytes(row[0]) if row else None
+
+    def set(self, key: str, value: bytes, ttl=None) -> None:
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, sqlite3.Binary(value), time.time() + ttl if ttl else None),
+        )
+        self._writes += 1
+        if self._writes % 200 == 0:
+            self._purge(conn)
+
+    def _purge(self, conn) -> None:
+        conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+        conn.execute(
+            "DELETE FROM cache WHERE expires_at IS NOT NULL AND key IN ("
+            "SELECT key FROM cache WHERE expires_at IS NOT NULL ORDER BY expires_at "
+            "LIMIT MAX(0, (SELECT COUNT(*) FROM cache) - ?))",
+            (self.max_entries,),
+        )
+
+    def delete(self, key: str) -> None:
+        self._connect().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def incr(self, key: str) -> int:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+            value = int(bytes(row[0])) + 1 if row else 1
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, NULL)", (key, str(value).encode())
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+
+class RespError(Exception):
+    pass
+
+
+class RedisBackend:
+    """
+    Minimal client for the Redis protocol (RESP2): GET, SET .. PX, DEL, INCR.
+    One socket per thread (per process); no dependency on redis-py.
+    """
+
+    name = "redis"
+
+    def __init__(self, url=CACHE_REDIS_URL, timeout=CACHE_REDIS_TIMEOUT_SECONDS):
+        parsed = urllib.parse.urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = urllib.parse.unquote(parsed.password) if parsed.password else None
+        self.username = urllib.parse.unquote(parsed.username) if parsed.username else None
+        self.db = int(parsed.path.strip("/") or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = self._local.conn = (sock, sock.makefile("rb"))
+            self._local.pid = os.getpid()
+            if self.password:
+                self._roundtrip(conn, *(["AUTH", self.username] if self.username else ["AUTH"]), self.password)
+            if self.db:
+                self._roundtrip(conn, "SELECT", str(self.db))
+        return conn
+
+    def _close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn:
+            try:
+                conn[1].close()
+                conn[0].close()
+            except OSError:
+                pass
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(out)
+
+    def _read(self, reader):
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("connection closed by the cache server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest
+        if kind == b"-":
+            raise RespError(rest.decode(errors="replace"))
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            size = int(rest)
+            if size < 0:
+                return None
+            data = reader.read(size + 2)
+            return data[:-2]
+        if kind == b"*":
+            size = int(rest)
+            return None if size < 0 else [self._read(reader) for _ in range(size)]
+        raise RespError(f"unexpected reply {line[:20]!r}")
+
+    def _roundtrip(self, conn, *args):
+        sock, reader = conn
+        sock.sendall(self._encode(args))
+        return self._read(reader)
+
+    def execute(self, *args):
+        # One retry on a stale pooled socket (server restart, idle timeout).
+        for attempt in (0, 1):
+            try:
+                return self._roundtrip(self._connection(), *args)
+            except (OSError, ConnectionError):
+                self._close()
+                if attempt:
+                    raise
+
+    def get(self, key: str):
+        return self.execute("GET", key)
+
+    def set(self, key: str, value: bytes, ttl=None) -> None:
+        if ttl:
+            self.execute("SET", key, value, "PX", int(ttl * 1000))
+        else:
+            self.execute("SET", key, value)
+
+    def delete(self, key: str) -> None:
+        self.execute("DEL", key)
+
+    def incr(self, key: str) -> int:
+        return self.execute("INCR", key)
+
+
+BACKENDS = {"memory": MemoryBackend, "sqlite": SQLiteBackend, "redis": RedisBackend}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            factory = BACKENDS.get(CACHE_BACKEND)
+            if factory is None:
+                logger.warning("Unknown CACHE_BACKEND %r, using the in-process cache.", CACHE_BACKEND)
+                factory = MemoryBackend
+            try:
+                _backend = factory()
+            except Exception as e:
+                logger.warning("Cache backend %s unavailable, using the in-process cache: %s", CACHE_BACKEND, e)
+                _backend = MemoryBackend()
+        return _backend
+
+
+def set_backend(backend) -> None:
+    """Swap the backend, e.g. a RedisBackend pointed at a local stand-in."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+    with _caches_lock:
+        for cache in _caches.values():
+            cache._version_checked_at = 0.0
+
+
+def _reset_after_fork():
+    # Sockets and SQLite connections are already per process (pid-checked);
+    # only locks another thread may have held at fork time need replacing.
+    global _backend_lock, _caches_lock, _metrics_lock
+    _backend_lock = threading.Lock()
+    _caches_lock = threading.Lock()
+    _metrics_lock = threading.Lock()
+    if isinstance(_backend, MemoryBackend):
+        _backend._lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+# ---------------------------------------------------------------- namespaces
+
+class Cache:
+    """
+    A namespace in the shared cache with its own default TTL. Keys are hashed,
+    so any string works. invalidate() bumps the namespace version, which
+    orphans every entry at once on every worker (they then age out by TTL).
+    Backend errors never propagate: they count as misses.
+    """
+
+    def __init__(self, namespace: str, ttl=None):
+        self.namespace = namespace
+        self.ttl = float(os.getenv(f"CACHE_TTL_{namespace.upper()}", ttl or 0)) or None
+        self._version = None
+        self._version_checked_at = 0.0
+        self._failed_at = 0.0
+
+    def _healthy(self) -> bool:
+        return time.monotonic() - self._failed_at >= CACHE_ERROR_BACKOFF_SECONDS
+
+    def _error(self, action: str, error) -> None:
+        self._failed_at = time.monotonic()
+        with _metrics_lock:
+            _metrics["errors"] += 1
+        logger.warning("Cache %s %s failed: %s", self.namespace, action, error)
+
+    def _version_key(self) -> str:
+        return f"{CACHE_KEY_PREFIX}:{self.namespace}:version"
+
+    def _current_version(self, backend) -> int:
+        now = time.monotonic()
+        if self._version is None or now - self._version_checked_at >= CACHE_VERSION_CHECK_SECONDS:
+            raw = backend.get(self._version_key())
+            self._version = int(raw) if raw else 0
+            self._version_checked_at = now
+        return self._version
+
+    def _key(self, backend, key: str) -> str:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:40]
+        return f"{CACHE_KEY_PREFIX}:{self.namespace}:v{self._current_version(backend)}:{digest}"
+
+    def get(self, key: str, default=None):
+        if not self._healthy():
+            return default
+        backend = get_backend()
+        try:
+            data = backend.get(self._key(backend, key))
+            value = default if data is None else loads(data)
+        except Exception as e:
+            self._error("get", e)
+            return default
+        _count(self.namespace, "misses" if data is None else "hits")
+        return value
+
+    def version(self) -> "int | None":
+        """The namespace version now (read from the backend), or None when it can't be read."""
+        backend = get_backend()
+        try:
+            self._version_checked_at = 0.0
+            return self._current_version(backend)
+        except Exception as e:
+            self._error("version", e)
+            return None
+
+    def set(self, key: str, value, ttl=None, version=None) -> bool:
+        """
+        Store `value`. With `version` (from version() before computing the
+        value), the write is dropped if the namespace was invalidated since,
+        so a result computed from pre-reload data isn't filed under the new version.
+        """
+        if not self._healthy():
+            return False
+        if version is not None and self.version() != version:
+            with _metrics_lock:
+                _metrics["skipped_stale"] += 1
+            return False
+        try:
+            data = dumps(value)
+        except Exception as e:
+            logger.warning("Cache %s: value not serializable: %s", self.namespace, e)
+            return False
+        if len(data) > CACHE_MAX_VALUE_BYTES:
+            with _metrics_lock:
+                _metrics["skipped_too_large"] += 1
+            return False
+        backend = get_backend()
+        try:
+            backend.set(self._key(backend, key), data, ttl or self.ttl)
+        except Exception as e:
+            self._error("set", e)
+            return False
+        _count(self.namespace, "sets")
+        _count(self.namespace, "bytes_written", len(data))
+        return True
+
+    def delete(self, key: str) -> None:
+        backend = get_backend()
+        try:
+            backend.delete(self._key(backend, key))
+        except Exception as e:
+            self._error("delete", e)
+
+    def get_or_set(self, key: str, fn, ttl=None):
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = fn()
+            self.set(key, value, ttl)
+        return value
+
+    def claim(self, key: str) -> bool:
+        """
+        True for exactly one caller per key across workers sharing the backend
+        (an atomic counter); also True when the backend is unreachable.
+        """
+        backend = get_backend()
+        try:
+            return backend.incr(self._key(backend, key)) == 1
+        except Exception as e:
+            self._error("claim", e)
+            return True
+
+    def invalidate(self) -> None:
+        backend = get_backend()
+        try:
+            self._version = backend.incr(self._version_key())
+            self._version_checked_at = time.monotonic()
+        except Exception as e:
+            self._error("invalidate", e)
+            return
+        _count(self.namespace, "invalidations")
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(namespace: str, ttl=None) -> Cache:
+    """The shared Cache for `namespace`; CACHE_TTL_<NAMESPACE> overrides `ttl` (seconds)."""
+    with _caches_lock:
+        cache = _caches.get(namespace)
+        if cache is None:
+            cache = _caches[namespace] = Cache(namespace, ttl)
+        return cache
+
+
+def invalidate(namespace: str) -> None:
+    get_cache(namespace).invalidate()
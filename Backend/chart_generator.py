@@ -2,23 +2,24 @@ import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
+import io
+import logging
 import uuid
-import os
 import pandas as pd
 import numpy as np
+from chart_store import save_chart
+
+logger = logging.getLogger(__name__)
 
 def generate_chart(df, title="Data Insights"):
     if df.empty:
         return None
     MAX_ROWS_FOR_CHART = 100
     if len(df) > MAX_ROWS_FOR_CHART:
-        print(f"Warning: Chart data has been truncated to the first {MAX_ROWS_FOR_CHART} rows.")
+        logger.info("Chart data has been truncated to the first %d rows.", MAX_ROWS_FOR_CHART)
         df = df.head(MAX_ROWS_FOR_CHART)
 
-    charts_dir = os.path.join("static", "charts")
-    os.makedirs(charts_dir, exist_ok=True)
     filename = f"chart_{uuid.uuid4().hex}.png"
-    chart_path = os.path.join(charts_dir, filename)
 
     BG_COLOR, PRIMARY_BLUE, TEXT_DEEP_BLUE, TEXT_PRIMARY, GRID_COLOR = "#FFFFFF", "#e3f2fd", "#265f94", "#333333", "#E0E0E0"
 
@@ -147,7 +148,11 @@ def generate_chart(df, title="Data Insights"):
             plt.setp(ax.get_xticklabels(), rotation=0)
 
     plt.tight_layout(rect=[0, 0, 1, 0.96] if 'axs' in locals() and len(axs) > 1 else None)
-    plt.savefig(chart_path, dpi=150, bbox_inches='tight', facecolor=fig.get_facecolor())
+    buffer = io.BytesIO()
+    plt.savefig(buffer, format='png', dpi=150, bbox_inches='tight', facecolor=fig.get_facecolor())
     plt.close(fig)
 
+    # Stored where every node can serve it (see chart_store).
+    if not save_chart(filename, buffer.getvalue()):
+        return None
     return filename
@@ -0,0 +1,239 @@
+import hashlib
+import hmac
+import logging
+import os
+import re
+import tempfile
+import threading
+import urllib.parse
+from datetime import datetime, timezone
+
+import requests
+
+from config import load_env
+
+load_env()
+
+logger = logging.getLogger(__name__)
+
+# local - files under CHART_LOCAL_DIR, served by this app (one node, or a shared volume)
+# s3    - any S3-compatible bucket (AWS S3, MinIO, a local stand-in), shared by every node
+CHART_STORE = os.getenv("CHART_STORE", "local").lower()
+CHART_LOCAL_DIR = os.getenv("CHART_LOCAL_DIR", os.path.join("static", "charts"))
+# Chart files are never rewritten (every chart gets a new name), so clients may cache them for good.
+CHART_MAX_AGE_SECONDS = int(os.getenv("CHART_MAX_AGE_SECONDS", str(365 * 24 * 3600)))
+
+CHART_S3_ENDPOINT = os.getenv("CHART_S3_ENDPOINT", "https://s3.amazonaws.com").rstrip("/")
+CHART_S3_BUCKET = os.getenv("CHART_S3_BUCKET", "")
+CHART_S3_REGION = os.getenv("CHART_S3_REGION", "us-east-1")
+CHART_S3_PREFIX = os.getenv("CHART_S3_PREFIX", "charts/")
+# path - https://endpoint/bucket/key (MinIO and most stand-ins); virtual - https://bucket.endpoint/key
+CHART_S3_ADDRESSING = os.getenv("CHART_S3_ADDRESSING", "path").lower()
+CHART_S3_ACCESS_KEY = os.getenv("CHART_S3_ACCESS_KEY") or os.getenv("AWS_ACCESS_KEY_ID", "")
+CHART_S3_SECRET_KEY = os.getenv("CHART_S3_SECRET_KEY") or os.getenv("AWS_SECRET_ACCESS_KEY", "")
+CHART_S3_SESSION_TOKEN = os.getenv("CHART_S3_SESSION_TOKEN") or os.getenv("AWS_SESSION_TOKEN", "")
+CHART_S3_TIMEOUT_SECONDS = float(os.getenv("CHART_S3_TIMEOUT_SECONDS", "10"))
+# Lifetime of the pre-signed GET URLs the chart route redirects to (SigV4 allows up to 7 days).
+CHART_PRESIGN_SECONDS = int(os.getenv("CHART_PRESIGN_SECONDS", "3600"))
+# A public bucket or CDN in front of it; chart URLs then point there directly and never touch the app.
+CHART_PUBLIC_BASE_URL = os.getenv("CHART_PUBLIC_BASE_URL", "").rstrip("/")
+
+CHART_NAME_RE = re.compile(r"^chart_[0-9a-f]{32}\.png$")
+CHART_CACHE_CONTROL = f"public, max-age={CHART_MAX_AGE_SECONDS}, immutable"
+
+_metrics_lock = threading.Lock()
+_metrics = {"stored": 0, "bytes_stored": 0, "store_errors": 0, "served": 0, "redirected": 0, "not_modified": 0}
+
+
+def _count(key: str, amount: int = 1) -> None:
+    with _metrics_lock:
+        _metrics[key] += amount
+
+
+def get_chart_store_metrics() -> dict:
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    metrics["store"] = get_chart_store().name
+    return metrics
+
+
+def record_served(outcome: str) -> None:
+    """Count how the chart route answered: served, redirected or not_modified."""
+    _count(outcome)
+
+
+def is_chart_name(name: str) -> bool:
+    return bool(CHART_NAME_RE.match(name or ""))
+
+
+def chart_etag(name: str) -> str:
+    # Content never changes under a name, so the name itself is a strong validator.
+    return hashlib.sha256(name.encode("utf-8")).hexdigest()[:32]
+
+
+class LocalChartStore:
+    name = "local"
+
+    def __init__(self, root=CHART_LOCAL_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def put(self, name: str, data: bytes, content_type: str = "image/png") -> None:
+        # Write-then-rename, so a concurrent reader never sees a half-written file.
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".tmp_")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, os.path.join(self.root, name))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def get(self, name: str):
+        try:
+            with open(os.path.join(self.root, name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def exists(self, name: str) -> bool:
+        return os.path.isfile(os.path.join(self.root, name))
+
+    def public_url(self, name: str):
+        return f"{CHART_PUBLIC_BASE_URL}/{name}" if CHART_PUBLIC_BASE_URL else None
+
+    def redirect_url(self, name: str):
+        return None
+
+
+def _quote(value: str, safe: str = "-_.~") -> str:
+    return urllib.parse.quote(value, safe=safe)
+
+
+def _hmac(key: bytes, msg: str) -> bytes:
+    return hmac.new(key, msg.encode("utf-8"), hashlib.sha256).digest()
+
+
+class S3ChartStore:
+    """
+    S3-compatible store using SigV4 pre-signed URLs for every call (PUT, GET),
+    so only `requests` is needed. Objects are written with an immutable
+    Cache-Control; browsers are redirected to a pre-signed GET URL, or to
+    CHART_PUBLIC_BASE_URL when the bucket sits behind a CDN.
+    """
+
+    name = "s3"
+
+    def __init__(self, endpoint=CHART_S3_ENDPOINT, bucket=CHART_S3_BUCKET, region=CHART_S3_REGION,
+                 access_key=CHART_S3_ACCESS_KEY, secret_key=CHART_S3_SECRET_KEY,
+                 session_token=CHART_S3_SESSION_TOKEN, prefix=CHART_S3_PREFIX, addressing=CHART_S3_ADDRESSING):
+        if not bucket:
+            raise ValueError("CHART_S3_BUCKET is not set")
+        parsed = urllib.parse.urlparse(endpoint)
+        self.scheme = parsed.scheme or "https"
+        self.host = parsed.netloc
+        self.bucket = bucket
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.session_token = session_token
+        self.prefix = prefix
+        self.addressing = addressing
+        self._session = requests.Session()
+
+    def _location(self, key: str):
+        if self.addressing == "virtual":
+            return f"{self.bucket}.{self.host}", "/" + _quote(key, safe="/-_.~")
+        return self.host, f"/{_quote(self.bucket)}/" + _quote(key, safe="/-_.~")
+
+    def presign(self, method: str, key: str, expires: int, now: datetime = None) -> str:
+        now = now or datetime.now(timezone.utc)
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        scope = f"{amz_date[:8]}/{self.region}/s3/aws4_request"
+        host, path = self._location(key)
+        params = {
+            "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+            "X-Amz-Credential": f"{self.access_key}/{scope}",
+            "X-Amz-Date": amz_date,
+            "X-Amz-Expires": str(expires),
+            "X-Amz-SignedHeaders": "host",
+        }
+        if self.session_token:
+            params["X-Amz-Security-Token"] = self.session_token
+        query = "&".join(f"{_quote(k)}={_quote(v)}" for k, v in sorted(params.items()))
+        canonical_request = "\n".join([method, path, query, f"host:{host}\n", "host", "UNSIGNED-PAYLOAD"])
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(canonical_request.encode("utf-8")).hexdigest(),
+        ])
+        key_bytes = _hmac(("AWS4" + self.secret_key).encode("utf-8"), amz_date[:8])
+        for part in (self.region, "s3", "aws4_request"):
+            key_bytes = _hmac(key_bytes, part)
+        signature = hmac.new(key_bytes, string_to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+        return f"{self.scheme}://{host}{path}?{query}&X-Amz-Signature={signature}"
+
+    def _key(self, name: str) -> str:
+        return f"{self.prefix}{name}"
+
+    def put(self, name: str, data: bytes, content_type: str = "image/png") -> None:
+        response = self._session.put(
+            self.presign("PUT", self._key(name), 300),
+            data=data,
+            headers={"Content-Type": content_type, "Cache-Control": CHART_CACHE_CONTROL},
+            timeout=CHART_S3_TIMEOUT_SECONDS,
+        )
+        response.raise_for_status()
+
+    def get(self, name: str):
+        response = self._session.get(self.presign("GET", self._key(name), 60), timeout=CHART_S3_TIMEOUT_SECONDS)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.content
+
+    def exists(self, name: str) -> bool:
+        response = self._session.head(self.presign("HEAD", self._key(name), 60), timeout=CHART_S3_TIMEOUT_SECONDS)
+        return response.status_code == 200
+
+    def public_url(self, name: str):
+        return f"{CHART_PUBLIC_BASE_URL}/{self._key(name)}" if CHART_PUBLIC_BASE_URL else None
+
+    def redirect_url(self, name: str):
+        return self.public_url(name) or self.presign("GET", self._key(name), CHART_PRESIGN_SECONDS)
+
+
+CHART_STORES = {"local": LocalChartStore, "s3": S3ChartStore}
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_chart_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            factory = CHART_STORES.get(CHART_STORE)
+            if factory is None:
+                logger.warning("Unknown CHART_STORE %r, using local files.", CHART_STORE)
+                factory = LocalChartStore
+            _store = factory()
+        return _store
+
+
+def set_chart_store(store) -> None:
+    """Swap the store, e.g. an S3ChartStore pointed at a local stand-in."""
+    global _store
+    with _store_lock:
+        _store = store
+
+
+def save_chart(name: str, data: bytes) -> bool:
+    try:
+        get_chart_store().put(name, data)
+    except Exception as e:
+        _count("store_errors")
+        logger.error("Could not store chart %s: %s", name, e)
+        return False
+    _count("stored")
+    _count("bytes_stored", len(data))
+    return True
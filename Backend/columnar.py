@@ -0,0 +1,91 @@
+import os
+from datetime import date, datetime
+from decimal import Decimal
+
+import pandas as pd
+import pyarrow as pa
+
+FETCH_BATCH_SIZE = int(os.getenv("FETCH_BATCH_SIZE", "10000"))
+# float   - DECIMAL/NUMERIC columns become float64 (JSON friendly, the default)
+# decimal - keep exact values as Arrow decimal128 (pandas ArrowDtype)
+FETCH_DECIMAL_AS = os.getenv("FETCH_DECIMAL_AS", "float").lower()
+
+
+def arrow_type(type_code, precision=None, scale=None):
+    """Arrow type for a pyodbc cursor.description type_code (a Python class)."""
+    if type_code is bool:
+        return pa.bool_()
+    if type_code is int:
+        return pa.int64()
+    if type_code is float:
+        return pa.float64()
+    if type_code is Decimal and precision:
+        return pa.decimal128(min(int(precision), 38), int(scale or 0))
+    if type_code is datetime:
+        return pa.timestamp("us")
+    if type_code is date:
+        return pa.date32()
+    if type_code in (bytes, bytearray):
+        return pa.binary()
+    return pa.string()
+
+
+def arrow_schema(description):
+    return pa.schema([pa.field(col[0], arrow_type(col[1], col[4], col[5])) for col in description])
+
+
+def _column_array(values, field):
+    try:
+        return pa.array(values, type=field.type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # The driver reported one type but returned another (e.g. sql_variant); keep the text.
+        return pa.array([None if v is None else str(v) for v in values], type=pa.string())
+
+
+def rows_to_record_batch(rows, schema):
+    """Convert one fetchmany() batch into typed Arrow columns."""
+    if rows and type(rows[0]) is not tuple:
+        # pyodbc.Row is a sequence but not a tuple, which Arrow's struct conversion needs.
+        rows = [tuple(row) for row in rows]
+    try:
+        # Arrow transposes the row tuples in C++; much cheaper than zip(*rows) in Python.
+        return pa.RecordBatch.from_struct_array(pa.array(rows, type=pa.struct(list(schema))))
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        columns = list(zip(*rows)) if rows else [() for _ in schema]
+        arrays = [_column_array(values, field) for values, field in zip(columns, schema)]
+        return pa.RecordBatch.from_arrays(arrays, names=schema.names)
+
+
+def fetch_arrow_table(cur, batch_size: int = None):
+    """Drain `cur` in fetchmany batches into one Arrow table; no per-row Python objects are kept."""
+    batch_size = batch_size or FETCH_BATCH_SIZE
+    schema = arrow_schema(cur.description)
+    batches = []
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        batches.append(rows_to_record_batch(rows, schema))
+    if not batches:
+        return schema.empty_table()
+    return pa.Table.from_batches(batches) if len({b.schema for b in batches}) == 1 else pa.concat_tables(
+        [pa.Table.from_batches([b]) for b in batches], promote_options="permissive"
+    )
+
+
+def arrow_to_pandas(table, decimal_as: str = None):
+    """
+    DataFrame with numeric DECIMAL columns and datetime64 dates (same ISO output
+    from to_json as date objects, without a Python object per cell).
+    """
+    decimal_as = (decimal_as or FETCH_DECIMAL_AS).lower()
+    if decimal_as == "decimal":
+        return table.to_pandas(
+            date_as_object=False,
+            types_mapper=lambda t: pd.ArrowDtype(t) if pa.types.is_decimal(t) else None,
+        )
+
+    schema = pa.schema(
+        pa.field(f.name, pa.float64()) if pa.types.is_decimal(f.type) else f for f in table.schema
+    )
+    return table.cast(schema).to_pandas(date_as_object=False)
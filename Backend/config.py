@@ -1,6 +1,23 @@
 import os
 import re
-from flask_cors import CORS
+import threading
+
+_env_loaded = False
+_env_lock = threading.Lock()
+
+
+def load_env():
+    """Load .env once per process; modules call this instead of load_dotenv() at import."""
+    global _env_loaded
+    if _env_loaded:
+        return
+    with _env_lock:
+        if not _env_loaded:
+            from dotenv import load_dotenv
+
+            load_dotenv()
+            _env_loaded = True
+
 
 def configure_cors(app):
     """
@@ -23,6 +40,8 @@ def configure_cors(app):
         re.compile(r"^http://192\.168\.\d+\.\d+(:\d+)?$"),
     ]
 
+    from flask_cors import CORS
+
     env = os.getenv("CORS_ENV", "").lower()
     is_production = env in {"prod", "production", "live"}
 
@@ -1,14 +1,93 @@
+import functools
 import os
+import logging
+import threading
+import time
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text
 import re
 from sqlalchemy.exc import SQLAlchemyError
 from contextlib import contextmanager
-from dotenv import load_dotenv
-
-load_dotenv()
+from cache import get_cache
+from config import load_env
+from freshness import register_cache_namespace, tracks_changes
+from query_guard import QUERY_DEFAULT_ROW_CAP, QUERY_TIMEOUT_SECONDS, guard_query
+from sql_parse import parse_sql, parameterize
+
+load_env()
+
+logger = logging.getLogger(__name__)
+
+# Isolation for the read-only (chatbot) path, applied once per pooled connection:
+#   default                 - driver default (READ COMMITTED, locking)
+#   snapshot                - SNAPSHOT; needs ALLOW_SNAPSHOT_ISOLATION ON for the database. If the
+#                             database refuses it (3952/3960/3961), the process falls back to
+#                             read_committed_snapshot and the failed query runs once more.
+#   read_committed_snapshot - READ COMMITTED (default); row-versioned when the database has READ_COMMITTED_SNAPSHOT ON
+#   read_uncommitted        - dirty reads (NOLOCK semantics); meant for exploratory probes only
+ISOLATION_LEVELS = {
+    "default": None,
+    "snapshot": "SNAPSHOT",
+    "read_committed_snapshot": "READ COMMITTED",
+    "read_uncommitted": "READ UNCOMMITTED",
+}
+DB_ISOLATION_MODE = os.getenv("DB_ISOLATION_MODE", "read_committed_snapshot").lower()
+SNAPSHOT_FALLBACK_MODE = "read_committed_snapshot"
+DB_PROBE_ISOLATION_MODE = os.getenv("DB_PROBE_ISOLATION_MODE", "read_uncommitted").lower()
+DB_LOCK_TIMEOUT_MS = int(os.getenv("DB_LOCK_TIMEOUT_MS", "5000"))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_POOL_MAX_OVERFLOW = int(os.getenv("DB_POOL_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+FETCH_MODE = os.getenv("FETCH_MODE", "columnar").lower()
+DB_LOCK_WAIT_STATS = os.getenv("DB_LOCK_WAIT_STATS", "1").lower() not in {"0", "false", "no"}
+# 0 disables the shared result cache. While this worker's freshness poller runs
+# with a watermark that sees every reload, results are dropped as soon as the
+# table changes and may live for RESULT_CACHE_TRACKED_TTL_SECONDS instead.
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL_SECONDS", "300"))
+RESULT_CACHE_TRACKED_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TRACKED_TTL_SECONDS", "86400"))
+
+LOCK_TIMEOUT_ERROR = "1222"
+SNAPSHOT_ERRORS = ("3952", "3960", "3961")
+LOCK_WAIT_QUERY = (
+    "SELECT COALESCE(SUM(waiting_tasks_count), 0), COALESCE(SUM(wait_time_ms), 0) "
+    "FROM sys.dm_exec_session_wait_stats WHERE session_id = @@SPID AND wait_type LIKE 'LCK[_]M[_]%'"
+)
 
-def get_engine():
+_engines = {}
+_engines_lock = threading.Lock()
+_snapshot_unavailable = False
+_results = get_cache("results", RESULT_CACHE_TTL_SECONDS)
+register_cache_namespace("results")
+_metrics_lock = threading.Lock()
+_metrics = {
+    "connections_opened": 0,
+    "checkouts": 0,
+    "lock_waits": 0,
+    "lock_wait_ms": 0,
+    "max_lock_wait_ms": 0,
+    "lock_timeouts": 0,
+    "snapshot_errors": 0,
+    "lock_stats_unavailable": 0,
+}
+
+
+def get_db_metrics() -> dict:
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    metrics["isolation_mode"] = DB_ISOLATION_MODE
+    metrics["snapshot_fallback"] = _snapshot_unavailable
+    metrics["probe_isolation_mode"] = DB_PROBE_ISOLATION_MODE
+    with _engines_lock:
+        metrics["pools"] = {mode: engine.pool.status() for mode, engine in _engines.items()}
+    return metrics
+
+
+def _count(key: str, amount: int = 1) -> None:
+    with _metrics_lock:
+        _metrics[key] += amount
+
+
+def get_engine(isolation_level=None, **pool_kwargs):
     import urllib.parse
     server = os.getenv('DB_SERVER')
     database = os.getenv('DB_NAME')
@@ -21,14 +100,279 @@ def get_engine():
         f"?driver={driver.replace(' ', '+')}&TrustServerCertificate=yes"
     )
 
-    return create_engine(connection_string)
+    if isolation_level:
+        pool_kwargs["isolation_level"] = isolation_level
+    return create_engine(connection_string, **pool_kwargs)
 
-def run_sql_query(sql):
-    engine = get_engine()
-    with engine.connect() as conn:
-        df = pd.read_sql(text(sql), conn)
+
+def get_read_engine(mode=None):
+    """
+    Shared, pooled engine for the read-only path. The isolation level and
+    LOCK_TIMEOUT are set when a connection is first opened, not per query.
+    `mode` is a key of ISOLATION_LEVELS; "probe" resolves to DB_PROBE_ISOLATION_MODE.
+    """
+    mode = (mode or DB_ISOLATION_MODE).lower()
+    if mode == "probe":
+        mode = DB_PROBE_ISOLATION_MODE
+    if mode not in ISOLATION_LEVELS:
+        logger.warning("Unknown isolation mode %r, using the driver default.", mode)
+        mode = "default"
+    if mode == "snapshot" and _snapshot_unavailable:
+        mode = SNAPSHOT_FALLBACK_MODE
+
+    with _engines_lock:
+        engine = _engines.get(mode)
+        if engine is None:
+            engine = get_engine(
+                ISOLATION_LEVELS[mode],
+                pool_size=DB_POOL_SIZE,
+                max_overflow=DB_POOL_MAX_OVERFLOW,
+                pool_recycle=DB_POOL_RECYCLE_SECONDS,
+                pool_pre_ping=True,
+            )
+            event.listen(engine, "connect", _on_connect)
+            event.listen(engine, "checkin", functools.partial(_reset_session, _session_reset_sql(ISOLATION_LEVELS[mode])))
+            _engines[mode] = engine
+    return engine
+
+
+def dispose_engines():
+    with _engines_lock:
+        engines = list(_engines.values())
+        _engines.clear()
+    for engine in engines:
+        engine.dispose()
+
+
+def _reset_after_fork():
+    # Pooled connections are sockets owned by the parent; a forked worker must
+    # not reuse them. Drop the pools without closing the parent's connections.
+    global _engines_lock
+    _engines_lock = threading.Lock()
+    for engine in list(_engines.values()):
+        engine.dispose(close=False)
+    _engines.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _on_connect(dbapi_conn, connection_record):
+    _count("connections_opened")
+    if DB_LOCK_TIMEOUT_MS < 0:
+        return
+    cur = dbapi_conn.cursor()
+    try:
+        # Fail fast (error 1222) instead of queueing behind an ETL load's locks.
+        cur.execute(f"SET LOCK_TIMEOUT {int(DB_LOCK_TIMEOUT_MS)}")
+    finally:
+        cur.close()
+
+
+def _session_reset_sql(isolation_level) -> str:
+    """Session options put back on every checkin, so nothing one checkout changed leaks into the next."""
+    lock_timeout = int(DB_LOCK_TIMEOUT_MS) if DB_LOCK_TIMEOUT_MS >= 0 else -1
+    return (
+        "SET ROWCOUNT 0; SET IMPLICIT_TRANSACTIONS OFF; "
+        f"SET LOCK_TIMEOUT {lock_timeout}; "
+        f"SET TRANSACTION ISOLATION LEVEL {isolation_level or 'READ COMMITTED'}"
+    )
+
+
+def _reset_session(reset_sql, dbapi_conn, connection_record):
+    if dbapi_conn is None:
+        return
+    cur = None
+    try:
+        cur = dbapi_conn.cursor()
+        cur.execute(reset_sql)
+    except Exception as e:
+        # A connection whose state we can't vouch for doesn't go back into the pool.
+        logger.warning("Could not reset a pooled connection, discarding it: %s", e)
+        connection_record.invalidate(e)
+    finally:
+        if cur is not None:
+            try:
+                cur.close()
+            except Exception:
+                pass
+
+
+def _session_lock_waits(dbapi_conn):
+    """Cumulative (count, ms) of LCK_M_* waits for this session, or None without permission."""
+    cur = dbapi_conn.cursor()
+    try:
+        cur.execute(LOCK_WAIT_QUERY)
+        count, wait_ms = cur.fetchone()
+        return int(count), int(wait_ms)
+    except Exception:
+        return None
+    finally:
+        cur.close()
+
+
+def _record_lock_waits(dbapi_conn):
+    info = getattr(dbapi_conn, "info", None)
+    if info is None or info.get("lock_stats") is False:
+        return
+    current = _session_lock_waits(dbapi_conn)
+    if current is None:
+        info["lock_stats"] = False
+        _count("lock_stats_unavailable")
+        return
+    previous = info.get("lock_stats") or (0, 0)
+    info["lock_stats"] = current
+    waits, wait_ms = current[0] - previous[0], current[1] - previous[1]
+    if waits <= 0:
+        return
+    with _metrics_lock:
+        _metrics["lock_waits"] += waits
+        _metrics["lock_wait_ms"] += wait_ms
+        _metrics["max_lock_wait_ms"] = max(_metrics["max_lock_wait_ms"], wait_ms)
+
+
+def is_snapshot_error(error) -> bool:
+    message = str(error)
+    return any(code in message for code in SNAPSHOT_ERRORS) and "snapshot" in message.lower()
+
+
+def _record_db_error(error):
+    global _snapshot_unavailable
+    message = str(error)
+    if LOCK_TIMEOUT_ERROR in message and "lock request time out" in message.lower():
+        _count("lock_timeouts")
+    elif is_snapshot_error(error):
+        _count("snapshot_errors")
+        if not _snapshot_unavailable:
+            _snapshot_unavailable = True
+            logger.warning(
+                "Snapshot isolation failed (%s); using %s from now on. Enable ALLOW_SNAPSHOT_ISOLATION or set DB_ISOLATION_MODE.",
+                message, SNAPSHOT_FALLBACK_MODE,
+            )
+
+def execute_guarded_query(cur, sql, row_cap=None):
+    """
+    Run `sql` on `cur` after the cost guard: may inject a row cap, and raises
+    query_guard.QueryRejected instead of executing an over-budget query.
+    """
+    guarded_sql = guard_query(sql, cur=cur, row_cap=row_cap)
+    template, params = parameterize(guarded_sql)
+    if params:
+        _set_input_sizes(cur, params)
+        try:
+            cur.execute(template, *[p.value for p in params])
+        finally:
+            # Input sizes stick to the cursor; don't let them apply to its next statement.
+            _clear_input_sizes(cur)
+    else:
+        cur.execute(guarded_sql)
+    return guarded_sql
+
+
+def _set_input_sizes(cur, params):
+    """
+    pyodbc binds every str as NVARCHAR, which forces an implicit conversion
+    against VARCHAR columns; bind plain literals as VARCHAR(8000) (fixed size,
+    so the plan is reused) and keep N'...' literals as NVARCHAR.
+    """
+    import pyodbc
+
+    sizes = []
+    for p in params:
+        if isinstance(p.value, str):
+            sizes.append((pyodbc.SQL_WVARCHAR, 4000, 0) if p.national else (pyodbc.SQL_VARCHAR, 8000, 0))
+        else:
+            sizes.append(None)
+    try:
+        cur.setinputsizes(sizes)
+    except Exception:
+        pass
+
+
+def _clear_input_sizes(cur):
+    try:
+        cur.setinputsizes(None)
+    except Exception:
+        pass
+
+
+def fetch_dataframe(cur):
+    """
+    Build a DataFrame from the cursor's result. The columnar path (FETCH_MODE,
+    default) reads typed fetchmany batches into Arrow, so DECIMAL columns come
+    back as float64 instead of object dtype; "records" keeps the row-object path.
+    """
+    if FETCH_MODE == "columnar":
+        try:
+            from columnar import arrow_to_pandas, fetch_arrow_table
+        except ImportError:
+            pass
+        else:
+            table = fetch_arrow_table(cur)
+            if table.num_rows == 0:
+                return pd.DataFrame()
+            return arrow_to_pandas(table)
+
+    rows = cur.fetchall()
+    if not rows:
+        return pd.DataFrame()
+    columns = [col[0] for col in cur.description]
+    return pd.DataFrame.from_records(rows, columns=columns)
+
+
+def run_sql_query(sql, row_cap=None):
+    """
+    Run a read-only query and return a DataFrame; when the injected row cap
+    cut the result short, `df.attrs["truncated"]` is True. Results are shared through
+    the "results" cache for RESULT_CACHE_TTL_SECONDS, so the agent's tool call
+    and the answer's own execution of the same SQL (on any worker) hit the
+    database once. Long-range aggregates are answered incrementally from
+    cached closed-month partials where possible (see incremental.py).
+    """
+    from incremental import run_incremental
+
+    cached = cached_result(sql, row_cap=row_cap)
+    if cached is not None:
+        return cached
+    # Taken before running, so a result that straddles a reload isn't cached as fresh.
+    version = _results.version() if RESULT_CACHE_TTL_SECONDS > 0 else None
+    df = run_incremental(sql, row_cap=row_cap)
+    if df is None:
+        cap = QUERY_DEFAULT_ROW_CAP if row_cap is None else row_cap
+        try:
+            guarded_sql, df = _fetch_capped(sql, cap)
+        except Exception as e:
+            if not is_snapshot_error(e):
+                raise
+            # The pool has switched away from SNAPSHOT (see _record_db_error); run it once more.
+            guarded_sql, df = _fetch_capped(sql, cap)
+        if guarded_sql != sql and len(df) > cap:
+            df = df.head(cap)
+            df.attrs["truncated"] = True
+    if RESULT_CACHE_TTL_SECONDS > 0:
+        ttl = RESULT_CACHE_TRACKED_TTL_SECONDS if tracks_changes() else RESULT_CACHE_TTL_SECONDS
+        _results.set(_result_key(sql, row_cap), df, ttl=ttl, version=version)
     return df
 
+
+def _fetch_capped(sql, cap):
+    with with_sqlserver_cursor() as (conn, cur):
+        # One row past the cap tells a capped result apart from one that just fits.
+        guarded_sql = execute_guarded_query(cur, sql, row_cap=cap + 1 if cap and cap > 0 else cap)
+        return guarded_sql, fetch_dataframe(cur)
+
+
+def _result_key(sql, row_cap=None):
+    return f"{row_cap}:{sql.strip()}"
+
+
+def cached_result(sql, row_cap=None):
+    """The shared cached result of `run_sql_query(sql, row_cap)`, or None."""
+    if RESULT_CACHE_TTL_SECONDS <= 0:
+        return None
+    return _results.get(_result_key(sql, row_cap))
+
 def extract_schema():
     engine = get_engine()
     query = """
@@ -55,19 +399,13 @@ def extract_schema():
     return schema_text.strip()
 
 
-FORBIDDEN_STMTS = re.compile(
-    r"\b(INSERT|UPDATE|DELETE|MERGE|CREATE|DROP|ALTER|TRUNCATE|GRANT|REVOKE|BACKUP|RESTORE|EXECUTE|EXEC|RECONFIGURE)\b",
-    re.IGNORECASE,
-)
-
 class ReadOnlyCursor:
     def __init__(self, cursor):
         self._cursor = cursor
 
     def _ensure_read_only_sql(self, sql):
         if isinstance(sql, str):
-            stripped = sql.lstrip()
-            if FORBIDDEN_STMTS.search(stripped):
+            if not parse_sql(sql).is_read_only():
                 raise PermissionError(
                     "Query blocked: only read-only queries (SELECT/CTE) are permitted in this context."
                 )
@@ -95,6 +433,11 @@ class ReadOnlyCursor:
     def close(self):
         return self._cursor.close()
 
+    @property
+    def raw(self):
+        """The unchecked cursor, for internal session options (SHOWPLAN_XML); never hand it generated SQL."""
+        return self._cursor
+
     @property
     def description(self):
         return self._cursor.description
@@ -110,8 +453,17 @@ class ReadOnlyCursor:
         return getattr(self._cursor, name)
 
 
+def _set_query_timeout(dbapi_conn, seconds):
+    # pyodbc applies Connection.timeout to every statement executed on it.
+    driver_conn = getattr(dbapi_conn, "driver_connection", None) or dbapi_conn
+    try:
+        driver_conn.timeout = int(seconds)
+    except Exception:
+        pass
+
+
 @contextmanager
-def with_sqlserver_cursor():
+def with_sqlserver_cursor(query_timeout=None, isolation=None):
     """
     Context manager that yields a DB-API (pyodbc) connection and a read-only cursor proxy.
 
@@ -121,23 +473,30 @@ def with_sqlserver_cursor():
             rows = cur.fetchall()
 
     Characteristics:
-    - Any SQL containing write/DDL keywords (INSERT/UPDATE/DELETE/CREATE/DROP/etc.)
+    - Any SQL that parses to a write/DDL statement (INSERT/UPDATE/DELETE/CREATE/DROP/etc.)
       will raise PermissionError before being executed.
     - Stored procedure calls are blocked.
+    - Every statement is bounded by `query_timeout` seconds (QUERY_TIMEOUT_SECONDS by default, 0 = none).
+    - Connections come from a shared pool whose isolation level is `isolation`
+      (DB_ISOLATION_MODE by default, "probe" for exploratory lookups).
     - The manager will ALWAYS rollback (so no accidental writes persist).
-    - Resources are properly closed and the engine disposed.
+    - Resources are properly closed and the connection returned to the pool.
     """
-    engine = get_engine()
+    engine = get_read_engine(isolation)
     dbapi_conn = None
     raw_cur = None
     ro_cur = None
 
     try:
         dbapi_conn = engine.raw_connection()
+        _count("checkouts")
+        _set_query_timeout(dbapi_conn, QUERY_TIMEOUT_SECONDS if query_timeout is None else query_timeout)
         raw_cur = dbapi_conn.cursor()
         ro_cur = ReadOnlyCursor(raw_cur)
         yield dbapi_conn, ro_cur
 
+        if DB_LOCK_WAIT_STATS:
+            _record_lock_waits(dbapi_conn)
         try:
             dbapi_conn.rollback()
         except Exception:
@@ -152,7 +511,8 @@ def with_sqlserver_cursor():
         raise
     except PermissionError:
         raise
-    except Exception:
+    except Exception as e:
+        _record_db_error(e)
         if dbapi_conn:
             try:
                 dbapi_conn.rollback()
@@ -176,10 +536,6 @@ def with_sqlserver_cursor():
                 dbapi_conn.close()
             except Exception:
                 pass
-        try:
-            engine.dispose()
-        except Exception:
-            pass
 
 # with with_sqlserver_cursor() as (con, cur):
 #     cur.execute("SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_TYPE = 'BASE TABLE';")
@@ -0,0 +1,350 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from cache import get_cache
+from config import load_env
+from freshness import FRESHNESS_ENABLED, register_cache_namespace
+from single_flight import normalize_question
+
+load_env()
+
+logger = logging.getLogger(__name__)
+
+# Scheduled digests: the fixed KPI questions asked when stores open are
+# answered off-peak, once per data load, and served from the digest store.
+#
+# DIGEST_CONFIG_PATH is a JSON file like
+#   {"digests": [{"name": "store-open", "tenant": "tnr", "regions": ["North", "South"],
+#                 "questions": ["What were total sales yesterday in {region}?", ...]}]}
+# Questions are templates: {region} and {tenant} are filled in, and a digest
+# with regions runs every question once per region.
+DIGEST_ENABLED = os.getenv("DIGEST_ENABLED", "1").lower() not in {"0", "false", "no"}
+DIGEST_CONFIG_PATH = os.getenv("DIGEST_CONFIG_PATH", "digests.json")
+# Off-peak window in server local time, HH:MM-HH:MM (may wrap midnight); empty means any time.
+DIGEST_WINDOW = os.getenv("DIGEST_WINDOW", "01:00-06:00").strip()
+DIGEST_CHECK_SECONDS = float(os.getenv("DIGEST_CHECK_SECONDS", "60"))
+# Wait until the watermark has stood still this long, so a load still in progress isn't digested.
+DIGEST_SETTLE_SECONDS = float(os.getenv("DIGEST_SETTLE_SECONDS", "600"))
+# Questions of one digest answered at the same time.
+DIGEST_CONCURRENCY = int(os.getenv("DIGEST_CONCURRENCY", "2"))
+# Precomputed answers are also dropped as soon as the data is reloaded, and at
+# local midnight: questions like "sales yesterday" mean another day tomorrow.
+DIGEST_ANSWER_TTL_SECONDS = int(os.getenv("DIGEST_ANSWER_TTL_SECONDS", str(36 * 3600)))
+DIGEST_SERVE = os.getenv("DIGEST_SERVE", "1").lower() not in {"0", "false", "no"}
+DIGEST_REPORTS_KEPT = int(os.getenv("DIGEST_REPORTS_KEPT", "50"))
+
+_answers = get_cache("digest_answers", DIGEST_ANSWER_TTL_SECONDS)
+register_cache_namespace("digest_answers")
+_runs = get_cache("digest_runs", 7 * 24 * 3600)
+_reports = get_cache("digest_reports", 30 * 24 * 3600)
+
+_metrics_lock = threading.Lock()
+_metrics = {
+    "runs": 0,
+    "questions": 0,
+    "answers_stored": 0,
+    "failures": 0,
+    "served": 0,
+    "skipped_claimed": 0,
+    "skipped_busy": 0,
+}
+
+_answer_fn = None
+# Held while this worker runs digests, so a manual run can't pile onto another.
+_running = threading.Lock()
+
+
+def get_digest_metrics() -> dict:
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    metrics["enabled"] = DIGEST_ENABLED
+    metrics["window"] = DIGEST_WINDOW
+    metrics["last_checked_at"] = _scheduler.checked_at
+    return metrics
+
+
+def _count(key: str, amount: int = 1) -> None:
+    with _metrics_lock:
+        _metrics[key] += amount
+
+
+def set_answer_function(fn) -> None:
+    """
+    Register `fn(question, run_sql, auth_header) -> (body, status)`, the
+    /api/query pipeline (admission included) used for every digest question.
+    """
+    global _answer_fn
+    _answer_fn = fn
+
+
+class Digest:
+    def __init__(self, name: str, questions, tenant: str = None, regions=None):
+        self.name = name
+        self.tenant = tenant
+        self.templates = list(questions)
+        self.regions = list(regions or [])
+
+    def questions(self) -> list:
+        expanded = []
+        for region in self.regions or [None]:
+            for template in self.templates:
+                question = template.format(region=region or "", tenant=self.tenant or "").strip()
+                if question not in expanded:
+                    expanded.append(question)
+        return expanded
+
+
+def load_digests(path: str = None) -> list:
+    path = path or DIGEST_CONFIG_PATH
+    try:
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        return []
+    digests = []
+    for i, entry in enumerate(config.get("digests", [])):
+        if not entry.get("questions"):
+            logger.warning("Digest %s has no questions; skipped.", entry.get("name", i))
+            continue
+        digests.append(Digest(entry.get("name") or f"digest-{i}", entry["questions"], entry.get("tenant"), entry.get("regions")))
+    return digests
+
+
+def _answer_key(question: str, day) -> str:
+    # Answers are only valid on the local calendar day they were computed for.
+    return f"{day.isoformat()}\x00{normalize_question(question)}"
+
+
+def _seconds_to_midnight(now: datetime) -> float:
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    return (midnight - now).total_seconds()
+
+
+def precomputed_answer(question: str):
+    """The stored digest body for this question (computed today), or None."""
+    if not DIGEST_SERVE:
+        return None
+    entry = _answers.get(_answer_key(question, datetime.now().date()))
+    if entry is None:
+        return None
+    _count("served")
+    return {**entry["body"], "precomputed": True, "computed_at": entry["computed_at"]}
+
+
+def in_window(now: datetime = None, window: str = None) -> bool:
+    window = DIGEST_WINDOW if window is None else window
+    if not window:
+        return True
+    start, end = (datetime.strptime(part.strip(), "%H:%M").time() for part in window.split("-", 1))
+    current = (now or datetime.now()).time()
+    return start <= current < end if start <= end else current >= start or current < end
+
+
+def _data_marker() -> "str | None":
+    """The current data load: the freshness watermark once it has settled (None before), else today's date."""
+    if FRESHNESS_ENABLED:
+        from freshness import get_freshness_metrics
+
+        freshness = get_freshness_metrics()
+        if freshness["changed_at"] and time.time() - freshness["changed_at"] < DIGEST_SETTLE_SECONDS:
+            return None
+        return freshness["watermark"]
+    return datetime.now().strftime("%Y-%m-%d")
+
+
+def _record_report(report: dict) -> None:
+    # Read-modify-write; two digests finishing at the same instant may drop a report, never an answer.
+    reports = _reports.get("recent") or []
+    reports.append(report)
+    _reports.set("recent", reports[-DIGEST_REPORTS_KEPT:])
+
+
+def recent_reports(name: str = None) -> list:
+    reports = _reports.get("recent") or []
+    return [r for r in reversed(reports) if name is None or r["digest"] == name]
+
+
+def run_digest(digest: Digest, trigger: str = "schedule", marker: str = None, auth_header: str = None) -> dict:
+    """
+    Answer every question of `digest` through the registered pipeline and
+    store the answers; returns the run report. Each question is admitted as
+    `auth_header` (the digest itself for scheduled runs).
+    """
+    from batch import BatchRun
+    from db import run_sql_query
+
+    if _answer_fn is None:
+        raise RuntimeError("No answer function registered; call digest.set_answer_function first.")
+    questions = digest.questions()
+    durations = {}
+    auth_header = auth_header or f"digest:{digest.name}"
+
+    def answer_one(question, run_sql):
+        started = time.perf_counter()
+        try:
+            return _answer_fn(question, run_sql, auth_header)
+        finally:
+            durations[question] = round((time.perf_counter() - started) * 1000, 1)
+
+    started_at = datetime.now(timezone.utc)
+    # Relative dates in the questions were resolved against this local day.
+    local_start = datetime.now()
+    run = BatchRun(questions, answer_one, run_sql_query, concurrency=DIGEST_CONCURRENCY)
+    results = []
+    for indices, (body, status) in run:
+        question = questions[indices[0]]
+        result = {"question": question, "status": status, "duration_ms": durations.get(question)}
+        if status == 200:
+            result["rows"] = len(body.get("table") or [])
+            ttl = min(DIGEST_ANSWER_TTL_SECONDS, _seconds_to_midnight(datetime.now()))
+            entry = {"body": body, "computed_at": started_at.isoformat(timespec="seconds")}
+            # A run that crossed midnight has nothing left to store for its day.
+            if datetime.now().date() == local_start.date() and _answers.set(_answer_key(question, local_start.date()), entry, ttl=ttl):
+                _count("answers_stored")
+        else:
+            result["error"] = body.get("error")
+            _count("failures")
+        results.append(result)
+
+    summary = run.summary()
+    report = {
+        "run_id": uuid.uuid4().hex,
+        "digest": digest.name,
+        "tenant": digest.tenant,
+        "trigger": trigger,
+        "data_marker": marker,
+        "started_at": started_at.isoformat(timespec="seconds"),
+        "duration_ms": summary["elapsed_ms"],
+        "answered": sum(1 for r in results if r["status"] == 200),
+        "failed": sum(1 for r in results if r["status"] != 200),
+        "sql_executions": summary["sql_executions"],
+        "questions": sorted(results, key=lambda r: questions.index(r["question"])),
+    }
+    _count("runs")
+    _count("questions", len(questions))
+    _record_report(report)
+    logger.info(
+        "Digest %s finished: %d answered, %d failed in %d ms",
+        digest.name, report["answered"], report["failed"], report["duration_ms"],
+        extra={"digest_run_id": report["run_id"]},
+    )
+    return report
+
+
+class DigestScheduler:
+    """
+    Checks every DIGEST_CHECK_SECONDS; inside the off-peak window, each digest
+    runs once per local day and data marker (the freshness watermark, i.e. once
+    a day and again after every load). The first worker to claim (digest, day,
+    marker) in the shared cache runs it.
+    """
+
+    def __init__(self, interval=DIGEST_CHECK_SECONDS):
+        self.interval = interval
+        self.checked_at = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def run_due(self, now: datetime = None) -> list:
+        self.checked_at = time.time()
+        if not in_window(now):
+            return []
+        marker = _data_marker()
+        if marker is None:
+            return []
+        if not _running.acquire(blocking=False):
+            # A manual run is going; check again next time.
+            _count("skipped_busy")
+            return []
+        reports = []
+        try:
+            # Stored answers expire at local midnight, so each day gets its run even without a reload.
+            today = datetime.now().date().isoformat()
+            for digest in load_digests():
+                if not _runs.claim(f"{digest.name}:{today}:{marker}"):
+                    _count("skipped_claimed")
+                    continue
+                try:
+                    reports.append(run_digest(digest, "schedule", marker))
+                except Exception as e:
+                    _count("failures")
+                    logger.error("Digest %s failed: %s", digest.name, e)
+        finally:
+            _running.release()
+        return reports
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.run_due()
+            except Exception as e:
+                logger.warning("Digest check failed: %s", e)
+            time.sleep(self.interval)
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="digest-scheduler", daemon=True)
+                self._thread.start()
+
+
+_scheduler = DigestScheduler()
+
+
+def start_scheduler():
+    if not DIGEST_ENABLED:
+        return {"skipped": "disabled"}
+    if _answer_fn is None or not load_digests():
+        return {"skipped": "no digests configured"}
+    _scheduler.start()
+    return None
+
+
+def run_now(names=None, auth_header: str = None) -> "list | None":
+    """
+    Run the named digests (all when `names` is empty) on a background thread,
+    outside the window, with every question admitted as `auth_header`. Returns
+    their names, or None while this worker is already running digests.
+    """
+    digests = [d for d in load_digests() if not names or d.name in names]
+    if not digests:
+        return []
+    if not _running.acquire(blocking=False):
+        _count("skipped_busy")
+        return None
+
+    def run():
+        try:
+            for digest in digests:
+                try:
+                    run_digest(digest, "manual", _data_marker(), auth_header)
+                except Exception as e:
+                    _count("failures")
+                    logger.error("Digest %s failed: %s", digest.name, e)
+        finally:
+            _running.release()
+
+    try:
+        threading.Thread(target=contextvars.copy_context().run, args=(run,), name="digest-manual", daemon=True).start()
+    except Exception:
+        _running.release()
+        raise
+    return [d.name for d in digests]
+
+
+def _reset_after_fork():
+    global _metrics_lock, _running
+    _metrics_lock = threading.Lock()
+    _running = threading.Lock()
+    _scheduler._lock = threading.Lock()
+    _scheduler._thread = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
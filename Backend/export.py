@@ -0,0 +1,180 @@
+import csv
+import hashlib
+import io
+import os
+import threading
+import uuid
+import zlib
+from datetime import date, datetime
+
+from cache import get_cache
+
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+# Row cap for exports; 0 streams the full result. The chat path keeps QUERY_DEFAULT_ROW_CAP.
+EXPORT_ROW_CAP = int(os.getenv("EXPORT_ROW_CAP", "0"))
+EXPORT_ANSWER_TTL_SECONDS = int(os.getenv("EXPORT_ANSWER_TTL_SECONDS", "86400"))
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+_answers = get_cache("answers", EXPORT_ANSWER_TTL_SECONDS)
+_metrics_lock = threading.Lock()
+_metrics = {"exports": 0, "rows": 0, "bytes": 0, "by_format": {fmt: 0 for fmt in EXPORT_FORMATS}}
+
+
+def get_export_metrics() -> dict:
+    with _metrics_lock:
+        return {**_metrics, "by_format": dict(_metrics["by_format"])}
+
+
+def _owner_key(auth_header: str) -> str:
+    return hashlib.sha256((auth_header or "").encode("utf-8")).hexdigest()
+
+
+def remember_answer(sql: str, auth_header: str) -> str:
+    """Keep the SQL behind a completed answer so it can be exported later (from any worker); returns the answer id."""
+    answer_id = uuid.uuid4().hex
+    _answers.set(answer_id, (sql, _owner_key(auth_header)))
+    return answer_id
+
+
+def lookup_answer(answer_id: str, auth_header: str):
+    """Return the SQL for `answer_id` if it exists, hasn't expired and belongs to the caller."""
+    entry = _answers.get(answer_id)
+    if entry is None:
+        return None
+    sql, owner = entry
+    return sql if owner == _owner_key(auth_header) else None
+
+
+def iter_batches(sql: str, batch_size: int = None, row_cap: int = None):
+    """
+    Run `sql` and yield the cursor description first, then lists of rows of
+    at most `batch_size`. Only one batch is held in memory at a time.
+    """
+    from db import with_sqlserver_cursor, execute_guarded_query
+
+    batch_size = batch_size or EXPORT_BATCH_SIZE
+    with with_sqlserver_cursor() as (conn, cur):
+        execute_guarded_query(cur, sql, row_cap=EXPORT_ROW_CAP if row_cap is None else row_cap)
+        yield cur.description
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+
+def _csv_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def encode_csv(description, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([col[0] for col in description])
+    for rows in batches:
+        writer.writerows([[_csv_value(v) for v in row] for row in rows])
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _ChunkSink:
+    """Write-only file object for ParquetWriter that hands back what was written since the last drain."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+def encode_parquet(description, batches):
+    """One Parquet row group per fetched batch, emitted as soon as it's written."""
+    import pyarrow.parquet as pq
+    from columnar import arrow_schema, rows_to_record_batch
+
+    schema = arrow_schema(description)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="snappy")
+    try:
+        for rows in batches:
+            batch = rows_to_record_batch(rows, schema)
+            writer.write_batch(batch if batch.schema == schema else batch.cast(schema, safe=False))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def gzip_stream(chunks, level: int = 6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _count_rows(batches, fmt):
+    with _metrics_lock:
+        _metrics["exports"] += 1
+        _metrics["by_format"][fmt] += 1
+    for rows in batches:
+        with _metrics_lock:
+            _metrics["rows"] += len(rows)
+        yield rows
+
+
+def _count_bytes(chunks):
+    for chunk in chunks:
+        if chunk:
+            with _metrics_lock:
+                _metrics["bytes"] += len(chunk)
+            yield chunk
+
+
+def export_stream(sql: str, fmt: str = "csv", compress: bool = False, row_cap: int = None):
+    """
+    Start an export of `sql` as `fmt` ("csv" or "parquet"). The query runs
+    before this returns, so guard rejections and database errors surface to the
+    caller; the returned generator then streams the encoded (optionally gzipped) bytes.
+    """
+    batches = iter_batches(sql, row_cap=row_cap)
+    description = next(batches)
+    batches = _count_rows(batches, fmt)
+    encoder = encode_parquet if fmt == "parquet" else encode_csv
+    chunks = encoder(description, batches)
+    if compress:
+        chunks = gzip_stream(chunks)
+    return _count_bytes(chunks)
@@ -0,0 +1,203 @@
+import logging
+import os
+import threading
+import time
+
+from cache import get_cache, invalidate
+from config import load_env
+
+load_env()
+
+logger = logging.getLogger(__name__)
+
+FRESHNESS_ENABLED = os.getenv("FRESHNESS_ENABLED", "1").lower() not in {"0", "false", "no"}
+FRESHNESS_POLL_SECONDS = float(os.getenv("FRESHNESS_POLL_SECONDS", "60"))
+# A custom watermark query (one row; any columns), e.g. SELECT CHANGE_TRACKING_CURRENT_VERSION()
+# when change tracking is on. Otherwise the first of WATERMARK_QUERIES that runs is used.
+FRESHNESS_QUERY = os.getenv("FRESHNESS_QUERY", "").strip()
+
+TABLE = "[dbo].[ConsolidateData_PBI]"
+_PARTITION_ROWS = (
+    "(SELECT SUM(row_count) FROM sys.dm_db_partition_stats "
+    "WHERE object_id = OBJECT_ID(N'dbo.ConsolidateData_PBI') AND index_id IN (0, 1))"
+)
+_LAST_UPDATE = (
+    "(SELECT MAX(last_user_update) FROM sys.dm_db_index_usage_stats "
+    "WHERE database_id = DB_ID() AND object_id = OBJECT_ID(N'dbo.ConsolidateData_PBI'))"
+)
+# Best first. The first also moves on in-place restatements (same row count and
+# latest date) through the table's last write time, and needs VIEW SERVER STATE;
+# the others only see loads that add rows or dates.
+WATERMARK_QUERIES = (
+    f"SELECT MAX([From_Date]), {_PARTITION_ROWS}, {_LAST_UPDATE} FROM {TABLE}",
+    f"SELECT MAX([From_Date]), {_PARTITION_ROWS} FROM {TABLE}",
+    f"SELECT MAX([From_Date]), COUNT_BIG(*) FROM {TABLE}",
+)
+
+_state = get_cache("freshness")
+
+_metrics_lock = threading.Lock()
+_metrics = {"polls": 0, "poll_errors": 0, "changes_seen": 0, "invalidations_published": 0, "listener_errors": 0}
+
+_namespaces = set()
+_listeners = []
+_bus_lock = threading.Lock()
+
+
+def register_cache_namespace(namespace: str) -> None:
+    """Retire every entry of this shared cache namespace when the data changes."""
+    with _bus_lock:
+        _namespaces.add(namespace)
+
+
+def on_data_change(listener) -> None:
+    """Call `listener(old_watermark, new_watermark)` in every worker when the data changes."""
+    with _bus_lock:
+        _listeners.append(listener)
+
+
+class WatermarkPoller:
+    def __init__(self, interval=FRESHNESS_POLL_SECONDS):
+        self.interval = interval
+        self.watermark = None
+        self.changed_at = None
+        self.polled_at = None
+        self._query = FRESHNESS_QUERY or None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def read_watermark(self) -> str:
+        from db import with_sqlserver_cursor
+
+        candidates = [self._query] if self._query else list(WATERMARK_QUERIES)
+        with with_sqlserver_cursor(isolation="probe") as (conn, cur):
+            for i, query in enumerate(candidates):
+                try:
+                    cur.execute(query)
+                    row = cur.fetchone()
+                except Exception as e:
+                    if i == len(candidates) - 1:
+                        raise
+                    logger.info("Watermark query unavailable, trying a fallback: %s", e)
+                    continue
+                self._query = query
+                return "|".join("" if v is None else str(v) for v in (row or ()))
+
+    def publish(self, old, new) -> None:
+        """Invalidate the shared namespaces (once, by the first worker to notice)."""
+        shared = _state.get("watermark")
+        if shared != new:
+            with _bus_lock:
+                namespaces = sorted(_namespaces)
+            for namespace in namespaces:
+                invalidate(namespace)
+            _state.set("watermark", new)
+            with _metrics_lock:
+                _metrics["invalidations_published"] += 1
+            logger.info("Data watermark changed (%s -> %s); invalidated %s", shared, new, ", ".join(namespaces))
+
+    def notify_local(self, old, new) -> None:
+        with _bus_lock:
+            listeners = list(_listeners)
+        for listener in listeners:
+            try:
+                listener(old, new)
+            except Exception as e:
+                with _metrics_lock:
+                    _metrics["listener_errors"] += 1
+                logger.warning("Data change listener %r failed: %s", listener, e)
+
+    def poll_once(self) -> bool:
+        """Read the watermark; returns True when the data changed since the last poll."""
+        try:
+            current = self.read_watermark()
+        except Exception as e:
+            with _metrics_lock:
+                _metrics["poll_errors"] += 1
+            logger.warning("Watermark poll failed: %s", e)
+            return False
+        with _metrics_lock:
+            _metrics["polls"] += 1
+        self.polled_at = time.time()
+        previous = self.watermark
+        self.publish(previous, current)
+        self.watermark = current
+        if previous is None or previous == current:
+            return False
+        self.changed_at = self.polled_at
+        with _metrics_lock:
+            _metrics["changes_seen"] += 1
+        self.notify_local(previous, current)
+        return True
+
+    def _run(self) -> None:
+        while True:
+            self.poll_once()
+            time.sleep(self.interval)
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="freshness-poller", daemon=True)
+                self._thread.start()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def sees_updates(self) -> bool:
+        """True once a watermark query that also catches in-place updates is in use."""
+        return self.polled_at is not None and (bool(FRESHNESS_QUERY) or self._query == WATERMARK_QUERIES[0])
+
+
+_poller = WatermarkPoller()
+
+
+def start_poller():
+    if not FRESHNESS_ENABLED:
+        return {"skipped": "disabled"}
+    _poller.start()
+    return None
+
+
+def tracks_changes() -> bool:
+    """
+    True while this worker's poller is running and its watermark sees every
+    kind of reload, so caches registered here may keep entries for long.
+    """
+    return _poller.running and _poller.sees_updates
+
+
+def _reset_after_fork():
+    # The poller thread doesn't survive fork; a worker forked from a process
+    # that was polling starts its own right away.
+    global _bus_lock, _metrics_lock
+    _bus_lock = threading.Lock()
+    _metrics_lock = threading.Lock()
+    _poller._lock = threading.Lock()
+    was_polling = _poller._thread is not None
+    _poller._thread = None
+    if was_polling:
+        start_poller()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_freshness_metrics() -> dict:
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    with _bus_lock:
+        metrics["namespaces"] = sorted(_namespaces)
+        metrics["listeners"] = len(_listeners)
+    metrics.update({
+        "enabled": FRESHNESS_ENABLED,
+        "running": _poller.running,
+        "sees_updates": _poller.sees_updates,
+        "watermark": _poller.watermark,
+        "changed_at": _poller.changed_at,
+        "polled_at": _poller.polled_at,
+    })
+    return metrics
@@ -0,0 +1,245 @@
+import logging
+import os
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "1").lower() not in {"0", "false", "no"}
+# Connections opened up front in the read pool, so the first users don't pay for the connect.
+WARMUP_DB_CONNECTIONS = int(os.getenv("WARMUP_DB_CONNECTIONS", "2"))
+WARMUP_TIMEOUT_SECONDS = float(os.getenv("WARMUP_TIMEOUT_SECONDS", "5"))
+# /readyz re-runs the cheap checks at most this often; load balancers poll it every few seconds.
+READINESS_CACHE_SECONDS = float(os.getenv("READINESS_CACHE_SECONDS", "10"))
+POSAPI_BASE_URL = os.getenv("POSAPI_BASE_URL", "http://posapi.iconnectgroup.com")
+
+# A worker is ready once these pass; the others are reported but don't take it out of rotation.
+REQUIRED_CHECKS = ("sql_server", "schema_cache", "agent_graph")
+
+_started_at = time.monotonic()
+_state_lock = threading.Lock()
+_state = {"warmup": "pending", "warmup_ms": None, "warmup_steps": {}, "checks": {}, "checked_at": 0.0}
+_warmup_thread = None
+_checks_thread = None
+
+
+def _timed(name: str, fn) -> dict:
+    started = time.perf_counter()
+    try:
+        detail = fn()
+        result = {"status": "ok"}
+        if detail:
+            result["detail"] = detail
+    except Exception as e:
+        logger.warning("Readiness check %s failed: %s", name, e)
+        result = {"status": "error", "error": str(e)[:200]}
+    result["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+
+def check_sql_server():
+    from db import get_read_engine, with_sqlserver_cursor
+
+    with with_sqlserver_cursor(query_timeout=WARMUP_TIMEOUT_SECONDS) as (conn, cur):
+        cur.execute("SELECT 1")
+        cur.fetchall()
+    pool = get_read_engine().pool
+    return {"pool": pool.status()}
+
+
+def prime_sql_pool():
+    """Open WARMUP_DB_CONNECTIONS connections in the read pool at once and hand them back."""
+    from db import get_read_engine
+
+    engine = get_read_engine()
+    conns = []
+    try:
+        for _ in range(max(1, WARMUP_DB_CONNECTIONS)):
+            conns.append(engine.raw_connection())
+    finally:
+        for conn in conns:
+            conn.close()
+    return {"connections": len(conns), "pool": engine.pool.status()}
+
+
+def check_schema_cache():
+    from tools_and_primary_agent import get_schema_context, schema_context_available
+
+    get_schema_context()
+    if not schema_context_available():
+        raise RuntimeError("schema context could not be built")
+
+
+def check_agent_graph():
+    from agent_graph import get_graph
+
+    get_graph()
+
+
+def check_openai():
+    """
+    Reachability stub: fetch the SQL model's metadata through the same client
+    the agent uses, which also leaves a warm TLS connection in its pool. No
+    tokens are spent.
+    """
+    from utils import get_llm, model_for_step
+
+    llm = get_llm("sql")
+    client = getattr(llm, "root_client", None)
+    if client is None:
+        return {"skipped": "chat model has no OpenAI client"}
+    client.with_options(timeout=WARMUP_TIMEOUT_SECONDS, max_retries=0).models.retrieve(model_for_step("sql"))
+
+
+def check_posapi():
+    # Any HTTP answer means the upstream is reachable; only connection errors count as down.
+    response = requests.head(POSAPI_BASE_URL, timeout=WARMUP_TIMEOUT_SECONDS, allow_redirects=False)
+    return {"http_status": response.status_code}
+
+
+def warm_charts():
+    # Importing pyplot builds (or loads) the matplotlib font cache.
+    import chart_generator  # noqa: F401
+    from matplotlib import font_manager
+
+    font_manager.findfont("DejaVu Sans")
+
+
+def start_freshness_poller():
+    from freshness import start_poller
+
+    return start_poller()
+
+
+def start_digest_scheduler():
+    from digest import start_scheduler
+
+    return start_scheduler()
+
+
+def warm_value_index():
+    from value_index import VALUE_INDEX_ENABLED, get_value_index
+
+    if not VALUE_INDEX_ENABLED:
+        return {"skipped": "disabled"}
+    if not get_value_index().ensure_loaded():
+        raise RuntimeError("value index could not be loaded")
+
+
+READINESS_CHECKS = {
+    "sql_server": check_sql_server,
+    "schema_cache": check_schema_cache,
+    "agent_graph": check_agent_graph,
+    "openai": check_openai,
+    "posapi": check_posapi,
+}
+
+WARMUP_STEPS = {
+    "sql_pool": prime_sql_pool,
+    "schema_cache": check_schema_cache,
+    "agent_graph": check_agent_graph,
+    "openai": check_openai,
+    "charts": warm_charts,
+    "value_index": warm_value_index,
+    "freshness_poller": start_freshness_poller,
+    "digest_scheduler": start_digest_scheduler,
+}
+
+
+def run_checks() -> dict:
+    checks = {name: _timed(name, check) for name, check in READINESS_CHECKS.items()}
+    with _state_lock:
+        _state["checks"] = checks
+        _state["checked_at"] = time.monotonic()
+    return checks
+
+
+def warm_up() -> dict:
+    """Prime pools, caches and clients once per process, then record the readiness checks."""
+    with _state_lock:
+        _state["warmup"] = "running"
+    started = time.perf_counter()
+    steps = {name: _timed(name, step) for name, step in WARMUP_STEPS.items()}
+    checks = run_checks()
+    elapsed = round((time.perf_counter() - started) * 1000, 1)
+    with _state_lock:
+        _state["warmup"] = "done"
+        _state["warmup_ms"] = elapsed
+        _state["warmup_steps"] = steps
+    logger.info("Warm-up finished in %.0f ms: %s", elapsed, {n: c["status"] for n, c in checks.items()})
+    return steps
+
+
+def _refresh_checks() -> None:
+    """Re-run the readiness checks on a background thread unless a refresh is already running."""
+    global _checks_thread
+    with _state_lock:
+        if _checks_thread is not None and _checks_thread.is_alive():
+            return
+        _checks_thread = threading.Thread(target=run_checks, name="readiness-checks", daemon=True)
+        _checks_thread.start()
+
+
+def start_warmup() -> None:
+    """Start warm_up() on a background thread, once per process."""
+    global _warmup_thread
+    with _state_lock:
+        if _warmup_thread is not None:
+            return
+        _warmup_thread = threading.Thread(target=warm_up, name="warmup", daemon=True)
+        _warmup_thread.start()
+
+
+def _reset_after_fork():
+    # Warm-up primes per-process pools and clients; a forked worker does its own.
+    global _state_lock, _warmup_thread, _checks_thread, _started_at
+    _state_lock = threading.Lock()
+    _warmup_thread = None
+    _checks_thread = None
+    _started_at = time.monotonic()
+    _state.update({"warmup": "pending", "warmup_ms": None, "warmup_steps": {}, "checks": {}, "checked_at": 0.0})
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def liveness() -> dict:
+    return {"status": "ok", "pid": os.getpid(), "uptime_seconds": round(time.monotonic() - _started_at, 1)}
+
+
+def readiness():
+    """
+    Return (body, ready). Not ready until warm-up is done and every required
+    check passes. Probes never run the checks themselves: stale results are
+    refreshed by one background thread, and the probe answers from the last run.
+    """
+    start_warmup()
+    with _state_lock:
+        warmup = _state["warmup"]
+        stale = time.monotonic() - _state["checked_at"] >= READINESS_CACHE_SECONDS
+    if warmup == "done" and stale:
+        _refresh_checks()
+    with _state_lock:
+        checks = dict(_state["checks"])
+        body = {
+            "warmup": _state["warmup"],
+            "warmup_ms": _state["warmup_ms"],
+            "checks": checks,
+            "checked_seconds_ago": round(time.monotonic() - _state["checked_at"], 1) if _state["checked_at"] else None,
+        }
+    ready = warmup == "done" and all(checks.get(name, {}).get("status") == "ok" for name in REQUIRED_CHECKS)
+    body["status"] = "ready" if ready else "not_ready"
+    return body, ready
+
+
+def get_health_metrics() -> dict:
+    with _state_lock:
+        return {
+            "warmup": _state["warmup"],
+            "warmup_ms": _state["warmup_ms"],
+            "warmup_steps": dict(_state["warmup_steps"]),
+            "checks": dict(_state["checks"]),
+        }
@@ -0,0 +1,615 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+from datetime import date, timedelta
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from sqlglot import exp
+
+from cache import get_cache
+from config import load_env
+from db import RESULT_CACHE_TTL_SECONDS, execute_guarded_query, fetch_dataframe, with_sqlserver_cursor
+from freshness import register_cache_namespace
+from query_guard import QUERY_DEFAULT_ROW_CAP
+from sql_parse import DIALECT, LITERAL_OR_COMMENT_RE, SQL_PARSE_CACHE_SIZE, parse_condition, parse_sql, to_sql
+
+load_env()
+
+logger = logging.getLogger(__name__)
+
+# Time-bucketed aggregates over the fact table are answered from per-month
+# partial aggregates: completed months are computed once per query shape and
+# cached, only the open period (and any partial edge months) is queried live.
+INCREMENTAL_ENABLED = os.getenv("INCREMENTAL_ENABLED", "1").lower() not in {"0", "false", "no"}
+# A month stays open until this many days of newer data have been loaded, to
+# absorb late corrections; after that it is assumed final.
+INCREMENTAL_SETTLE_DAYS = int(os.getenv("INCREMENTAL_SETTLE_DAYS", "3"))
+# Below this many cacheable months the query simply runs as written.
+INCREMENTAL_MIN_MONTHS = int(os.getenv("INCREMENTAL_MIN_MONTHS", "2"))
+# Closed months are not dropped on a reload (only the open period changes);
+# after a historical backfill call cache.invalidate("partitions").
+PARTITION_CACHE_TTL_SECONDS = int(os.getenv("PARTITION_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+
+TABLE_NAME = "ConsolidateData_PBI"
+DATE_COLUMN = "From_Date"
+BOUNDS_QUERY = f"SELECT MIN([{DATE_COLUMN}]), MAX([{DATE_COLUMN}]) FROM [dbo].[{TABLE_NAME}]"
+BUCKET = exp.DateFromParts(
+    year=exp.Year(this=exp.column(DATE_COLUMN, quoted=True)),
+    month=exp.Month(this=exp.column(DATE_COLUMN, quoted=True)),
+    day=exp.Literal.number(1),
+)
+# Non-deterministic functions make a cached month depend on when it was computed.
+VOLATILE_RE = re.compile(
+    r"\b(GETDATE|GETUTCDATE|SYSDATETIME|SYSUTCDATETIME|SYSDATETIMEOFFSET|CURRENT_TIMESTAMP|NEWID|RAND)\b", re.IGNORECASE
+)
+UNSUPPORTED_CLAUSES = ("distinct", "joins", "having", "with", "laterals", "windows", "qualify", "offset", "into", "pivots")
+DECOMPOSABLE = (exp.Sum, exp.Count, exp.Min, exp.Max, exp.Avg)
+INTEGER_TYPES = ("int", "bigint", "smallint", "tinyint")
+NUMERIC_TYPES = ("float", "real", "decimal", "numeric", "money", "smallmoney")
+
+_partitions = get_cache("partitions", PARTITION_CACHE_TTL_SECONDS)
+_bounds = get_cache("data_bounds", max(RESULT_CACHE_TTL_SECONDS, 60))
+register_cache_namespace("data_bounds")
+
+_metrics_lock = threading.Lock()
+_metrics = {
+    "considered": 0,
+    "unsupported": 0,
+    "too_few_months": 0,
+    "incremental": 0,
+    "partitions_hit": 0,
+    "partitions_computed": 0,
+    "live_queries": 0,
+    "errors": 0,
+}
+
+
+def get_incremental_metrics() -> dict:
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    metrics["enabled"] = INCREMENTAL_ENABLED
+    metrics["partition_hit_rate"] = round(
+        metrics["partitions_hit"] / max(1, metrics["partitions_hit"] + metrics["partitions_computed"]), 4
+    )
+    return metrics
+
+
+def _count(key: str, amount: int = 1) -> None:
+    with _metrics_lock:
+        _metrics[key] += amount
+
+
+def _reset_after_fork():
+    global _metrics_lock
+    _metrics_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class Unsupported(ValueError):
+    """The query can't be split into month partials; it runs as written."""
+
+
+def _key(node) -> str:
+    # [Sales] and Sales are the same column to SQL Server.
+    return node.sql(dialect=DIALECT).replace("[", "").replace("]", "").lower()
+
+
+def _next_month(d: date) -> date:
+    return date(d.year + d.month // 12, d.month % 12 + 1, 1)
+
+
+def _month_ceil(d: date) -> date:
+    return d if d.day == 1 else _next_month(d)
+
+
+def _as_date(value):
+    if value is None:
+        return None
+    return pd.Timestamp(value).date()
+
+
+def _iso_date(node):
+    if isinstance(node, exp.Literal) and node.is_string and re.fullmatch(r"\d{4}-\d{2}-\d{2}", node.this):
+        try:
+            return date.fromisoformat(node.this)
+        except ValueError:
+            return None
+    return None
+
+
+def _is_date_column(node) -> bool:
+    return isinstance(node, exp.Column) and not node.table and node.name.lower() == DATE_COLUMN.lower()
+
+
+def _unwrap(node):
+    # sqlglot reads T-SQL YEAR(x) as YEAR(TsOrDsToDate(x)).
+    return node.this if isinstance(node, exp.TsOrDsToDate) else node
+
+
+def _conjuncts(node):
+    while isinstance(node, exp.Paren):
+        node = node.this
+    if isinstance(node, exp.And):
+        yield from _conjuncts(node.this)
+        yield from _conjuncts(node.expression)
+    else:
+        yield node
+
+
+FLIPPED = {exp.GT: exp.LT, exp.GTE: exp.LTE, exp.LT: exp.GT, exp.LTE: exp.GTE, exp.EQ: exp.EQ}
+
+
+def _covered_range(conjunct):
+    """
+    (lo, hi, exact) such that every row in a whole month inside [lo, hi)
+    satisfies `conjunct`, or None when it isn't a plain bound on the date
+    column. Bounds are conservative so they also hold if the column carries a
+    time of day; `exact` means no row outside [lo, hi) can satisfy it.
+    """
+    if isinstance(conjunct, exp.Between) and _is_date_column(conjunct.this):
+        low, high = _iso_date(conjunct.args.get("low")), _iso_date(conjunct.args.get("high"))
+        return (low, high, False) if low and high else None
+    if isinstance(conjunct, exp.EQ) and isinstance(conjunct.this, exp.Year) and _is_date_column(_unwrap(conjunct.this.this)):
+        value = conjunct.expression
+        if isinstance(value, exp.Literal) and not value.is_string and str(value.this).isdigit():
+            year = int(value.this)
+            return date(year, 1, 1), date(year + 1, 1, 1), True
+        return None
+    if type(conjunct) not in FLIPPED:
+        return None
+    op, column, value = type(conjunct), conjunct.this, conjunct.expression
+    if not _is_date_column(column):
+        op, column, value = FLIPPED[op], value, column
+    day = _iso_date(value)
+    if not _is_date_column(column) or day is None:
+        return None
+    if op is exp.GTE:
+        return day, None, True
+    if op is exp.GT:
+        return day + timedelta(days=1), None, False
+    if op in (exp.LT, exp.LTE):
+        return None, day, op is exp.LT
+    return day, day, False
+
+
+class Plan:
+    """How one aggregate SELECT splits into month partials and how to put them back together."""
+
+    def __init__(self, select, table, group_exprs, aggregates, partial_columns, where, residual, bounds, top):
+        self.select = select
+        self.table = table
+        self.group_exprs = group_exprs
+        self.aggregates = aggregates  # key -> (kind, [partial column, ...])
+        self.partial_columns = partial_columns  # [(name, expression, reducer), ...]
+        self.where = where
+        self.residual = residual
+        # lo/hi bound the months that may be cached; exact_lo/exact_hi (when
+        # known) bound every row the WHERE clause can match.
+        self.lo, self.hi, self.exact_lo, self.exact_hi = bounds
+        self.top = top
+        self.shape = hashlib.sha1(self.partial_sql(residual).encode("utf-8")).hexdigest()
+
+    def partial_sql(self, condition, bucketed: bool = False, table=None) -> str:
+        columns = [g.copy().as_(f"__g{i}") for i, g in enumerate(self.group_exprs)]
+        columns += [expression.copy().as_(name) for name, expression, _ in self.partial_columns]
+        group = [g.copy() for g in self.group_exprs]
+        if bucketed:
+            columns.append(BUCKET.copy().as_("__bucket"))
+            group.append(BUCKET.copy())
+        tree = exp.select(*columns).from_((table or self.table).copy())
+        if condition is not None:
+            tree = tree.where(condition.copy())
+        if group:
+            tree = tree.group_by(*group)
+        return to_sql(tree)
+
+    @property
+    def partial_names(self) -> list:
+        return [f"__g{i}" for i in range(len(self.group_exprs))] + [name for name, _, _ in self.partial_columns]
+
+
+def _build_plan(sql: str) -> Plan:
+    if VOLATILE_RE.search(LITERAL_OR_COMMENT_RE.sub("''", sql)):
+        raise Unsupported("non-deterministic function")
+    select = parse_sql(sql).select
+    if select is None:
+        raise Unsupported("not a single SELECT")
+    if any(select.args.get(clause) for clause in UNSUPPORTED_CLAUSES):
+        raise Unsupported("unsupported clause")
+    source = select.args.get("from_") or select.args.get("from")
+    table = source.this if source is not None else None
+    if not isinstance(table, exp.Table) or table.name.lower() != TABLE_NAME.lower():
+        raise Unsupported("not the fact table")
+    if table.args.get("sample"):
+        raise Unsupported("TABLESAMPLE")
+    if any(select.find_all(exp.Subquery, exp.Window)) or len(list(select.find_all(exp.Select))) > 1:
+        raise Unsupported("subquery or window")
+
+    top = None
+    limit = select.args.get("limit")
+    if limit is not None:
+        count = limit.args.get("expression")
+        if limit.args.get("limit_options") or not isinstance(count, exp.Literal) or not str(count.this).isdigit():
+            raise Unsupported("TOP variant")
+        top = int(count.this)
+
+    group = select.args.get("group")
+    if group is not None and any(v for k, v in group.args.items() if k != "expressions"):
+        raise Unsupported("ROLLUP / CUBE / GROUPING SETS")
+    group_exprs = list(group.expressions) if group is not None else []
+
+    aggregates, partial_columns = {}, []
+    for node in select.find_all(exp.AggFunc):
+        if not isinstance(node, DECOMPOSABLE) or any(node.find_all(exp.Distinct)):
+            raise Unsupported(f"aggregate {node.key}")
+        if any(n is not node for n in node.find_all(exp.AggFunc)):
+            raise Unsupported("nested aggregate")
+        key = _key(node)
+        if key in aggregates:
+            continue
+        i = len(aggregates)
+        if isinstance(node, exp.Avg):
+            arg = node.this.copy()
+            parts = [(f"__a{i}s", exp.Sum(this=arg), "sum"), (f"__a{i}c", exp.Count(this=arg.copy()), "count")]
+        else:
+            parts = [(f"__a{i}", node.copy(), node.key)]
+        aggregates[key] = (type(node), [name for name, _, _ in parts])
+        partial_columns.extend(parts)
+    if not aggregates:
+        raise Unsupported("no aggregate")
+
+    where = select.args.get("where")
+    where = where.this if where is not None else None
+    bounds = [None, None, None, None]
+    residual = []
+    for conjunct in _conjuncts(where) if where is not None else ():
+        covered = _covered_range(conjunct)
+        if covered is None:
+            residual.append(conjunct)
+            continue
+        c_lo, c_hi, exact = covered
+        for i, value, tighter in ((0, c_lo, max), (1, c_hi, min)):
+            if value is None:
+                continue
+            bounds[i] = value if bounds[i] is None else tighter(bounds[i], value)
+            if exact:
+                bounds[i + 2] = value if bounds[i + 2] is None else tighter(bounds[i + 2], value)
+    residual_condition = exp.and_(*[c.copy() for c in residual]) if residual else None
+
+    plan = Plan(select, table, group_exprs, aggregates, partial_columns, where, residual_condition, bounds, top)
+    # Resolve every output and ORDER BY expression once, against no rows.
+    finish(plan, pd.DataFrame(columns=plan.partial_names), row_cap=0)
+    return plan
+
+
+@lru_cache(maxsize=SQL_PARSE_CACHE_SIZE)
+def _plan_cached(sql: str):
+    try:
+        return _build_plan(sql)
+    except Unsupported as e:
+        return str(e)
+    except Exception as e:
+        # e.g. an out-of-range ORDER BY ordinal: SQL Server reports it when the query runs as written.
+        logger.debug("Incremental plan failed, running the query as written: %s", e)
+        return f"plan failed: {e}"
+
+
+def plan_query(sql: str) -> "Plan | None":
+    plan = _plan_cached(sql.strip())
+    return plan if isinstance(plan, Plan) else None
+
+
+# ---- Re-aggregation and evaluation of the outer query over merged partials ----
+
+def _collation_key(value):
+    # The table's collation is case-insensitive and ignores trailing spaces:
+    # 'North', 'NORTH' and 'North ' are one group, and sort together.
+    return value.casefold().rstrip(" ") if isinstance(value, str) else value
+
+
+def _maybe_text(column: pd.Series) -> bool:
+    return column.dtype == object or pd.api.types.is_string_dtype(column.dtype)
+
+
+def _is_text(column: pd.Series) -> bool:
+    return _maybe_text(column) and column.map(lambda v: isinstance(v, str)).any()
+
+
+def _merge(plan: Plan, frame: pd.DataFrame) -> pd.DataFrame:
+    keys = [f"__g{i}" for i in range(len(plan.group_exprs))]
+    reducers = {name: how for name, _, how in plan.partial_columns}
+    for name, how in reducers.items():
+        if how in ("sum", "count"):
+            frame[name] = pd.to_numeric(frame[name], errors="coerce")
+
+    def reduce(values, how):
+        # SUM over no (or only NULL) rows is NULL; a COUNT of partial counts is their plain sum.
+        if how == "count":
+            return values.sum()
+        if how == "sum":
+            return values.sum(min_count=1)
+        return getattr(values, how)()
+
+    if not keys:
+        # A scalar aggregate returns one row even over no rows.
+        return pd.DataFrame({name: [reduce(frame[name], how)] for name, how in reducers.items()})
+    # Each month's partial carries whichever spelling SQL Server picked for a
+    # string group; group on the collation key and keep the first spelling.
+    text_keys = [key for key in keys if _is_text(frame[key])]
+    for key in text_keys:
+        frame[f"{key}_ci"] = frame[key].map(_collation_key)
+    grouped = frame.groupby([f"{key}_ci" if key in text_keys else key for key in keys], dropna=False, sort=False)
+    columns = [reduce(grouped[name], how) for name, how in reducers.items()]
+    columns += [grouped[key].first() for key in text_keys]
+    merged = pd.concat(columns, axis=1).reset_index()
+    return merged.drop(columns=[f"{key}_ci" for key in text_keys])
+
+
+class _Env:
+    def __init__(self, plan: Plan, merged: pd.DataFrame):
+        self.index = merged.index
+        self.groups = {_key(g): merged[f"__g{i}"] for i, g in enumerate(plan.group_exprs)}
+        self.aggregates = {}
+        for key, (kind, names) in plan.aggregates.items():
+            if kind is exp.Avg:
+                total, count = merged[names[0]], merged[names[1]]
+                average = total / count.where(count != 0)
+                # AVG over an integer column is an integer in T-SQL.
+                self.aggregates[key] = np.trunc(average) if pd.api.types.is_integer_dtype(total.dtype) else average
+            else:
+                self.aggregates[key] = merged[names[0]]
+        self.aliases = {}
+
+
+def _series(value, index):
+    if isinstance(value, pd.Series):
+        return value
+    return pd.Series([np.nan if value is None else value] * len(index), index=index, dtype=None if value is not None else float)
+
+
+def _is_integer(value) -> bool:
+    if isinstance(value, pd.Series):
+        return pd.api.types.is_integer_dtype(value.dtype)
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _evaluate(node, env: _Env):
+    key = _key(node)
+    if key in env.groups:
+        return env.groups[key]
+    if isinstance(node, exp.AggFunc):
+        return env.aggregates[key]
+    if isinstance(node, exp.Column):
+        if not node.table and node.name in env.aliases:
+            return env.aliases[node.name]
+        raise Unsupported(f"column {node.name} is not grouped")
+    if isinstance(node, (exp.Paren, exp.Alias)):
+        return _evaluate(node.this, env)
+    if isinstance(node, exp.Null):
+        return None
+    if isinstance(node, exp.Literal):
+        if node.is_string:
+            return node.this
+        text = str(node.this)
+        return int(text) if text.isdigit() else float(text)
+    if isinstance(node, exp.Neg):
+        return -_series(_evaluate(node.this, env), env.index)
+    if isinstance(node, exp.Not):
+        return ~_series(_evaluate(node.this, env), env.index).astype(bool)
+
+    binary = {
+        exp.Add: lambda a, b: a + b, exp.Sub: lambda a, b: a - b, exp.Mul: lambda a, b: a * b,
+        exp.Mod: lambda a, b: a % b, exp.EQ: lambda a, b: a == b, exp.NEQ: lambda a, b: a != b,
+        exp.GT: lambda a, b: a > b, exp.GTE: lambda a, b: a >= b, exp.LT: lambda a, b: a < b,
+        exp.LTE: lambda a, b: a <= b, exp.And: lambda a, b: a & b, exp.Or: lambda a, b: a | b,
+    }
+    if type(node) in binary or isinstance(node, exp.Div):
+        left, right = _evaluate(node.this, env), _evaluate(node.expression, env)
+        a, b = _series(left, env.index), _series(right, env.index)
+        if isinstance(node, exp.Div):
+            with np.errstate(divide="ignore", invalid="ignore"):
+                quotient = a.astype(float) / b.astype(float)
+            # INT / INT is integer division in T-SQL.
+            return np.trunc(quotient) if _is_integer(left) and _is_integer(right) else quotient
+        return binary[type(node)](a, b)
+
+    if isinstance(node, exp.Case):
+        default = node.args.get("default")
+        result = _series(_evaluate(default, env) if default is not None else None, env.index)
+        for branch in reversed(node.args.get("ifs") or []):
+            condition = _series(_evaluate(branch.this, env), env.index).fillna(False).astype(bool)
+            result = _series(_evaluate(branch.args["true"], env), env.index).where(condition, result)
+        return result
+    if isinstance(node, exp.If):
+        condition = _series(_evaluate(node.this, env), env.index).fillna(False).astype(bool)
+        otherwise = node.args.get("false")
+        result = _series(_evaluate(otherwise, env) if otherwise is not None else None, env.index)
+        return _series(_evaluate(node.args["true"], env), env.index).where(condition, result)
+    if isinstance(node, exp.Nullif):
+        value = _series(_evaluate(node.this, env), env.index)
+        return value.where(value != _series(_evaluate(node.expression, env), env.index))
+    if isinstance(node, exp.Coalesce):
+        result = _series(_evaluate(node.this, env), env.index)
+        for other in node.expressions:
+            result = result.fillna(_series(_evaluate(other, env), env.index))
+        return result
+    if isinstance(node, exp.Abs):
+        return _series(_evaluate(node.this, env), env.index).abs()
+    if isinstance(node, exp.Round):
+        decimals = node.args.get("decimals")
+        digits = int(_evaluate(decimals, env)) if decimals is not None else 0
+        return _series(_evaluate(node.this, env), env.index).astype(float).round(digits)
+    if isinstance(node, exp.Cast):
+        value = _series(_evaluate(node.this, env), env.index)
+        if node.to.is_type(*INTEGER_TYPES):
+            return np.trunc(value.astype(float))
+        if node.to.is_type(*NUMERIC_TYPES):
+            return value.astype(float)
+        raise Unsupported(f"CAST to {node.to.sql(dialect=DIALECT)}")
+    raise Unsupported(f"expression {node.key}")
+
+
+def _output_name(node) -> str:
+    if isinstance(node, exp.Alias):
+        return node.alias
+    if isinstance(node, exp.Column):
+        return node.name
+    return ""
+
+
+def _order_key(node, env: _Env, result: pd.DataFrame):
+    # ORDER BY 2 refers to the second output column.
+    if isinstance(node, exp.Literal) and not node.is_string and str(node.this).isdigit():
+        return result.iloc[:, int(node.this) - 1]
+    return _series(_evaluate(node, env), env.index)
+
+
+def finish(plan: Plan, frame: pd.DataFrame, row_cap=None) -> pd.DataFrame:
+    """Re-aggregate the partial rows and evaluate the original select list, ORDER BY and TOP."""
+    merged = _merge(plan, frame)
+    env = _Env(plan, merged)
+    names, columns = [], []
+    for node in plan.select.expressions:
+        value = _series(_evaluate(node, env), env.index)
+        names.append(_output_name(node))
+        columns.append(value.to_numpy())
+        if isinstance(node, exp.Alias):
+            env.aliases[node.alias] = value
+    result = pd.DataFrame({i: column for i, column in enumerate(columns)}, index=env.index)
+    result.columns = names
+
+    order = plan.select.args.get("order")
+    if order is not None and plan.top is not None:
+        # Collation order isn't Python's, so TOP could keep different rows than SQL Server.
+        for ordered in order.expressions:
+            if _maybe_text(_order_key(ordered.this, env, result)):
+                raise Unsupported("TOP over a string ORDER BY")
+    if order is not None and len(result):
+        keys = pd.DataFrame({f"k{i}": _order_key(ordered.this, env, result) for i, ordered in enumerate(order.expressions)})
+        for column in keys.columns:
+            if _is_text(keys[column]):
+                keys[column] = keys[column].map(_collation_key)
+        ascending = [not ordered.args.get("desc") for ordered in order.expressions]
+        # SQL Server sorts NULLs lowest.
+        keys = keys.sort_values(list(keys.columns), ascending=ascending, kind="stable",
+                                na_position="first" if ascending[0] else "last")
+        result = result.loc[keys.index]
+    if plan.top is not None:
+        result = result.head(plan.top)
+    cap = QUERY_DEFAULT_ROW_CAP if row_cap is None else row_cap
+    truncated = bool(cap and cap > 0 and len(result) > cap)
+    if truncated:
+        result = result.head(cap)
+    result = result.reset_index(drop=True)
+    if truncated:
+        result.attrs["truncated"] = True
+    return result
+
+
+# ---- Execution ----
+
+def data_bounds():
+    """(first, last) business date in the table; re-read whenever the data watermark moves."""
+    bounds = _bounds.get("bounds")
+    if bounds is None:
+        with with_sqlserver_cursor() as (conn, cur):
+            cur.execute(BOUNDS_QUERY)
+            row = cur.fetchone()
+        bounds = (_as_date(row[0]), _as_date(row[1])) if row else (None, None)
+        _bounds.set("bounds", bounds)
+    return bounds
+
+
+def _closed_months(plan: Plan, first: date, last: date) -> list:
+    open_start = (last - timedelta(days=INCREMENTAL_SETTLE_DAYS)).replace(day=1)
+    start = _month_ceil(plan.lo or first)
+    end = min(plan.hi, open_start) if plan.hi else open_start
+    months = []
+    while _next_month(start) <= end:
+        months.append(start)
+        start = _next_month(start)
+    return months
+
+
+def _run_live(plan: Plan, condition) -> pd.DataFrame:
+    _count("live_queries")
+    with with_sqlserver_cursor() as (conn, cur):
+        # Partials are grouped rows, not the answer: no row cap here.
+        execute_guarded_query(cur, plan.partial_sql(condition, bucketed=True), row_cap=0)
+        df = fetch_dataframe(cur)
+    if df.empty:
+        return pd.DataFrame(columns=plan.partial_names + ["__bucket"])
+    df["__bucket"] = pd.to_datetime(df["__bucket"]).dt.date
+    return df
+
+
+def _live_condition(plan: Plan, run_start: date, run_end: date, missing: list):
+    column = f"[{DATE_COLUMN}]"
+    outside = f"{column} < '{run_start.isoformat()}' OR {column} >= '{run_end.isoformat()}'"
+    if missing:
+        outside += f" OR ({column} >= '{missing[0].isoformat()}' AND {column} < '{_next_month(missing[-1]).isoformat()}')"
+    condition = parse_condition(f"({outside})")
+    return exp.and_(plan.where.copy(), condition) if plan.where is not None else condition
+
+
+def run_incremental(sql: str, row_cap=None) -> "pd.DataFrame | None":
+    """
+    Answer `sql` from cached closed-month partials plus one live query for the
+    rest, or return None when the query isn't a decomposable aggregate over a
+    long enough range (the caller then runs it as written).
+    """
+    if not INCREMENTAL_ENABLED or PARTITION_CACHE_TTL_SECONDS <= 0:
+        return None
+    _count("considered")
+    plan = plan_query(sql)
+    if plan is None:
+        _count("unsupported")
+        return None
+    try:
+        first, last = data_bounds()
+        if first is None:
+            return None
+        months = _closed_months(plan, first, last)
+        if len(months) < INCREMENTAL_MIN_MONTHS:
+            _count("too_few_months")
+            return None
+
+        cached = {}
+        for month in months:
+            part = _partitions.get(f"{plan.shape}:{month.isoformat()}")
+            if part is not None:
+                cached[month] = part
+        missing = [m for m in months if m not in cached]
+        # One live query: the open period, partial edge months and every
+        # closed month between the first and last missing one.
+        recompute = [m for m in months if missing and missing[0] <= m <= missing[-1]]
+        run_end = _next_month(months[-1])
+        if recompute or not (plan.exact_lo and plan.exact_hi and plan.exact_lo >= months[0] and plan.exact_hi <= run_end):
+            live = _run_live(plan, _live_condition(plan, months[0], run_end, recompute))
+        else:
+            # The query lies entirely inside cached months.
+            live = pd.DataFrame(columns=plan.partial_names + ["__bucket"])
+        for month in recompute:
+            part = live.loc[live["__bucket"] == month, plan.partial_names].reset_index(drop=True)
+            _partitions.set(f"{plan.shape}:{month.isoformat()}", part)
+
+        frames = [cached[m] for m in months if m in cached and m not in recompute]
+        frames.append(live[plan.partial_names])
+        frames = [f for f in frames if not f.empty]
+        frame = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=plan.partial_names)
+        result = finish(plan, frame, row_cap=row_cap)
+    except Exception as e:
+        _count("errors")
+        logger.warning("Incremental evaluation failed, running the query as written: %s", e)
+        return None
+    _count("incremental")
+    _count("partitions_hit", len(months) - len(recompute))
+    _count("partitions_computed", len(recompute))
+    return result
@@ -0,0 +1,369 @@
+import calendar
+import json
+import logging
+import os
+import re
+import threading
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+from prompt_helper import (
+    LEVEL_PHRASE_TO_CONDITION,
+    _append_condition,
+    _ensure_not_blank,
+    _inject_group_by_sum_sales,
+)
+
+logger = logging.getLogger(__name__)
+
+TABLE = "[dbo].[ConsolidateData_PBI]"
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "1").lower() not in {"0", "false", "no"}
+FAST_PATH_LLM_SLOTS = os.getenv("FAST_PATH_LLM_SLOTS", "1").lower() not in {"0", "false", "no"}
+MAX_TOP_N = 50
+
+# Store-level detail rows roll up cleanly to companies and regions, so every
+# template aggregates over them instead of mixing pre-aggregated levels.
+DETAIL_LEVEL_CONDITION = LEVEL_PHRASE_TO_CONDITION["store level data"]
+
+ENTITIES = {
+    "store": ("[Profitcenter_Name]", "Store Name"),
+    "company": ("[Company_Name]", "Company Name"),
+    "region": ("[Region_Name]", "Region Name"),
+}
+
+TEMPLATES = {
+    "total_sales": "SELECT SUM([Sales]) AS [Total Sales] FROM {table} WHERE {where}",
+    "traffic": "SELECT SUM([Traffic Count]) AS [Traffic Count] FROM {table} WHERE {where}",
+    "yoy_sales": (
+        "SELECT SUM([Sales]) AS [Sales], SUM([LastYearSales]) AS [Last Year Sales], "
+        "CASE WHEN SUM([LastYearSales]) = 0 THEN NULL "
+        "ELSE (SUM([Sales]) - SUM([LastYearSales])) * 100.0 / SUM([LastYearSales]) END AS [Sales YoY Change (%)] "
+        "FROM {table} WHERE {where}"
+    ),
+    "top_n": "SELECT TOP {n} {entity} FROM {table} WHERE {where}",
+}
+
+MONTHS = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+MONTHS.update({name.lower(): i for i, name in enumerate(calendar.month_abbr) if name})
+MONTH_ALT = "|".join(sorted(MONTHS, key=len, reverse=True))
+# "may" is far more often a verb than a month, so it only counts with a preposition or a year.
+MONTH_RE = re.compile(rf"\b(?:in|for|during|of)\s+({MONTH_ALT})\.?(?:\s+(20\d\d))?\b|\b({MONTH_ALT})\.?\s+(20\d\d)\b")
+
+# Anything beyond a plain metric over a date range goes to the full agent.
+COMPLEX_MARKERS = re.compile(
+    r"\b(by|per|each|every|trend|compare|compared|versus|vs|average|avg|margin|salesperson|sales ?person|"
+    r"employee|ticket|tickets|bedding|fpp|protection|delivery|delivered|written|finance|financing|financed|"
+    r"discount|goal|customer|customers|cogs|profit|tax|why|chart|graph|plot|where|except|exclude|"
+    r"without|not)\b"
+)
+TOP_N_RE = re.compile(
+    r"\b(?P<dir>top|best|highest|leading|bottom|worst|lowest)\s+(?P<n>\d{1,3}\s+)?(?P<entity>stores?|companies|company|regions?)\b"
+)
+WHICH_ENTITY_RE = re.compile(
+    r"\bwhich\s+(?P<entity>store|company|region)\s+(?:has|had|made|did|sold|generated)\s+(?:the\s+)?"
+    r"(?P<dir>most|highest|best|least|lowest|worst)\b"
+)
+YOY_RE = re.compile(r"\b(yoy|year[\s-]+over[\s-]+year|(?:vs\.?|versus|compared\s+to|against)\s+last\s+year)\b")
+TRAFFIC_RE = re.compile(r"\b(traffic|foot\s*fall|footfall|ups)\b")
+SALES_RE = re.compile(r"\bsales?\b|\brevenue\b")
+# Words a plain fast-path question is made of. Anything else left over (a store,
+# company or region name, "Dallas", "East region", ...) is a filter the
+# templates can't express, so the question goes to the agent instead.
+PLAIN_WORDS = frozenset(
+    """
+    a an the our my we us me i you it its all so far please show tell give get list
+    what what's whats which who how much many is are was were did do does have has had
+    make made sell sold generate generated bring brought in total overall altogether combined
+    sale sales revenue traffic foot footfall fall ups
+    in for during of on at to from between and until through till since
+    today yesterday this current last past previous week weeks weekend month months year years
+    day days date to-date wtd mtd ytd quarter q1 q2 q3 q4
+    top best highest leading bottom worst lowest least most stores store companies company regions region
+    with terms
+    """.split()
+) | frozenset(MONTHS)
+WORD_RE = re.compile(r"[a-z][a-z0-9'-]*")
+ISO_DATE_RE = re.compile(r"\b\d{4}-\d{2}-\d{2}\b")
+DATEISH_RE = re.compile(rf"\b({MONTH_ALT.replace('|may', '')}|q[1-4]|quarter|week|weekend|month|year|day|days|\d{{1,4}}[/-]\d{{1,2}}|20\d\d)\b")
+# A date right after / before these is one end of an open range, not the whole range.
+OPEN_BEFORE_RE = re.compile(r"\b(?:since|until|till|through|thru|before|after|from|to|up\s+to|starting|beginning)\s*$")
+OPEN_AFTER_RE = re.compile(r"\s*(?:onwards?|and\s+(?:later|after|before|earlier)|or\s+(?:later|after|before|earlier))\b")
+
+_metrics_lock = threading.Lock()
+_metrics = {"matched": 0, "fallback": 0, "llm_slot_calls": 0, "by_intent": {}}
+
+
+def get_fast_path_metrics() -> dict:
+    with _metrics_lock:
+        return {**_metrics, "by_intent": dict(_metrics["by_intent"])}
+
+
+def _count(key: str, intent: str = None) -> None:
+    with _metrics_lock:
+        _metrics[key] += 1
+        if intent:
+            _metrics["by_intent"][intent] = _metrics["by_intent"].get(intent, 0) + 1
+
+
+@dataclass
+class DateRange:
+    start: date
+    end: date  # exclusive
+    label: str
+
+    def condition(self) -> str:
+        return f"[From_Date] >= '{self.start.isoformat()}' AND [From_Date] < '{self.end.isoformat()}'"
+
+
+@dataclass
+class FastPathMatch:
+    intent: str
+    sql: str
+    text: str
+
+
+class UnresolvedDate(ValueError):
+    pass
+
+
+def _month_range(year: int, month: int) -> tuple[date, date]:
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start, end
+
+
+def _parse_iso(value: str) -> date:
+    return date.fromisoformat(value)
+
+
+def _date_phrases(today: date) -> list:
+    """(pattern, builder) for every date phrase the fast path resolves, most specific first."""
+    week_start = today - timedelta(days=today.weekday())
+    tomorrow = today + timedelta(days=1)
+
+    def iso_range(m):
+        start, end = _parse_iso(m.group(1)), _parse_iso(m.group(2))
+        if end < start:
+            raise UnresolvedDate(m.group(0))
+        return DateRange(start, end + timedelta(days=1), f"{start.isoformat()} to {end.isoformat()}")
+
+    def iso_day(m):
+        day = _parse_iso(m.group(1))
+        return DateRange(day, day + timedelta(days=1), day.isoformat())
+
+    def last_days(m):
+        days = int(m.group(1))
+        if days < 1:
+            raise UnresolvedDate(m.group(0))
+        # N days including today.
+        return DateRange(today - timedelta(days=days - 1), tomorrow, f"the last {days} days")
+
+    def last_month(m):
+        end = today.replace(day=1)
+        return DateRange((end - timedelta(days=1)).replace(day=1), end, "last month")
+
+    def quarter(m):
+        q = int(m.group(1))
+        year = int(m.group(2)) if m.group(2) else today.year
+        return DateRange(date(year, 3 * q - 2, 1), _month_range(year, 3 * q)[1], f"Q{q} {year}")
+
+    def month(m):
+        number = MONTHS[m.group(1) or m.group(3)]
+        if m.group(2) or m.group(4):
+            year = int(m.group(2) or m.group(4))
+        else:
+            year = today.year if number <= today.month else today.year - 1
+        start, end = _month_range(year, number)
+        return DateRange(start, end, f"{calendar.month_name[number]} {year}")
+
+    def year(m):
+        y = int(m.group(1))
+        return DateRange(date(y, 1, 1), date(y + 1, 1, 1), str(y))
+
+    return [
+        (r"\b(?:from|between)\s+(\d{4}-\d{2}-\d{2})\s+(?:to|and|until|-)\s+(\d{4}-\d{2}-\d{2})\b", iso_range),
+        (r"\b(?:on\s+)?(\d{4}-\d{2}-\d{2})\b", iso_day),
+        (r"\btoday\b", lambda m: DateRange(today, tomorrow, "today")),
+        (r"\byesterday\b", lambda m: DateRange(today - timedelta(days=1), today, "yesterday")),
+        (r"\b(?:last|past|previous)\s+(\d{1,3})\s+days\b", last_days),
+        (r"\b(?:this|current)\s+week\b|\bweek\s+to\s+date\b|\bwtd\b", lambda m: DateRange(week_start, tomorrow, "this week")),
+        (r"\b(?:last|previous|past)\s+week\b", lambda m: DateRange(week_start - timedelta(days=7), week_start, "last week")),
+        (r"\b(?:this|current)\s+month\b|\bmonth\s+to\s+date\b|\bmtd\b", lambda m: DateRange(today.replace(day=1), tomorrow, "this month")),
+        (r"\b(?:last|previous|past)\s+month\b", last_month),
+        (r"\b(?:this|current)\s+year\b|\byear\s+to\s+date\b|\bytd\b", lambda m: DateRange(date(today.year, 1, 1), tomorrow, "this year")),
+        (r"\b(?:last|previous|past)\s+year\b", lambda m: DateRange(date(today.year - 1, 1, 1), date(today.year, 1, 1), "last year")),
+        (r"\bq([1-4])(?:\s+(20\d\d))?\b", quarter),
+        (MONTH_RE, month),
+        (r"\b(?:(?:in|for|during)\s+)?(20\d\d)\b", year),
+    ]
+
+
+def parse_date_range(text: str, today: date = None) -> "DateRange | None":
+    """
+    Resolve the common relative/absolute date phrases to a half-open range.
+    Returns None when the question carries no date phrase at all and raises
+    UnresolvedDate when it has date-looking words we can't pin down: more than
+    one date phrase ("january and february", "from march to may"), or an
+    open-ended one ("since 2024-03-01", "until last month").
+    """
+    today = today or date.today()
+    t = text.lower()
+
+    found = []
+    for pattern, build in _date_phrases(today):
+        for m in re.finditer(pattern, t):
+            if not any(m.start() < end and start < m.end() for start, end, _, _ in found):
+                found.append((m.start(), m.end(), build, m))
+    if not found:
+        if DATEISH_RE.search(t):
+            raise UnresolvedDate(text)
+        return None
+
+    start, end, build, m = found[0]
+    rest = t[:start] + " " + t[end:]
+    if len(found) > 1 or DATEISH_RE.search(rest) or OPEN_BEFORE_RE.search(t[:start]) or OPEN_AFTER_RE.match(t[end:]):
+        raise UnresolvedDate(text)
+    return build(m)
+
+
+def extract_date_range_with_llm(question: str, today: date = None) -> "DateRange | None":
+    """One cheap LLM call to turn a date phrase the regexes missed into an explicit range."""
+    today = today or date.today()
+    _count("llm_slot_calls")
+    prompt = (
+        f"Today is {today.isoformat()} ({today.strftime('%A')}). "
+        "Extract the date range the question refers to. Reply with JSON only: "
+        '{"start": "YYYY-MM-DD", "end": "YYYY-MM-DD"} where end is inclusive, '
+        'or {"start": null, "end": null} if there is no date range or it asks about '
+        'separate periods (e.g. comparing two years).\n'
+        f"Question: {question}"
+    )
+    from utils import get_llm, record_model_usage
+
+    result = get_llm("slots").invoke(prompt)
+    record_model_usage("slots", result)
+    content = result.content
+    m = re.search(r"\{[\s\S]*\}", content or "")
+    if not m:
+        return None
+    data = json.loads(m.group(0))
+    if not data.get("start") or not data.get("end"):
+        return None
+    start, end = _parse_iso(data["start"]), _parse_iso(data["end"])
+    if end < start:
+        return None
+    return DateRange(start, end + timedelta(days=1), f"{start.isoformat()} to {end.isoformat()}")
+
+
+def _base_where(date_range: "DateRange | None", entity_col: str = None) -> str:
+    sql = f"WHERE [From_Date] IS NOT NULL AND {DETAIL_LEVEL_CONDITION}"
+    sql = _ensure_not_blank(sql, "[Company_Name]")
+    sql = _ensure_not_blank(sql, "[Region_Name]")
+    if entity_col == "[Profitcenter_Name]":
+        sql = _ensure_not_blank(sql, "[Profitcenter_Name]")
+    if date_range:
+        sql = _append_condition(sql, date_range.condition())
+    # The helpers expect a WHERE block to append to; the templates supply their own.
+    return re.sub(r"^\s*WHERE\s+", "", sql)
+
+
+def _period_text(date_range: "DateRange | None") -> str:
+    return f" for {date_range.label}" if date_range else ""
+
+
+def _names_a_filter(text: str) -> bool:
+    """True when `text` has words beyond metric, date and filler vocabulary, e.g. a store or region name."""
+    return any(word not in PLAIN_WORDS for word in WORD_RE.findall(ISO_DATE_RE.sub(" ", text)))
+
+
+def classify_intent(question: str) -> "tuple[str, dict] | None":
+    q = " ".join(question.lower().split())
+
+    m = TOP_N_RE.search(q) or WHICH_ENTITY_RE.search(q)
+    if m:
+        rest = q[:m.start()] + " " + q[m.end():]
+        if TRAFFIC_RE.search(rest) or COMPLEX_MARKERS.search(rest.replace(" by sales", " ")):
+            return None
+        # "top 5 stores in the East region": the entity words only count as the ranked entity.
+        if _names_a_filter(rest.replace(" by sales", " ")) or re.search(r"\b(stores?|compan(?:y|ies)|regions?)\b", rest):
+            return None
+        entity = m.group("entity").rstrip("s")
+        entity = "company" if entity.startswith("compan") else entity
+        n = int((m.groupdict().get("n") or "").strip() or (1 if "which" in m.group(0) else 10))
+        descending = m.group("dir") not in {"bottom", "worst", "lowest", "least"}
+        return "top_n", {"entity": entity, "n": max(1, min(n, MAX_TOP_N)), "descending": descending}
+
+    if COMPLEX_MARKERS.search(YOY_RE.sub(" ", q)):
+        return None
+    # The templates aggregate over every store; a named store, company or region needs the agent.
+    if _names_a_filter(YOY_RE.sub(" ", q)) or re.search(r"\b(stores?|compan(?:y|ies)|regions?)\b", q):
+        return None
+    if YOY_RE.search(q) and SALES_RE.search(q):
+        return "yoy_sales", {}
+    if TRAFFIC_RE.search(q) and not SALES_RE.search(q):
+        return "traffic", {}
+    if SALES_RE.search(q) and re.search(r"\b(total|overall|how much|what (?:are|were|is|was))\b", q):
+        return "total_sales", {}
+    return None
+
+
+def build_sql(intent: str, slots: dict, date_range: "DateRange | None") -> FastPathMatch:
+    period = _period_text(date_range)
+    if intent == "top_n":
+        entity_col, alias = ENTITIES[slots["entity"]]
+        where = _base_where(date_range, entity_col)
+        base = TEMPLATES["top_n"].format(n=slots["n"], entity=entity_col, table=TABLE, where=where)
+        sql = _inject_group_by_sum_sales(base, entity_col, out_alias=alias)
+        if not slots["descending"]:
+            sql = sql.replace("ORDER BY SUM([Sales]) DESC", "ORDER BY SUM([Sales]) ASC")
+        if slots["n"] == 1:
+            label = "highest" if slots["descending"] else "lowest"
+            text = f"Here is the {slots['entity']} with the {label} sales{period}."
+        else:
+            label = "top" if slots["descending"] else "bottom"
+            noun = {"store": "stores", "company": "companies", "region": "regions"}[slots["entity"]]
+            text = f"Here are the {label} {slots['n']} {noun} by sales{period}."
+        return FastPathMatch(intent, sql, text)
+
+    sql = TEMPLATES[intent].format(table=TABLE, where=_base_where(date_range))
+    text = {
+        "total_sales": f"Here are the total sales{period}.",
+        "traffic": f"Here is the total store traffic{period}.",
+        "yoy_sales": f"Here are the sales{period} compared with the same period last year.",
+    }[intent]
+    return FastPathMatch(intent, sql, text)
+
+
+def route_question(question: str, today: date = None) -> "FastPathMatch | None":
+    """
+    Match the question against the known fast-path intents and return a
+    ready-to-run T-SQL statement, or None to fall back to the full agent.
+    """
+    if not FAST_PATH_ENABLED:
+        return None
+
+    intent = classify_intent(question)
+    if not intent:
+        _count("fallback")
+        return None
+    intent_name, slots = intent
+
+    try:
+        date_range = parse_date_range(YOY_RE.sub(" ", question.lower()), today)
+    except UnresolvedDate:
+        if not FAST_PATH_LLM_SLOTS:
+            _count("fallback")
+            return None
+        try:
+            date_range = extract_date_range_with_llm(question, today)
+        except Exception as e:
+            logger.warning("Fast-path slot extraction failed, falling back to agent: %s", e)
+            date_range = None
+        if date_range is None:
+            _count("fallback")
+            return None
+
+    match = build_sql(intent_name, slots, date_range)
+    _count("matched", intent_name)
+    logger.info("Fast-path intent '%s' matched for question: %s", intent_name, question)
+    return match
@@ -0,0 +1,254 @@
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()  # json | text
+LOG_FILE_PATH = os.getenv("LOG_FILE_PATH", "logs/app.log")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(20 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_TO_STDERR = os.getenv("LOG_TO_STDERR", "0").lower() in {"1", "true", "yes"}
+# Records beyond this many waiting for the writer thread are dropped (and counted), never blocked on.
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Share of requests whose DEBUG records are kept when LOG_LEVEL=DEBUG; the
+# decision is made once per request so a sampled request logs its whole trace.
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.05"))
+# Extra regexes to mask, comma separated; the first group (if any) is kept.
+LOG_REDACT_PATTERNS = [p.strip() for p in os.getenv("LOG_REDACT_PATTERNS", "").split(",") if p.strip()]
+LOG_REDACT_SQL_LITERALS = os.getenv("LOG_REDACT_SQL_LITERALS", "0").lower() in {"1", "true", "yes"}
+
+# Libraries that are chatty at DEBUG; they stay at WARNING whatever LOG_LEVEL says.
+QUIET_LOGGERS = ("urllib3", "httpx", "httpcore", "openai", "matplotlib", "PIL", "sqlalchemy.engine")
+
+REDACTED = "[REDACTED]"
+DEFAULT_REDACT_PATTERNS = [
+    r"(Bearer\s+)[A-Za-z0-9\-._~+/]+=*",
+    r"((?:password|passwd|pwd|api[_-]?key|secret|token|auth_?code)[\"']?\s*[:=]\s*[\"']?)[^\s\"',;&}]+",
+    r"(sk-)[A-Za-z0-9_\-]{8,}",
+]
+# The default patterns only run on text containing one of these (a plain substring scan is far cheaper).
+DEFAULT_REDACT_TRIGGERS = ("bearer", "pass", "pwd", "key", "secret", "token", "auth", "sk-")
+SQL_LITERAL_RE = re.compile(r"N?'(?:[^']|'')*'")
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+_debug_sampled_var = contextvars.ContextVar("debug_sampled", default=None)
+
+# LogRecord attributes that are not user-supplied `extra` fields.
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+_metrics_lock = threading.Lock()
+_metrics = {"enqueued": 0, "dropped": 0, "debug_sampled_out": 0, "redactions": 0}
+
+_listener = None
+_queue_handler = None
+_setup_lock = threading.Lock()
+
+
+def get_logging_metrics() -> dict:
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    metrics["queue_depth"] = _queue_handler.queue.qsize() if _queue_handler else 0
+    return metrics
+
+
+def _count(key: str, amount: int = 1) -> None:
+    with _metrics_lock:
+        _metrics[key] += amount
+
+
+def new_request_id(incoming: str = None) -> str:
+    """Use the caller's X-Request-Id when it looks sane, otherwise mint one."""
+    if incoming and re.fullmatch(r"[A-Za-z0-9\-_.:]{1,64}", incoming):
+        return incoming
+    return uuid.uuid4().hex
+
+
+def bind_request(request_id: str):
+    """Set the correlation ID (and the DEBUG sampling decision) for this context; returns reset tokens."""
+    sampled = random.random() < LOG_DEBUG_SAMPLE_RATE
+    return request_id_var.set(request_id), _debug_sampled_var.set(sampled)
+
+
+def unbind_request(tokens) -> None:
+    request_id_token, sampled_token = tokens
+    request_id_var.reset(request_id_token)
+    _debug_sampled_var.reset(sampled_token)
+
+
+class Redactor:
+    def __init__(self, patterns=None, sql_literals: bool = False):
+        self.default_patterns = [re.compile(p, re.IGNORECASE) for p in DEFAULT_REDACT_PATTERNS]
+        self.patterns = [re.compile(p, re.IGNORECASE) for p in (patterns or [])]
+        self.sql_literals = sql_literals
+
+    @staticmethod
+    def _mask(match) -> str:
+        return (match.group(1) if match.re.groups else "") + REDACTED
+
+    def __call__(self, text: str) -> str:
+        hits = 0
+        lowered = text.lower()
+        patterns = self.patterns
+        if any(trigger in lowered for trigger in DEFAULT_REDACT_TRIGGERS):
+            patterns = self.default_patterns + patterns
+        for pattern in patterns:
+            text, n = pattern.subn(self._mask, text)
+            hits += n
+        if self.sql_literals:
+            text, n = SQL_LITERAL_RE.subn("'?'", text)
+            hits += n
+        if hits:
+            _count("redactions", hits)
+        return text
+
+
+class ContextFilter(logging.Filter):
+    """
+    Runs on the calling thread: stamps the request ID and drops DEBUG records
+    of requests that were not sampled. Everything else happens on the writer thread.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        if record.levelno > logging.DEBUG:
+            return True
+        sampled = _debug_sampled_var.get()
+        if sampled is None:
+            sampled = random.random() < LOG_DEBUG_SAMPLE_RATE
+        if not sampled:
+            _count("debug_sampled_out")
+        return sampled
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that never blocks the request path: a full queue drops the record."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge args now (they may be mutated later) and render the traceback
+        # to text, but leave formatting and redaction to the writer thread.
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if record.stack_info:
+            record.exc_text = (record.exc_text + "\n" if record.exc_text else "") + record.stack_info
+            record.stack_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+            _count("enqueued")
+        except queue.Full:
+            _count("dropped")
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, redactor):
+        super().__init__()
+        self.redactor = redactor
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": self.redactor(str(record.msg)),
+            "request_id": getattr(record, "request_id", None),
+            "thread": record.threadName,
+            "pid": record.process,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = self.redactor(value) if isinstance(value, str) else value
+        if record.exc_text:
+            entry["exception"] = self.redactor(record.exc_text)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self, redactor):
+        super().__init__("[%(asctime)s] %(levelname)s [%(request_id)s] %(name)s: %(message)s")
+        self.redactor = redactor
+
+    def format(self, record: logging.LogRecord) -> str:
+        if not hasattr(record, "request_id"):
+            record.request_id = None
+        return self.redactor(super().format(record))
+
+
+def _build_handlers():
+    redactor = Redactor(LOG_REDACT_PATTERNS, LOG_REDACT_SQL_LITERALS)
+    formatter = JsonFormatter(redactor) if LOG_FORMAT == "json" else TextFormatter(redactor)
+    handlers = []
+    if LOG_FILE_PATH:
+        os.makedirs(os.path.dirname(LOG_FILE_PATH) or ".", exist_ok=True)
+        handlers.append(RotatingFileHandler(LOG_FILE_PATH, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"))
+    if LOG_TO_STDERR or not handlers:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+
+def configure_logging() -> None:
+    """
+    Route every logger through one bounded in-memory queue. Request threads
+    only enqueue a record; a single QueueListener thread formats, redacts and
+    writes it. Idempotent.
+    """
+    global _listener, _queue_handler
+    with _setup_lock:
+        if _listener is not None:
+            return
+        _queue_handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        _queue_handler.addFilter(ContextFilter())
+        _listener = QueueListener(_queue_handler.queue, *_build_handlers(), respect_handler_level=True)
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_queue_handler)
+        root.setLevel(LOG_LEVEL)
+        for name in QUIET_LOGGERS:
+            logging.getLogger(name).setLevel(max(logging.WARNING, root.level))
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Flush what is queued and stop the writer thread."""
+    global _listener
+    with _setup_lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        _listener = None
+
+
+def _reset_after_fork():
+    # The writer thread doesn't survive fork, and the queue's lock may have
+    # been held by it; give the child a fresh queue and its own writer.
+    global _listener, _setup_lock
+    _setup_lock = threading.Lock()
+    if _listener is None:
+        return
+    handlers = _listener.handlers
+    _queue_handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+    _listener = QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
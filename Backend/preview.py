@@ -0,0 +1,303 @@
+import contextvars
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from sqlglot import exp
+
+from cache import get_cache
+from config import load_env
+from freshness import register_cache_namespace
+from sql_parse import DIALECT, parse_sql, to_sql
+
+load_env()
+
+logger = logging.getLogger(__name__)
+
+# Preview answers run the generated aggregate over a sample of the fact table
+# and scale it up; the exact query then runs in the background.
+PREVIEW_ENABLED = os.getenv("PREVIEW_ENABLED", "1").lower() not in {"0", "false", "no"}
+# tablesample - TABLESAMPLE SYSTEM on the live table (page sample; no upkeep). Scaled by
+#               the fraction of rows the sample actually returned; no error bounds, since
+#               rows on a page aren't independent and the row-level variance understates them.
+# table       - a maintained row sample, PREVIEW_SAMPLE_TABLE holding PREVIEW_SAMPLE_PERCENT of
+#               the rows; estimates come with error bounds.
+PREVIEW_SOURCE = os.getenv("PREVIEW_SOURCE", "tablesample").lower()
+PREVIEW_SAMPLE_PERCENT = float(os.getenv("PREVIEW_SAMPLE_PERCENT", "2"))
+PREVIEW_SAMPLE_TABLE = os.getenv("PREVIEW_SAMPLE_TABLE", "[dbo].[ConsolidateData_PBI_Sample]")
+# A fixed seed makes the page sample repeatable, so previews are stable and cacheable; empty for a fresh sample.
+PREVIEW_SAMPLE_SEED = os.getenv("PREVIEW_SAMPLE_SEED", "42").strip()
+# Normal quantile of the reported bounds; 1.96 is a 95% interval.
+PREVIEW_CONFIDENCE_Z = float(os.getenv("PREVIEW_CONFIDENCE_Z", "1.96"))
+PREVIEW_EXACT_WORKERS = int(os.getenv("PREVIEW_EXACT_WORKERS", "2"))
+PREVIEW_JOB_TTL_SECONDS = int(os.getenv("PREVIEW_JOB_TTL_SECONDS", "900"))
+# Longest a poll may block waiting for the exact answer (?wait=N).
+PREVIEW_MAX_WAIT_SECONDS = float(os.getenv("PREVIEW_MAX_WAIT_SECONDS", "25"))
+
+VARIANCE_PREFIX = "__var"
+
+_jobs = get_cache("exact_jobs", PREVIEW_JOB_TTL_SECONDS)
+# Realized page-sample fractions; a fixed seed picks the same pages until the table is reloaded.
+_fractions = get_cache("sample_fractions", PREVIEW_JOB_TTL_SECONDS)
+register_cache_namespace("sample_fractions")
+_executor = None
+_executor_lock = threading.Lock()
+
+_metrics_lock = threading.Lock()
+_metrics = {
+    "previews": 0,
+    "unsupported": 0,
+    "already_exact": 0,
+    "preview_errors": 0,
+    "nominal_fraction": 0,
+    "exact_submitted": 0,
+    "exact_completed": 0,
+    "exact_failed": 0,
+}
+
+
+def get_preview_metrics() -> dict:
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    metrics["enabled"] = PREVIEW_ENABLED
+    metrics["source"] = PREVIEW_SOURCE
+    return metrics
+
+
+def _count(key: str, amount: int = 1) -> None:
+    with _metrics_lock:
+        _metrics[key] += amount
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PREVIEW_EXACT_WORKERS, thread_name_prefix="exact-answer")
+        return _executor
+
+
+def _reset_after_fork():
+    # The exact-answer threads stay with the parent; pending jobs there expire by TTL.
+    global _executor, _executor_lock, _metrics_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+    _metrics_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class Preview:
+    """
+    An approximate result: `bounds` maps output columns to per-row half-widths
+    (None when unknown), or is None when the sample method gives none.
+    """
+
+    def __init__(self, df, bounds, fraction, method):
+        self.df = df
+        self.bounds = bounds
+        self.fraction = fraction
+        self.method = method
+
+    def describe(self) -> dict:
+        return {
+            "approximate": True,
+            "sample": {"method": self.method, "fraction": self.fraction},
+            "confidence_z": PREVIEW_CONFIDENCE_Z,
+            "error_bounds": None if self.bounds is None else {
+                name: [round(v, 4) if v is not None and math.isfinite(v) else None for v in values]
+                for name, values in self.bounds.items()
+            },
+        }
+
+
+def _with_variance_columns(tree):
+    """
+    Append a hidden SUM(x * x) (or COUNT) next to every plain SUM / COUNT
+    output; scaled like the estimate, it gives the Horvitz-Thompson variance
+    of a row sample. Returns {hidden alias: output position}.
+    """
+    hidden = {}
+    for i, node in enumerate(list(tree.expressions)):
+        agg = node.this if isinstance(node, exp.Alias) else node
+        if isinstance(agg, exp.Sum) and not any(agg.find_all(exp.Distinct)):
+            value = exp.Cast(this=agg.this.copy(), to=exp.DataType.build("FLOAT"))
+            variance = exp.Sum(this=exp.Mul(this=value, expression=value.copy()))
+        elif isinstance(agg, exp.Count) and not any(agg.find_all(exp.Distinct)):
+            variance = agg.copy()
+        else:
+            continue
+        alias = f"{VARIANCE_PREFIX}{i}"
+        tree.select(exp.alias_(variance, alias), copy=False)
+        hidden[alias] = i
+    return hidden
+
+
+def _sampled_fraction(table, sampled) -> float:
+    """
+    The share of `table`'s rows the seeded page sample returns: a sampled
+    COUNT over the row count from partition metadata. SYSTEM sampling keeps
+    whole pages, so this can be well off the nominal percent.
+    """
+    from db import with_sqlserver_cursor
+
+    key = to_sql(sampled)
+    fraction = _fractions.get(key)
+    if fraction is None:
+        name = to_sql(table).replace("'", "''")
+        query = (
+            f"SELECT (SELECT COUNT_BIG(*) FROM {key}), (SELECT SUM(row_count) FROM sys.dm_db_partition_stats "
+            f"WHERE object_id = OBJECT_ID(N'{name}') AND index_id IN (0, 1))"
+        )
+        with with_sqlserver_cursor(isolation="probe") as (conn, cur):
+            cur.execute(query)
+            sampled_rows, total_rows = cur.fetchone()
+        if not sampled_rows or not total_rows:
+            raise ValueError("the page sample returned no rows")
+        fraction = min(float(sampled_rows) / float(total_rows), 1.0)
+        _fractions.set(key, fraction)
+    return fraction
+
+
+def _sample_source(table):
+    if PREVIEW_SOURCE == "table":
+        return exp.to_table(PREVIEW_SAMPLE_TABLE, dialect=DIALECT), PREVIEW_SAMPLE_PERCENT / 100
+    sampled = table.copy()
+    sampled.set("sample", exp.TableSample(
+        method=exp.var("SYSTEM"),
+        percent=exp.Literal.number(PREVIEW_SAMPLE_PERCENT),
+        seed=exp.Literal.number(int(PREVIEW_SAMPLE_SEED)) if PREVIEW_SAMPLE_SEED else None,
+    ))
+    if PREVIEW_SAMPLE_SEED:
+        try:
+            return sampled, _sampled_fraction(table, sampled)
+        except Exception as e:
+            logger.info("Sampled fraction unavailable, scaling by the nominal percent: %s", e)
+    # Unseeded samples differ per query, so a separate COUNT wouldn't describe this one.
+    _count("nominal_fraction")
+    return sampled, PREVIEW_SAMPLE_PERCENT / 100
+
+
+def run_preview(sql: str, row_cap=None) -> "Preview | None":
+    """
+    Estimate `sql` from a sample. Only single-table SUM / COUNT / AVG / MIN /
+    MAX aggregates (the shapes incremental.py can decompose) are previewed;
+    returns None for anything else, or when the exact result is already cached.
+    """
+    from db import cached_result, run_sql_query
+    from incremental import finish, plan_query
+
+    if not PREVIEW_ENABLED or not 0 < PREVIEW_SAMPLE_PERCENT < 100:
+        return None
+    if cached_result(sql, row_cap=row_cap) is not None:
+        _count("already_exact")
+        return None
+    tree = parse_sql(sql).tree()
+    if tree is None:
+        _count("unsupported")
+        return None
+    visible = len(tree.expressions)
+    hidden = _with_variance_columns(tree) if PREVIEW_SOURCE == "table" else None
+    plan = plan_query(to_sql(tree))
+    if plan is None:
+        _count("unsupported")
+        return None
+
+    try:
+        source, fraction = _sample_source(plan.table)
+        # Partial rows go through the shared result cache like any other query.
+        frame = run_sql_query(plan.partial_sql(plan.where, table=source), row_cap=0)
+        if frame.empty:
+            frame = pd.DataFrame(columns=plan.partial_names)
+        for name, _, how in plan.partial_columns:
+            if how in ("sum", "count"):
+                frame[name] = pd.to_numeric(frame[name], errors="coerce") / fraction
+        result = finish(plan, frame, row_cap=row_cap)
+    except Exception as e:
+        _count("preview_errors")
+        logger.warning("Preview failed, answering exactly: %s", e)
+        return None
+
+    if hidden is None:
+        _count("previews")
+        return Preview(result, None, fraction, PREVIEW_SOURCE)
+    # Var(estimate) = (1 - f) / f^2 * sum(x^2) over the sample = (1 - f) / f * (scaled hidden column).
+    bounds = {}
+    for position, (alias, index) in enumerate(hidden.items()):
+        scaled = pd.to_numeric(result.iloc[:, visible + position], errors="coerce")
+        half_width = PREVIEW_CONFIDENCE_Z * (scaled.clip(lower=0) * (1 - fraction) / fraction) ** 0.5
+        bounds[result.columns[index]] = [None if pd.isna(v) else float(v) for v in half_width]
+    _count("previews")
+    return Preview(result.iloc[:, :visible], bounds, fraction, PREVIEW_SOURCE)
+
+
+# ---- Background exact answers ----
+
+def _owner_key(auth_header: str) -> str:
+    return hashlib.sha256((auth_header or "").encode("utf-8")).hexdigest()
+
+
+def submit_exact(fn, auth_header: str) -> str:
+    """
+    Run `fn() -> (body, status)` in the background and keep its result in the
+    shared "exact_jobs" cache, so any worker can answer the poll. Returns the job id.
+    """
+    job_id = uuid.uuid4().hex
+    owner = _owner_key(auth_header)
+    _jobs.set(job_id, {"status": "pending", "owner": owner, "submitted_at": time.time()})
+
+    def run():
+        try:
+            body, status = fn()
+        except Exception as e:
+            logger.exception("Exact answer job %s failed", job_id)
+            body, status = {"error": f"An internal server error occurred: {e}"}, 500
+        _count("exact_completed" if status == 200 else "exact_failed")
+        _jobs.set(job_id, {"status": "done", "owner": owner, "body": body, "code": status, "finished_at": time.time()})
+
+    _count("exact_submitted")
+    # Keep the request ID on the job's log records.
+    _get_executor().submit(contextvars.copy_context().run, run)
+    return job_id
+
+
+def share_exact(job_id: str, auth_header: str) -> str:
+    """
+    A job id of the caller's own for `job_id`'s run, for a coalesced preview
+    that reused another caller's answer (and its exact job).
+    """
+    alias = uuid.uuid4().hex
+    _jobs.set(alias, {"status": "pending", "of": job_id, "owner": _owner_key(auth_header), "submitted_at": time.time()})
+    return alias
+
+
+def exact_job(job_id: str, auth_header: str, wait: float = 0):
+    """
+    The job's entry ({"status": "pending"} or {"status": "done", "body", "code"}),
+    or None when unknown, expired or not the caller's. Blocks up to `wait`
+    seconds (at most PREVIEW_MAX_WAIT_SECONDS) for a pending job to finish.
+    """
+    entry = _jobs.get(job_id)
+    if entry is None or entry.get("owner") != _owner_key(auth_header):
+        return None
+    if entry.get("of"):
+        # The caller's handle on a shared run; ownership was checked on the handle.
+        job_id, auth_header = entry["of"], None
+    if not math.isfinite(wait):  # ?wait=nan or ?wait=inf
+        wait = PREVIEW_MAX_WAIT_SECONDS if wait > 0 else 0
+    deadline = time.monotonic() + min(max(wait, 0), PREVIEW_MAX_WAIT_SECONDS)
+    while True:
+        entry = _jobs.get(job_id)
+        if entry is None or (auth_header is not None and entry.get("owner") != _owner_key(auth_header)):
+            return None
+        if entry["status"] == "done" or time.monotonic() >= deadline:
+            return entry
+        time.sleep(0.25)
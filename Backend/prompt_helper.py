@@ -1,11 +1,16 @@
-import openai
+import logging
 import os
 import re
 import json
-import pandas as pd
-from dotenv import load_dotenv
+from typing import TYPE_CHECKING
+from config import load_env
+from sqlglot import exp
+from sql_parse import parse_sql, parse_condition, to_sql
 
-load_dotenv()
+load_env()
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 SENSITIVE_KEYWORDS = [
     'schema', 'table', 'column', 'database', 'structure', 'ddl', 'create',
@@ -29,26 +34,43 @@ SENSITIVE_PATTERNS = [
     r'show.*field',
     r'list.*field'
 ]
-COMPILED_SENSITIVE_PATTERNS = [re.compile(p, re.IGNORECASE) for p in SENSITIVE_PATTERNS]
 
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# Precompiled classifier: one word-bounded alternation over all keywords and
+# one alternation over the patterns (named groups identify the rule), gated
+# by the patterns' leading words. Questions are lowercased once up front.
+SENSITIVE_KEYWORD_RE = re.compile(
+    r'\b(' + '|'.join(re.escape(k) for k in sorted(SENSITIVE_KEYWORDS, key=len, reverse=True)) + r')\b'
+)
+SENSITIVE_PATTERN_RE = re.compile('|'.join(f'(?P<p{i}>{p})' for i, p in enumerate(SENSITIVE_PATTERNS)))
+SENSITIVE_PATTERN_PREFILTER_RE = re.compile(
+    '|'.join(sorted({re.escape(p.split('.*')[0]) for p in SENSITIVE_PATTERNS}))
+)
 
+logger = logging.getLogger(__name__)
 
-def is_query_sensitive(question: str) -> bool:
+
+def match_sensitive_rule(question: str):
+    """Return ("keyword"|"pattern", rule) for the first sensitive rule the question hits, or None."""
     lower_question = question.lower()
-    for keyword in SENSITIVE_KEYWORDS:
-        if re.search(r'\b' + re.escape(keyword) + r'\b', lower_question):
-            print(f"Sensitive keyword detected: '{keyword}'")
-            return True
-    for pattern in COMPILED_SENSITIVE_PATTERNS:
-        if pattern.search(lower_question):
-            print(f"Sensitive pattern detected: '{pattern.pattern}'")
-            return True
-    return False
+    m = SENSITIVE_KEYWORD_RE.search(lower_question)
+    if m:
+        return "keyword", m.group(1)
+    if SENSITIVE_PATTERN_PREFILTER_RE.search(lower_question):
+        m = SENSITIVE_PATTERN_RE.search(lower_question)
+        if m:
+            return "pattern", SENSITIVE_PATTERNS[int(m.lastgroup[1:])]
+    return None
 
 
+def is_query_sensitive(question: str) -> bool:
+    match = match_sensitive_rule(question)
+    if match:
+        logger.info("Sensitive question blocked", extra={"rule_type": match[0], "rule": match[1]})
+    return match is not None
 
-def fill_hierarchy_levels(df: pd.DataFrame) -> pd.DataFrame:
+
+
+def fill_hierarchy_levels(df: "pd.DataFrame") -> "pd.DataFrame":
     df = df.copy()
 
     required_cols = ["StoreName", "CompanyName", "RegionName"]
@@ -219,17 +241,30 @@ LEVEL_PHRASE_TO_CONDITION = {
 def _ensure_where_block(sql: str) -> str:
     return sql if re.search(r"\bWHERE\b", sql, re.IGNORECASE) else re.sub(r"\bFROM\b", "FROM", sql, flags=re.IGNORECASE) + " WHERE 1=1"
 
+def _condition_present(sql: str, condition: str) -> bool:
+    lowered = sql.lower()
+    if condition.lower() in lowered:
+        return True
+    # Rewritten SQL comes back in sqlglot's canonical form, e.g. "NOT x IN (...)"
+    return to_sql(parse_condition(condition)).lower() in lowered
+
 def _append_condition(sql: str, condition: str) -> str:
-    if re.search(re.escape(condition), sql, re.IGNORECASE):
+    if _condition_present(sql, condition):
         return sql
+    tree = parse_sql(sql).tree()
+    if tree is not None:
+        return to_sql(tree.where(parse_condition(condition), append=True, copy=False))
     if re.search(r"\bWHERE\b", sql, re.IGNORECASE):
         return re.sub(r"(\bWHERE\b)", r"\1", sql, flags=re.IGNORECASE) + f" AND {condition}"
     return sql + f" WHERE {condition}"
 
 def _ensure_not_blank(sql: str, col: str) -> str:
     cond = f"ISNULL(LTRIM(RTRIM({col})), '') NOT IN ('', 'N/A')"
-    if re.search(re.escape(cond), sql, re.IGNORECASE):
+    if _condition_present(sql, cond):
         return sql
+    tree = parse_sql(sql).tree()
+    if tree is not None:
+        return to_sql(tree.where(parse_condition(cond), append=True, copy=False))
     if re.search(r"\bWHERE\b", sql, re.IGNORECASE):
         return sql + f" AND {cond}"
     else:
@@ -240,19 +275,52 @@ def _strip_trailing_order_by(sql: str) -> tuple[str, str]:
     m = re.search(r"\bORDER\s+BY\b[\s\S]*$", sql, re.IGNORECASE)
     if not m:
         return sql, ""
-    return sql[:m.start()].rstrip(), sql[m.group(0):]
+    return sql[:m.start()].rstrip(), sql[m.start():]
 
 def _needs_aggregation(sql: str, entity_col: str) -> bool:
+    parsed = parse_sql(sql)
+    if parsed.ok:
+        has_entity = parsed.references_column(entity_col)
+        return has_entity and not (parsed.has_function(exp.Sum) or parsed.has_group_by())
     has_entity = re.search(rf"\b{re.escape(entity_col)}\b", sql, re.IGNORECASE) is not None
     has_sum = re.search(r"\bSUM\s*\(", sql, re.IGNORECASE) is not None
     has_group = re.search(r"\bGROUP\s+BY\b", sql, re.IGNORECASE) is not None
     return has_entity and not (has_sum or has_group)
 
+def _is_sum_sales_desc(ordered) -> bool:
+    node = ordered.this
+    return (
+        bool(ordered.args.get("desc"))
+        and isinstance(node, exp.Sum)
+        and isinstance(node.this, exp.Column)
+        and node.this.name.lower() == "sales"
+    )
+
+def _inject_group_by_sum_sales_tree(tree, entity_col: str, out_alias: str = None) -> str:
+    entity = parse_condition(entity_col)
+    projection = exp.alias_(entity.copy(), out_alias, quoted=True) if out_alias else entity.copy()
+    sum_sales = exp.alias_(parse_condition("SUM([Sales])"), "Sales", quoted=True)
+    tree.select(projection, sum_sales, append=False, copy=False)
+    tree.set("distinct", None)
+    if tree.args.get("group") is None:
+        tree.group_by(entity.copy(), copy=False)
+
+    order = tree.args.get("order")
+    if not (order and any(_is_sum_sales_desc(o) for o in order.expressions)):
+        tree.order_by(parse_condition("SUM([Sales])").desc(), append=False, copy=False)
+    return to_sql(tree)
+
 def _inject_group_by_sum_sales(sql: str, entity_col: str, out_alias: str = None) -> str:
     """
     Force the SELECT to be: SELECT [entity_col] AS [alias], SUM([Sales]) AS [Sales] ... GROUP BY [entity_col]
     Keeps FROM ... WHERE ... parts intact; overwrites ORDER BY to be SUM([Sales]) DESC if none provided.
     """
+    tree = parse_sql(sql).tree()
+    if tree is not None:
+        if tree.args.get("from") is None and tree.args.get("from_") is None:
+            return sql
+        return _inject_group_by_sum_sales_tree(tree, entity_col, out_alias)
+
     sel_match = re.search(r"^\s*SELECT\s+(TOP\s+\d+\s+)?", sql, re.IGNORECASE)
     if not sel_match:
         return sql 
@@ -293,13 +361,11 @@ def _enforce_level_and_null_rules(sql: str, question: str) -> str:
 
     if "company level" in ql or "company level data" in ql:
         sql = _append_condition(_ensure_where_block(sql), "[Level] = '0'")
-        if "IS NULL" not in sql:
-            sql = sql + " AND [Profitcenter_Name] IS NULL"
+        sql = _append_condition(sql, "[Profitcenter_Name] IS NULL")
 
     if "region level" in ql or "region level data" in ql:
         sql = _append_condition(_ensure_where_block(sql), "[Level] = '2'")
-        if "Company_Name] IS NULL" not in sql:
-            sql = sql + " AND [Company_Name] IS NULL"
+        sql = _append_condition(sql, "[Company_Name] IS NULL")
 
     for phrase, cond in LEVEL_PHRASE_TO_CONDITION.items():
         if phrase in ql and re.search(re.escape(phrase), sql, re.IGNORECASE):
@@ -365,6 +431,10 @@ RULES:
 Question: "{question}"
 """
 
+    # Legacy path; the openai client is only imported when it is actually used.
+    import openai
+
+    openai.api_key = os.getenv("OPENAI_API_KEY")
     response = openai.ChatCompletion.create(
         model="gpt-4o",
         messages=[{"role": "user", "content": prompt}]
@@ -0,0 +1,133 @@
+import os
+import re
+import threading
+import xml.etree.ElementTree as ET
+
+# off       - no checks, no rewriting
+# heuristic - reject cross joins, inject the default row cap
+# showplan  - heuristic checks plus the estimated plan (SET SHOWPLAN_XML) against the thresholds
+QUERY_GUARD_MODE = os.getenv("QUERY_GUARD_MODE", "heuristic").lower()
+QUERY_DEFAULT_ROW_CAP = int(os.getenv("QUERY_DEFAULT_ROW_CAP", "5000"))
+QUERY_MAX_ESTIMATED_ROWS = float(os.getenv("QUERY_MAX_ESTIMATED_ROWS", "5000000"))
+QUERY_MAX_ESTIMATED_COST = float(os.getenv("QUERY_MAX_ESTIMATED_COST", "500"))
+QUERY_TIMEOUT_SECONDS = int(os.getenv("QUERY_TIMEOUT_SECONDS", "30"))
+
+SHOWPLAN_NS = {"sp": "http://schemas.microsoft.com/sqlserver/2004/07/showplan"}
+
+CROSS_JOIN_RE = re.compile(r"\bCROSS\s+JOIN\b", re.IGNORECASE)
+FROM_CLAUSE_RE = re.compile(
+    r"\bFROM\b(?P<body>.*?)(?=\bWHERE\b|\bGROUP\s+BY\b|\bHAVING\b|\bORDER\s+BY\b|\bUNION\b|;|$)",
+    re.IGNORECASE | re.DOTALL,
+)
+SELECT_HEAD_RE = re.compile(r"^\s*SELECT\s+(?:(?:DISTINCT|ALL)\s+)?", re.IGNORECASE)
+TOP_RE = re.compile(r"^\s*SELECT\s+(?:(?:DISTINCT|ALL)\s+)?TOP\b", re.IGNORECASE)
+OFFSET_FETCH_RE = re.compile(r"\bOFFSET\b[\s\S]*\bFETCH\b", re.IGNORECASE)
+UNION_RE = re.compile(r"\b(UNION|INTERSECT|EXCEPT)\b", re.IGNORECASE)
+
+_metrics_lock = threading.Lock()
+_metrics = {"checked": 0, "rejected": 0, "row_capped": 0, "plans_estimated": 0}
+
+
+def get_query_guard_metrics() -> dict:
+    with _metrics_lock:
+        return dict(_metrics)
+
+
+def _count(key: str) -> None:
+    with _metrics_lock:
+        _metrics[key] += 1
+
+
+class QueryRejected(PermissionError):
+    """Raised when a query is refused before execution; the message is meant for the model."""
+
+    tool_feedback = "Rewrite the query with tighter filters (date range, store, region), aggregation or TOP, then try again."
+
+
+def _strip_literals(sql: str) -> str:
+    return re.sub(r"'(?:[^']|'')*'", "''", sql)
+
+
+def _collapse_parens(text: str) -> str:
+    previous = None
+    while previous != text:
+        previous, text = text, re.sub(r"\([^()]*\)", "()", text)
+    return text
+
+
+def check_heuristics(sql: str) -> None:
+    text = _strip_literals(sql)
+    if CROSS_JOIN_RE.search(text):
+        raise QueryRejected("Query rejected: CROSS JOIN is not allowed.")
+    for m in FROM_CLAUSE_RE.finditer(_collapse_parens(text)):
+        if "," in m.group("body") and not re.search(r"\bJOIN\b|\bAPPLY\b", m.group("body"), re.IGNORECASE):
+            raise QueryRejected("Query rejected: comma-separated tables form an implicit cross join; use explicit JOIN ... ON.")
+
+
+def apply_row_cap(sql: str, row_cap: int) -> str:
+    """Inject TOP (row_cap) into a plain outer SELECT that has no TOP or OFFSET/FETCH of its own."""
+    if not row_cap or row_cap <= 0:
+        return sql
+    text = _strip_literals(sql)
+    if TOP_RE.match(text) or OFFSET_FETCH_RE.search(text) or UNION_RE.search(text):
+        return sql
+    head = SELECT_HEAD_RE.match(sql)
+    if not head:
+        return sql
+    _count("row_capped")
+    return f"{sql[:head.end()]}TOP ({int(row_cap)}) {sql[head.end():]}"
+
+
+def estimate_plan(cur, sql: str) -> "tuple[float, float]":
+    """Return (estimated rows, estimated subtree cost) from SQL Server's estimated XML plan."""
+    # The read-only proxy refuses SET; session options go through the raw cursor.
+    session = getattr(cur, "raw", cur)
+    session.execute("SET SHOWPLAN_XML ON")
+    try:
+        cur.execute(sql)
+        row = cur.fetchone()
+        plan_xml = row[0] if row else ""
+        while cur.nextset():
+            pass
+    finally:
+        session.execute("SET SHOWPLAN_XML OFF")
+
+    _count("plans_estimated")
+    if not plan_xml:
+        return 0.0, 0.0
+    root = ET.fromstring(plan_xml)
+    rows, cost = 0.0, 0.0
+    for stmt in root.iterfind(".//sp:StmtSimple", SHOWPLAN_NS):
+        rows = max(rows, float(stmt.get("StatementEstRows", 0) or 0))
+        cost = max(cost, float(stmt.get("StatementSubTreeCost", 0) or 0))
+    return rows, cost
+
+
+def guard_query(sql: str, cur=None, row_cap: int = None) -> str:
+    """
+    Check `sql` before execution and return the statement to run (possibly
+    with a row cap injected). Raises QueryRejected when the query is over the
+    configured limits. `row_cap=None` uses QUERY_DEFAULT_ROW_CAP, 0 disables it.
+    """
+    if QUERY_GUARD_MODE == "off":
+        return sql
+    _count("checked")
+
+    try:
+        check_heuristics(sql)
+        guarded = apply_row_cap(sql, QUERY_DEFAULT_ROW_CAP if row_cap is None else row_cap)
+
+        if QUERY_GUARD_MODE == "showplan" and cur is not None:
+            rows, cost = estimate_plan(cur, guarded)
+            if cost > QUERY_MAX_ESTIMATED_COST:
+                raise QueryRejected(
+                    f"Query rejected: estimated cost {cost:,.1f} exceeds the limit of {QUERY_MAX_ESTIMATED_COST:,.1f}."
+                )
+            if rows > QUERY_MAX_ESTIMATED_ROWS:
+                raise QueryRejected(
+                    f"Query rejected: estimated {rows:,.0f} rows exceeds the limit of {QUERY_MAX_ESTIMATED_ROWS:,.0f}."
+                )
+    except QueryRejected:
+        _count("rejected")
+        raise
+    return guarded
@@ -0,0 +1,99 @@
+import hashlib
+import os
+import re
+import threading
+
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "1").lower() not in {"0", "false", "no"}
+# global - every authenticated user reads the same data, so identical questions share one run
+# token  - only requests with the same Authorization header are coalesced
+COALESCE_SCOPE = os.getenv("COALESCE_SCOPE", "global").lower()
+# A waiter that gives up after this many seconds runs the question itself.
+COALESCE_WAIT_SECONDS = float(os.getenv("COALESCE_WAIT_SECONDS", "180"))
+
+WHITESPACE_RE = re.compile(r"\s+")
+
+_metrics_lock = threading.Lock()
+_metrics = {"leaders": 0, "coalesced_waiters": 0, "wait_timeouts": 0, "max_waiters": 0, "in_flight": 0}
+
+
+def get_coalescing_metrics() -> dict:
+    with _metrics_lock:
+        return dict(_metrics)
+
+
+def normalize_question(question: str) -> str:
+    return WHITESPACE_RE.sub(" ", question).strip().rstrip("?.! ").lower()
+
+
+def coalesce_key(question: str, auth_header: str = None) -> str:
+    scope = hashlib.sha256((auth_header or "").encode("utf-8")).hexdigest() if COALESCE_SCOPE == "token" else "global"
+    return f"{scope}:{normalize_question(question)}"
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Run at most one computation per key at a time. Callers that arrive while
+    it is in flight block and receive the same result (or exception).
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, timeout: float = None):
+        """Return (result, shared); `shared` is True when another caller's run was reused."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+
+        if not leader:
+            with _metrics_lock:
+                _metrics["coalesced_waiters"] += 1
+                _metrics["max_waiters"] = max(_metrics["max_waiters"], call.waiters)
+            if call.done.wait(COALESCE_WAIT_SECONDS if timeout is None else timeout):
+                if call.error is not None:
+                    raise call.error
+                return call.result, True
+            with _metrics_lock:
+                _metrics["wait_timeouts"] += 1
+            return fn(), False
+
+        with _metrics_lock:
+            _metrics["leaders"] += 1
+            _metrics["in_flight"] += 1
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+            with _metrics_lock:
+                _metrics["in_flight"] -= 1
+
+
+_questions = SingleFlight()
+
+
+def run_once(question: str, auth_header: str, fn):
+    """Coalesce `fn` with concurrent runs of the same normalized question in the same scope."""
+    if not COALESCE_ENABLED:
+        return fn(), False
+    return _questions.do(coalesce_key(question, auth_header), fn)
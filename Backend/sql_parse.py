@@ -0,0 +1,277 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import date
+from decimal import Decimal
+from functools import lru_cache
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+
+DIALECT = "tsql"
+SQL_PARSE_CACHE_SIZE = int(os.getenv("SQL_PARSE_CACHE_SIZE", "512"))
+
+# Statement roots a read-only cursor may run: queries only. Session options
+# (SHOWPLAN_XML, LOCK_TIMEOUT) are set by internal code on the raw cursor, so
+# generated SQL can't leave SET state behind on a pooled connection.
+READ_ONLY_ROOTS = (exp.Select, exp.SetOperation, exp.Subquery)
+# Pass-through queries run their string argument on another server, where it may write.
+REMOTE_FUNCTIONS = {"OPENQUERY", "OPENROWSET", "OPENDATASOURCE"}
+WRITE_NODES = tuple(
+    getattr(exp, name)
+    for name in (
+        "Insert", "Update", "Delete", "Merge", "Create", "Drop", "Alter", "TruncateTable",
+        "Grant", "Revoke", "Command", "Execute", "Into",
+    )
+    if hasattr(exp, name)
+)
+
+# Fallback for statements sqlglot can't parse: keyword scan with string
+# literals and comments removed so values like 'update' don't trip it.
+FORBIDDEN_STMTS = re.compile(
+    r"\b(INSERT|UPDATE|DELETE|MERGE|CREATE|DROP|ALTER|TRUNCATE|GRANT|REVOKE|BACKUP|RESTORE|EXECUTE|EXEC|RECONFIGURE|INTO|DBCC|SET|"
+    r"OPENQUERY|OPENROWSET|OPENDATASOURCE)\b",
+    re.IGNORECASE,
+)
+LITERAL_OR_COMMENT_RE = re.compile(r"'(?:[^']|'')*'|--[^\n]*|/\*[\s\S]*?\*/")
+
+
+def _unbracket(name: str) -> str:
+    name = name.strip()
+    if name.startswith("[") and name.endswith("]"):
+        return name[1:-1].replace("]]", "]")
+    return name
+
+
+def _function_name(node) -> str:
+    name = node.name if isinstance(node, exp.Anonymous) else node.sql_name()
+    return (name or "").upper()
+
+
+class ParsedSQL:
+    """
+    One parse of a SQL string, shared by read-only validation, column
+    extraction and the prompt_helper rewriters. `statements` belong to the
+    cache: callers that want to modify a tree must use `tree()` for a copy.
+    """
+
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.error = None
+        try:
+            self.statements = tuple(s for s in sqlglot.parse(sql, read=DIALECT) if s is not None)
+        except SqlglotError as e:
+            self.statements = ()
+            self.error = str(e)
+        self._read_only = None
+        self._base_columns = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and bool(self.statements)
+
+    @property
+    def select(self):
+        """The single top-level SELECT, or None for anything else."""
+        if self.ok and len(self.statements) == 1 and isinstance(self.statements[0], exp.Select):
+            return self.statements[0]
+        return None
+
+    def tree(self):
+        select = self.select
+        return select.copy() if select is not None else None
+
+    def is_read_only(self) -> bool:
+        if self._read_only is None:
+            if not self.ok:
+                stripped = LITERAL_OR_COMMENT_RE.sub("''", self.sql)
+                self._read_only = not FORBIDDEN_STMTS.search(stripped)
+            else:
+                self._read_only = all(
+                    isinstance(stmt, READ_ONLY_ROOTS)
+                    and not any(stmt.find_all(*WRITE_NODES))
+                    and not any(_function_name(f) in REMOTE_FUNCTIONS for f in stmt.find_all(exp.Func))
+                    for stmt in self.statements
+                )
+        return self._read_only
+
+    def table_names(self) -> set:
+        return {t.name for stmt in self.statements for t in stmt.find_all(exp.Table)}
+
+    def output_aliases(self) -> set:
+        return {a.alias for stmt in self.statements for a in stmt.find_all(exp.Alias) if a.alias}
+
+    def base_columns(self) -> list:
+        """Physical column names referenced anywhere in the query, in first-seen order."""
+        if self._base_columns is None:
+            skip = self.table_names() | self.output_aliases()
+            seen = []
+            for stmt in self.statements:
+                for col in stmt.find_all(exp.Column):
+                    name = col.name
+                    if name and name not in skip and name not in seen:
+                        seen.append(name)
+            self._base_columns = seen
+        return list(self._base_columns)
+
+    def references_column(self, column: str) -> bool:
+        target = _unbracket(column).lower()
+        return any(
+            col.name.lower() == target for stmt in self.statements for col in stmt.find_all(exp.Column)
+        )
+
+    def has_function(self, func_type) -> bool:
+        return any(any(stmt.find_all(func_type)) for stmt in self.statements)
+
+    def has_group_by(self) -> bool:
+        select = self.select
+        return select is not None and select.args.get("group") is not None
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_metrics = {"hits": 0, "misses": 0, "parse_errors": 0}
+
+
+def get_parse_cache_metrics() -> dict:
+    with _cache_lock:
+        return {**_metrics, "size": len(_cache)}
+
+
+def parse_sql(sql: str) -> ParsedSQL:
+    """Parse `sql` once; repeated calls with the same text hit an LRU keyed by its hash."""
+    key = hashlib.sha1(sql.encode("utf-8")).hexdigest()
+    with _cache_lock:
+        parsed = _cache.get(key)
+        if parsed is not None:
+            _cache.move_to_end(key)
+            _metrics["hits"] += 1
+            return parsed
+        _metrics["misses"] += 1
+
+    parsed = ParsedSQL(sql)
+
+    with _cache_lock:
+        if parsed.error:
+            _metrics["parse_errors"] += 1
+        _cache[key] = parsed
+        while len(_cache) > SQL_PARSE_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return parsed
+
+
+def parse_condition(condition: str):
+    return sqlglot.condition(condition, dialect=DIALECT)
+
+
+def to_sql(tree) -> str:
+    return tree.sql(dialect=DIALECT)
+
+
+# Literal -> parameter extraction. Only literals that are direct operands of a
+# WHERE / HAVING / JOIN predicate are lifted: a parameter in the select list
+# would no longer match the same expression in GROUP BY, and TOP, ORDER BY and
+# function arguments keep the exact text SQL Server needs them in.
+SQL_PARAMETERIZE = os.getenv("SQL_PARAMETERIZE", "1").lower() not in {"0", "false", "no"}
+PARAMETERIZABLE_PARENTS = (exp.EQ, exp.NEQ, exp.GT, exp.GTE, exp.LT, exp.LTE, exp.In, exp.Between, exp.Like)
+ISO_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+PLACEHOLDER_RE = re.compile(r":__p(\d+)__")
+PREDICATE_CLAUSES = (exp.Where, exp.Having, exp.Join)
+# SQL Server takes at most 2100 parameters per request; statements with more
+# candidate literals (long IN lists) are sent inline as before.
+SQL_MAX_PARAMETERS = int(os.getenv("SQL_MAX_PARAMETERS", "2000"))
+
+_param_metrics_lock = threading.Lock()
+_param_metrics = {"statements": 0, "parameterized": 0, "literals": 0, "skipped": 0, "over_limit": 0}
+
+
+def get_parameterization_metrics() -> dict:
+    with _param_metrics_lock:
+        metrics = dict(_param_metrics)
+    metrics["parameterization_rate"] = (
+        round(metrics["parameterized"] / metrics["statements"], 4) if metrics["statements"] else 0.0
+    )
+    return metrics
+
+
+class Param:
+    """A lifted literal; `national` marks N'...' strings that must stay NVARCHAR."""
+
+    __slots__ = ("value", "national")
+
+    def __init__(self, value, national=False):
+        self.value = value
+        self.national = national
+
+    def __eq__(self, other):
+        return isinstance(other, Param) and (self.value, self.national) == (other.value, other.national)
+
+    def __repr__(self):
+        return f"Param({self.value!r}, national={self.national})"
+
+
+def _literal_value(node):
+    if isinstance(node, exp.National):
+        return Param(node.this, national=True)
+    if node.is_string:
+        text = node.this
+        # ISO dates bind as DATE so the comparison against [From_Date] stays sargable.
+        if ISO_DATE_RE.match(text):
+            try:
+                return Param(date.fromisoformat(text))
+            except ValueError:
+                pass
+        return Param(text)
+    text = str(node.this)
+    return Param(int(text) if text.isdigit() else Decimal(text))
+
+
+@lru_cache(maxsize=SQL_PARSE_CACHE_SIZE)
+def _parameterize_cached(sql: str):
+    """(template, params, over_limit) for `sql`."""
+    tree = parse_sql(sql).tree()
+    if tree is None:
+        return sql, (), False
+
+    candidates = [
+        node for node in tree.find_all(exp.Literal, exp.National)
+        if isinstance(node.parent, PARAMETERIZABLE_PARENTS) and node.find_ancestor(*PREDICATE_CLAUSES)
+    ]
+    if len(candidates) > SQL_MAX_PARAMETERS:
+        return sql, (), True
+    if not candidates:
+        return sql, (), False
+    values = []
+    for node in candidates:
+        node.replace(exp.Placeholder(this=f"__p{len(values)}__"))
+        values.append(_literal_value(node))
+
+    rendered = to_sql(tree)
+    # find_all walks breadth-first; the rendered text gives the positional order.
+    ordered = tuple(values[int(i)] for i in PLACEHOLDER_RE.findall(rendered))
+    return PLACEHOLDER_RE.sub("?", rendered), ordered, False
+
+
+def parameterize(sql: str):
+    """
+    Turn inline predicate literals into `?` parameters so statements of the
+    same shape share one cached plan. Returns (sql, params); params is empty
+    when nothing was lifted, the statement isn't a single SELECT, or it has
+    more candidate literals than SQL_MAX_PARAMETERS.
+    """
+    if not SQL_PARAMETERIZE:
+        return sql, ()
+    template, params, over_limit = _parameterize_cached(sql)
+    with _param_metrics_lock:
+        _param_metrics["statements"] += 1
+        if params:
+            _param_metrics["parameterized"] += 1
+            _param_metrics["literals"] += len(params)
+        elif over_limit:
+            _param_metrics["over_limit"] += 1
+        elif parse_sql(sql).select is None:
+            _param_metrics["skipped"] += 1
+    return template, params
@@ -0,0 +1,116 @@
+import os
+import sys
+from datetime import date
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import intent_router
+from intent_router import DateRange, UnresolvedDate, classify_intent, parse_date_range, route_question
+
+TODAY = date(2025, 3, 10)  # a Monday
+
+
+@pytest.mark.parametrize("text, start, end", [
+    ("total sales today", date(2025, 3, 10), date(2025, 3, 11)),
+    ("total sales yesterday", date(2025, 3, 9), date(2025, 3, 10)),
+    ("total sales last 7 days", date(2025, 3, 4), date(2025, 3, 11)),
+    ("total sales last 1 days", date(2025, 3, 10), date(2025, 3, 11)),
+    ("total sales this week", date(2025, 3, 10), date(2025, 3, 11)),
+    ("total sales last week", date(2025, 3, 3), date(2025, 3, 10)),
+    ("total sales last month", date(2025, 2, 1), date(2025, 3, 1)),
+    ("total sales year to date", date(2025, 1, 1), date(2025, 3, 11)),
+    ("total sales last year", date(2024, 1, 1), date(2025, 1, 1)),
+    ("total sales in q1 2024", date(2024, 1, 1), date(2024, 4, 1)),
+    ("total sales in march 2024", date(2024, 3, 1), date(2024, 4, 1)),
+    ("total sales for april", date(2024, 4, 1), date(2024, 5, 1)),
+    ("total sales in 2023", date(2023, 1, 1), date(2024, 1, 1)),
+    ("total sales on 2024-03-01", date(2024, 3, 1), date(2024, 3, 2)),
+    ("total sales from 2024-01-01 to 2024-01-31", date(2024, 1, 1), date(2024, 2, 1)),
+    ("total sales between 2024-01-01 and 2024-01-31", date(2024, 1, 1), date(2024, 2, 1)),
+])
+def test_single_date_phrase(text, start, end):
+    date_range = parse_date_range(text, TODAY)
+    assert (date_range.start, date_range.end) == (start, end)
+
+
+def test_no_date_phrase():
+    assert parse_date_range("what are total sales", TODAY) is None
+
+
+@pytest.mark.parametrize("text", [
+    # Open-ended ranges.
+    "total sales since 2024-03-01",
+    "total sales until 2024-03-01",
+    "total sales before last month",
+    "total sales after march 2024",
+    "total sales from march 2024",
+    "total sales in march 2024 onwards",
+    # More than one date phrase.
+    "total sales 2024-01-01 through 2024-02-01",
+    "total sales from march 2024 to may 2024",
+    "total sales in january and february",
+    "total sales in 2023 and 2024",
+    "total sales last year and this year",
+    "total sales yesterday and today",
+    # Empty or backwards ranges, and dates the regexes don't know.
+    "total sales last 0 days",
+    "total sales from 2024-02-01 to 2024-01-01",
+    "total sales over the holiday weekend",
+])
+def test_unresolved_date(text):
+    with pytest.raises(UnresolvedDate):
+        parse_date_range(text, TODAY)
+
+
+@pytest.mark.parametrize("question, intent", [
+    ("What were total sales last week?", "total_sales"),
+    ("Total traffic yesterday", "traffic"),
+    ("Sales year over year this month", "yoy_sales"),
+    ("Top 5 stores last month", "top_n"),
+    ("Which region had the highest sales in 2024?", "top_n"),
+])
+def test_classify_intent(question, intent):
+    assert classify_intent(question)[0] == intent
+
+
+def test_classify_top_n_slots():
+    assert classify_intent("bottom 3 companies last year") == ("top_n", {"entity": "company", "n": 3, "descending": False})
+
+
+@pytest.mark.parametrize("question", [
+    "total sales for Dallas last week",
+    "total sales in the East region",
+    "top 5 stores in the North region",
+    "total sales by store last month",
+    "average ticket last week",
+])
+def test_classify_sends_filters_to_agent(question):
+    assert classify_intent(question) is None
+
+
+@pytest.mark.parametrize("question", [
+    "total sales since 2024-03-01",
+    "total sales from march 2024 to may 2024",
+    "total sales in 2023 and 2024",
+    "total sales last 0 days",
+])
+def test_route_falls_back_on_unresolved_dates(monkeypatch, question):
+    monkeypatch.setattr(intent_router, "FAST_PATH_LLM_SLOTS", False)
+    assert classify_intent(question) == ("total_sales", {})
+    assert route_question(question, TODAY) is None
+
+
+def test_route_uses_llm_slots_for_unresolved_dates(monkeypatch):
+    resolved = DateRange(date(2024, 3, 1), date(2025, 3, 11), "2024-03-01 to 2025-03-10")
+    monkeypatch.setattr(intent_router, "extract_date_range_with_llm", lambda question, today: resolved)
+    match = route_question("total sales since 2024-03-01", TODAY)
+    assert match.intent == "total_sales"
+    assert resolved.condition() in match.sql
+
+
+def test_route_builds_template_sql():
+    match = route_question("What were total sales last week?", TODAY)
+    assert match.intent == "total_sales"
+    assert "[From_Date] >= '2025-03-03' AND [From_Date] < '2025-03-10'" in match.sql
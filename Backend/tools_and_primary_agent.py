@@ -1,17 +1,29 @@
 from langchain.tools import tool
+import contextvars
+import logging
+import os
 import re
+import threading
+import time
+from contextlib import contextmanager
 from typing import List
-from db import with_sqlserver_cursor 
+from cache import get_cache
+from freshness import on_data_change, register_cache_namespace
+from db import with_sqlserver_cursor, run_sql_query as run_cached_sql_query
 import pandas as pd
 from datetime import datetime
 from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
-from utils import llm_agent
+from prompt_helper import get_column_definitions
+from value_index import VALUE_INDEX_COLUMNS, VALUE_INDEX_ENABLED, get_value_index
+from utils import get_llm, bind_tools_if_supported, llm_call_timeout, model_for_step, record_model_usage, with_call_timeout
 from langgraph.prebuilt import tools_condition
 from langgraph.graph import END
 
 
 Table_name = "ConsolidateData_PBI"
 
+logger = logging.getLogger(__name__)
+
 
 
 IDENT_RE = re.compile(r'^[A-Za-z0-9_\$\#]+(?:\.[A-Za-z0-9_\$\#]+)?$') 
@@ -33,14 +45,7 @@ def _normalize_table_list(tables_str: str) -> List[str]:
     return [t.strip() for t in tables_str.split(',') if t.strip()]
 
 
-@tool(parse_docstring=True)
-def get_table_info() -> str:
-    """
-    Return schema and up to max_samples non-null sample values per column for one or more SQL Server tables.
-
-    Returns:
-        str: Human-readable schema + sample values for each requested table.
-    """
+def describe_tables() -> str:
     tables = _normalize_table_list(Table_name)
     if not tables:
         return "No valid table names provided."
@@ -51,7 +56,8 @@ def get_table_info() -> str:
 
     output_lines = []
 
-    with with_sqlserver_cursor() as (dbapi_conn, cur):
+    # Schema and sample-value lookups tolerate dirty reads, so they use the probe isolation.
+    with with_sqlserver_cursor(isolation="probe") as (dbapi_conn, cur):
         for raw_name in tables:
             schema, table = _split_schema_table(raw_name)
 
@@ -131,7 +137,8 @@ def get_table_info() -> str:
 
                 quoted_col = _quote_ident(column_name)
                 # We must embed identifiers directly (safe because validated & quoted), but values are selected with no params
-                sample_q = f"SELECT DISTINCT TOP 3 {quoted_col} FROM {quoted_schema}.{quoted_table} WHERE {quoted_col} IS NOT NULL;"
+                # ORDER BY keeps the samples identical between refreshes so the cached prompt prefix stays stable
+                sample_q = f"SELECT DISTINCT TOP 3 {quoted_col} FROM {quoted_schema}.{quoted_table} WHERE {quoted_col} IS NOT NULL ORDER BY {quoted_col};"
                 try:
                     cur.execute(sample_q)
                     sample_rows = cur.fetchall()
@@ -154,64 +161,250 @@ def get_table_info() -> str:
 
     return "\n".join(output_lines)
 
+
 @tool(parse_docstring=True)
-def run_sql_query(query: str) -> pd.DataFrame:
+def get_table_info() -> str:
     """
-    Execute a SQL Server query in read-only mode and return results as a Pandas DataFrame.
+    Return schema and up to max_samples non-null sample values per column for one or more SQL Server tables.
+
+    Returns:
+        str: Human-readable schema + sample values for each requested table.
+    """
+    snapshot = _snapshot_var.get()
+    return snapshot.tables() if snapshot is not None else describe_tables()
+
+
+@tool(parse_docstring=True)
+def find_closest_values(column: str, value: str) -> str:
+    """
+    Fuzzy-match a possibly misspelled or partial name against the known distinct values of a
+    low-cardinality column (Region_Name, Company_Name, Profitcenter_Name or STATUS). Use it to
+    resolve store, company or region names before filtering on them.
 
     Args:
-        query (str): The raw SQL query (must be read-only, e.g., SELECT).
+        column (str): Column to search, e.g. "Profitcenter_Name".
+        value (str): The name as the user wrote it.
 
     Returns:
-        pd.DataFrame: Query results as a DataFrame.
+        str: The closest existing values with a similarity score, best first.
     """
-    with with_sqlserver_cursor() as (conn, cur):
-        cur.execute(query)
-        rows = cur.fetchall()
+    try:
+        matches = get_value_index().match(column, value)
+    except KeyError:
+        return f"Column '{column}' is not indexed. Indexed columns: {', '.join(VALUE_INDEX_COLUMNS)}."
+    if not matches:
+        return f"No value in {column} is close to '{value}'."
+    return "\n".join(f"{match} (score {score:.2f})" for match, score in matches)
+
+
+SCHEMA_CACHE_TTL_SECONDS = int(os.getenv("SCHEMA_CACHE_TTL_SECONDS", "3600"))
+# After a failed build, wait this long before trying again instead of hitting the database on every call.
+SCHEMA_RETRY_SECONDS = float(os.getenv("SCHEMA_RETRY_SECONDS", "30"))
+SCHEMA_UNAVAILABLE = "Schema context is unavailable right now: call get_table_info before writing any SQL."
 
-        # If no rows, return empty DataFrame
-        if not rows:
-            return pd.DataFrame()
+_schema_cache = {"text": None, "loaded_at": 0.0, "failed_at": None}
+_schema_lock = threading.Lock()
+_shared_schema = get_cache("schema", SCHEMA_CACHE_TTL_SECONDS)
+register_cache_namespace("schema")
 
-        # Extract column names from cursor.description
-        columns = [col[0] for col in cur.description]
 
-        # Build DataFrame
-        df = pd.DataFrame.from_records(rows, columns=columns)
+def _drop_schema_context(old_watermark, new_watermark):
+    # Sample values are part of the context; rebuild it after a reload.
+    with _schema_lock:
+        _schema_cache["loaded_at"] = 0.0
 
-    return df
 
+on_data_change(_drop_schema_context)
 
+
+def get_schema_context(refresh: bool = False) -> str:
+    """
+    Schema, sample values and column semantics for the system prompt, built
+    once and reused for SCHEMA_CACHE_TTL_SECONDS so the prompt prefix stays
+    byte-identical between requests.
+    """
+    snapshot = _snapshot_var.get()
+    if snapshot is not None and not refresh:
+        return snapshot.context
+    with _schema_lock:
+        fresh = time.monotonic() - _schema_cache["loaded_at"] < SCHEMA_CACHE_TTL_SECONDS
+        if _schema_cache["text"] and fresh and not refresh:
+            return _schema_cache["text"]
+        failed_at = _schema_cache["failed_at"]
+        if failed_at is not None and time.monotonic() - failed_at < SCHEMA_RETRY_SECONDS and not refresh:
+            return _schema_cache["text"] or SCHEMA_UNAVAILABLE
+        # Another worker may already have built it.
+        shared = None if refresh else _shared_schema.get("context")
+        if shared:
+            _schema_cache["text"] = shared["text"]
+            _schema_cache["loaded_at"] = time.monotonic() - max(0.0, time.time() - shared["built_at"])
+            return shared["text"]
+        try:
+            text = (
+                "Table schema and sample values:\n"
+                + describe_tables().strip()
+                + "\n\nColumn semantics and business rules (aliases are for understanding only, "
+                "use the actual column names in SQL):\n"
+                + get_column_definitions().strip()
+            )
+        except Exception as e:
+            logger.warning("Could not build schema context (retrying in %.0fs): %s", SCHEMA_RETRY_SECONDS, e)
+            _schema_cache["failed_at"] = time.monotonic()
+            return _schema_cache["text"] or SCHEMA_UNAVAILABLE
+        _schema_cache["text"] = text
+        _schema_cache["loaded_at"] = time.monotonic()
+        _schema_cache["failed_at"] = None
+        _shared_schema.set("context", {"text": text, "built_at": time.time()})
+        return text
+
+
+def schema_context_available() -> bool:
+    return get_schema_context() != SCHEMA_UNAVAILABLE
+
+
+class SchemaSnapshot:
+    """One schema context and table description, shared by everything run under pinned_schema()."""
+
+    def __init__(self):
+        self.context = get_schema_context()
+        self._tables = None
+        self._lock = threading.Lock()
+
+    def tables(self) -> str:
+        with self._lock:
+            if self._tables is None:
+                self._tables = describe_tables()
+            return self._tables
+
+
+_snapshot_var = contextvars.ContextVar("schema_snapshot", default=None)
+
+
+@contextmanager
+def pinned_schema():
+    """
+    Pin one schema snapshot for this context (and contexts copied from it),
+    so a batch of questions sees the same schema and runs get_table_info once.
+    """
+    token = _snapshot_var.set(SchemaSnapshot())
+    try:
+        yield
+    finally:
+        _snapshot_var.reset(token)
+
+
+@tool(parse_docstring=True)
+def run_sql_query(query: str) -> pd.DataFrame:
+    """
+    Execute a SQL Server query in read-only mode and return results as a Pandas DataFrame.
+
+    Args:
+        query (str): The raw SQL query (must be read-only, e.g., SELECT).
+
+    Returns:
+        pd.DataFrame: Query results as a DataFrame.
+    """
+    return run_cached_sql_query(query)
+
+
+# Everything before the conversation is static (rules + cached schema), so the
+# provider can cache the prefix; volatile content such as the time goes last.
 primary_agent_prompt = ChatPromptTemplate.from_messages(
     [
         (""
             "system",
             "You are a helpful assistant for a furniture business. "
             "Your primary role is to answer customer queries by routing them through the provided tools. "
-            "Don't Directly execute the query without having the information about tables and database schema"
+            "The table schema, sample values and column business rules are provided below; use them directly "
+            "and do not call get_table_info unless the schema section says it is unavailable. "
             "If the user asks about furniture sales, customers, prices, profits, or other business-related details, "
             "use the tools to fetch the relevant information from the database. "
             "Do not mention database names, tables, or technical details to the user. "
             "If the question is casual or unrelated to the data, respond directly without using tools. "
             "If the query is unclear, ask for clarification first. "
             "When processing queries, you may run multiple intermediate queries (e.g., fetching distinct values, checking for closest matches, etc.) before forming the final query that provides the correct result. "
-            "If a query with filters returns no result, check distinct values of the relevant column(s), find the closest matches, and suggest them to the user before finalizing the response. "
+            "Before filtering on a store, company, region or status name the user typed, or when such a filter returns no result, "
+            "call find_closest_values to get the exact stored value in one step instead of querying distinct values; "
+            "if several values are equally close, suggest them to the user before finalizing the response. "
             "Always provide clear, human-readable responses after tool use. "
-            "\nCurrent time: {time}.",
+            "\n\n{schema}",
         ),
         ("placeholder", "{messages}"),
+        ("system", "Current time: {time}."),
     ]
-).partial(time=datetime.now)
+).partial(time=datetime.now, schema=get_schema_context)
 
 
 def get_primary_agent_tools():
-    return [
+    tools = [
         # get_database_info,
         get_table_info,
         run_sql_query,
     ]
+    if VALUE_INDEX_ENABLED:
+        tools.append(find_closest_values)
+    return tools
+
+
+# Tools that only read from the database and may run concurrently within one agent turn.
+READ_ONLY_TOOL_NAMES = {"get_table_info", "run_sql_query", "find_closest_values"}
+
+
+def get_routing_tools():
+    # The routing turn may only look up the schema; writing SQL is left to the "sql" step.
+    return [get_table_info]
+
 
-Primary_agent = primary_agent_prompt | llm_agent.bind_tools(get_primary_agent_tools())
+_primary_agents = {}
+
+
+def get_primary_agent(step: str = "sql"):
+    llm = get_llm(step)
+    key = (step, id(llm))
+    if key not in _primary_agents:
+        tools = get_routing_tools() if step == "route" else get_primary_agent_tools()
+        _primary_agents[key] = primary_agent_prompt | bind_tools_if_supported(llm, tools)
+    return _primary_agents[key]
+
+
+def get_routing_agent():
+    """
+    The cheap routing runnable for the opening turn, or None when there is no
+    routing decision to make: the schema is already in the prompt, or routing
+    would use the same model as SQL synthesis.
+    """
+    if model_for_step("route") == model_for_step("sql") or schema_context_available():
+        return None
+    return get_primary_agent("route")
+
+
+triage_prompt = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            "You triage messages for a furniture business analytics assistant. "
+            "If the message needs business data (sales, stores, companies, regions, customers, prices, profits, traffic or similar), "
+            "reply with exactly the single word DATA. "
+            "Otherwise (greetings, small talk, questions unrelated to the business data) reply directly to the user in one or two friendly sentences, "
+            "without mentioning databases, tables or technical details.",
+        ),
+        ("human", "{question}"),
+    ]
+)
+
+
+def triage_question(question: str, budget=None):
+    """
+    Classify the question with the fast model. Returns a ready casual reply,
+    or None when the question needs data and should go to the agent.
+    """
+    result = (triage_prompt | with_call_timeout(get_llm("classify"), llm_call_timeout(budget))).invoke({"question": question})
+    record_model_usage("classify", result, budget)
+    content = result.content if isinstance(result.content, str) else ""
+    reply = content.strip()
+    if not reply or reply.strip(" .\"'").upper() == "DATA":
+        return None
+    return reply
 
 
 def route_primary_assistant(state):
@@ -1,57 +1,349 @@
-from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
-from langgraph.prebuilt import ToolNode
-from langchain_core.messages import ToolMessage
+from langchain_core.runnables import Runnable, RunnableBinding, RunnableConfig, RunnableSequence
+from langchain_core.language_models import BaseChatModel
+from langgraph.prebuilt.tool_node import msg_content_output
+from langchain_core.messages import AIMessage, ToolMessage
 from langchain_openai import ChatOpenAI
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+import contextvars
 import os
-from dotenv import load_dotenv
+import threading
+import time
+from config import load_env
+from budget import get_budget
+from langchain_core.rate_limiters import BaseRateLimiter
+from admission import get_llm_quota
 
-load_dotenv()
+load_env()
 
 openia_api_key =os.getenv("OPENAI_API_KEY")
 
+MAX_EMPTY_RESPONSE_RETRIES = int(os.getenv("AGENT_MAX_EMPTY_RETRIES", "2"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "1"))
+PARTIAL_RESULT_MAX_CHARS = 1500
+
+BUDGET_EXHAUSTED_REPLIES = {
+    "max_llm_turns": "I couldn't finish the full analysis within the allowed number of steps.",
+    "max_tool_calls": "I couldn't finish the full analysis within the allowed number of data lookups.",
+    "max_total_tokens": "I couldn't finish the full analysis within the allowed processing budget.",
+    "deadline": "I couldn't finish the full analysis in time.",
+    "empty_response": "I wasn't able to produce a complete answer for this question.",
+}
+
+
+def _is_empty_response(result) -> bool:
+    return not result.tool_calls and (
+        not result.content
+        or isinstance(result.content, list)
+        and not result.content[0].get("text")
+    )
+
+
+def best_partial_answer(messages, reason: str) -> AIMessage:
+    """
+    Build a final (tool-free) answer from whatever the agent gathered so far:
+    the latest successful run_sql_query result if there is one.
+    """
+    text = BUDGET_EXHAUSTED_REPLIES.get(reason, BUDGET_EXHAUSTED_REPLIES["deadline"])
+    for msg in reversed(messages):
+        if isinstance(msg, ToolMessage) and msg.name == "run_sql_query":
+            content = str(msg.content or "").strip()
+            if content and not content.startswith("Error"):
+                if len(content) > PARTIAL_RESULT_MAX_CHARS:
+                    content = content[:PARTIAL_RESULT_MAX_CHARS] + "\n..."
+                text += f" Here is the most recent result I retrieved:\n{content}"
+                break
+    else:
+        text += " Please try narrowing the question (for example a specific store, region or date range)."
+    return AIMessage(content=text, response_metadata={"budget_exhausted": reason})
+
+
+def llm_call_timeout(budget) -> float:
+    """
+    Per-attempt timeout for the next LLM call: what is left of the request
+    deadline, split across the client's attempts and capped at LLM_TIMEOUT_SECONDS.
+    """
+    if budget is None:
+        return LLM_TIMEOUT_SECONDS
+    return max(1.0, min(LLM_TIMEOUT_SECONDS, budget.remaining_seconds() / (LLM_MAX_RETRIES + 1)))
+
+
+def with_call_timeout(runnable, seconds: float):
+    """Bind `timeout` onto the chat model at the end of `runnable` (a model or a prompt | model chain)."""
+    if isinstance(runnable, RunnableSequence):
+        return RunnableSequence(*runnable.steps[:-1], with_call_timeout(runnable.last, seconds))
+    if isinstance(runnable, (BaseChatModel, RunnableBinding)):
+        return runnable.bind(timeout=seconds)
+    return runnable
+
+
 class Assistant:
-    def __init__(self, runnable: Runnable):
+    """
+    Agent node. `runnable` (the "sql" step) writes SQL and the final answer;
+    the optional `routing_runnable` (the "route" step) takes the opening turn,
+    which only decides between answering directly and fetching the schema.
+    """
+
+    def __init__(self, runnable: Runnable, routing_runnable: Runnable = None):
         self.runnable = runnable
+        self.routing_runnable = routing_runnable
+
+    def _select(self, state):
+        if self.routing_runnable is not None and not any(
+            isinstance(msg, ToolMessage) for msg in state["messages"]
+        ):
+            return "route", self.routing_runnable
+        return "sql", self.runnable
 
     def __call__(self, state, config: RunnableConfig):
+        budget = get_budget(config)
+        empty_retries = 0
         while True:
-            result = self.runnable.invoke(state)
+            reason = budget.check() if budget else None
+            if reason:
+                return {"messages": best_partial_answer(state["messages"], reason)}
 
-            if not result.tool_calls and (
-                not result.content
-                or isinstance(result.content, list)
-                and not result.content[0].get("text")
-            ):
+            step, runnable = self._select(state)
+            # The deadline is only checked between calls, so bound the call itself by it too.
+            result = with_call_timeout(runnable, llm_call_timeout(budget)).invoke(state)
+            record_model_usage(step, result, budget)
+
+            if _is_empty_response(result):
+                empty_retries += 1
+                if empty_retries > MAX_EMPTY_RESPONSE_RETRIES:
+                    return {"messages": best_partial_answer(state["messages"], "empty_response")}
                 messages = state["messages"] + [
                     ("user", "Respond with a real output.")
                 ]
                 state = {**state, "messages": messages}
-            else:
-                break
+                continue
+
+            if result.tool_calls and budget and not budget.charge_tool_calls(len(result.tool_calls)):
+                return {"messages": best_partial_answer(state["messages"], budget.exhausted_reason)}
+            break
         return {"messages": result}
     
-def handle_tool_error(state) -> dict:
-    error = state.get("error")
-    tool_calls = state["messages"][-1].tool_calls
-    return {
-        "messages": [
-            ToolMessage(
-                content=f"Error: {repr(error)}\n Tell the customer an error occured and escalate back to the main assistant.",
-                tool_call_id=tc["id"],
-            )
-            for tc in tool_calls
-        ]
-    }
-
-def create_tool_node_with_fallback(tools: list) -> dict:
-    return ToolNode(tools).with_fallbacks(
-        [RunnableLambda(handle_tool_error)], exception_key="error"
+def _tool_error_message(error, tool_call) -> ToolMessage:
+    # Errors the model can fix itself (e.g. cost-guard rejections) carry their own hint.
+    hint = getattr(error, "tool_feedback", None) or "Tell the customer an error occured and escalate back to the main assistant."
+    return ToolMessage(
+        content=f"Error: {repr(error)}\n {hint}",
+        tool_call_id=tool_call["id"],
+        name=tool_call.get("name"),
+        status="error",
     )
 
 
-llm_agent = ChatOpenAI(model='gpt-4o',
-                       temperature=0,
-                       max_tokens = None,
-                       timeout=None,
-                       max_retries=2,
-                       api_key=openia_api_key)
\ No newline at end of file
+# Calls of one turn that run at the same time; each turn gets its own workers.
+TOOL_POOL_SIZE = int(os.getenv("TOOL_POOL_SIZE", "8"))
+TOOL_CALL_TIMEOUT_SECONDS = float(os.getenv("TOOL_CALL_TIMEOUT_SECONDS", "60"))
+
+
+def _reset_after_fork() -> None:
+    # A forked worker inherits no usable HTTP connections; rebuild the models lazily.
+    global _chat_models_lock
+    _chat_models.clear()
+    _chat_models_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class _ToolRun:
+    """A submitted tool call and the moment a worker started running it."""
+
+    def __init__(self, tool_call):
+        self.tool_call = tool_call
+        self.future = None
+        self.started = threading.Event()
+        self.started_at = None
+
+    def mark_started(self) -> None:
+        self.started_at = time.monotonic()
+        self.started.set()
+
+
+class ParallelToolNode:
+    """
+    Tool node that runs the tool calls of one agent turn on the turn's own
+    thread pool (at most TOOL_POOL_SIZE workers). When every call in the turn
+    is in `concurrent_tools` (read-only), they run concurrently; otherwise one
+    after another. Each call gets its own timeout, counted from when it starts
+    running and capped by the request deadline, and its own error message;
+    results come back in the order the model asked for them. A timed-out call
+    keeps its worker until the tool returns, but only within its own turn; the
+    SQL tools bound that with the statement timeout on the cursor.
+    """
+
+    def __init__(self, tools: list, concurrent_tools=None):
+        self.tools_by_name = {t.name: t for t in tools}
+        self.concurrent_tools = set(concurrent_tools or ())
+
+    def _run_one(self, tool_call) -> ToolMessage:
+        tool = self.tools_by_name.get(tool_call["name"])
+        if tool is None:
+            return _tool_error_message(ValueError(f"Unknown tool: {tool_call['name']}"), tool_call)
+        try:
+            output = tool.invoke(tool_call["args"])
+        except Exception as e:
+            return _tool_error_message(e, tool_call)
+        return ToolMessage(
+            content=msg_content_output(output),
+            tool_call_id=tool_call["id"],
+            name=tool_call["name"],
+        )
+
+    def _call_timeout(self, budget) -> float:
+        if budget is None:
+            return TOOL_CALL_TIMEOUT_SECONDS
+        return max(0.0, min(TOOL_CALL_TIMEOUT_SECONDS, budget.remaining_seconds()))
+
+    def _submit(self, executor, tool_call) -> _ToolRun:
+        run = _ToolRun(tool_call)
+
+        def start():
+            run.mark_started()
+            return self._run_one(tool_call)
+
+        # Each call runs in a copy of the caller's context so its log records
+        # keep the request ID.
+        run.future = executor.submit(contextvars.copy_context().run, start)
+        return run
+
+    def _await(self, run: _ToolRun, budget) -> ToolMessage:
+        tool_call = run.tool_call
+        # Waiting for a free worker is only bounded by the request deadline.
+        queue_timeout = budget.remaining_seconds() if budget is not None else TOOL_CALL_TIMEOUT_SECONDS
+        if not run.started.wait(queue_timeout):
+            run.future.cancel()
+            return _tool_error_message(TimeoutError(f"Tool '{tool_call['name']}' did not start in time"), tool_call)
+        deadline = run.started_at + self._call_timeout(budget)
+        try:
+            return run.future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FuturesTimeoutError:
+            return _tool_error_message(TimeoutError(f"Tool '{tool_call['name']}' timed out"), tool_call)
+
+    def __call__(self, state, config: RunnableConfig):
+        tool_calls = state["messages"][-1].tool_calls
+        budget = get_budget(config)
+
+        concurrent = len(tool_calls) > 1 and all(tc["name"] in self.concurrent_tools for tc in tool_calls)
+        # Sequential calls get a worker each too, so one that timed out doesn't hold up the next.
+        executor = ThreadPoolExecutor(max_workers=max(1, min(len(tool_calls), TOOL_POOL_SIZE)), thread_name_prefix="agent-tool")
+        try:
+            if concurrent:
+                runs = [self._submit(executor, tc) for tc in tool_calls]
+                results = [self._await(run, budget) for run in runs]
+            else:
+                results = [self._await(self._submit(executor, tc), budget) for tc in tool_calls]
+        finally:
+            # Don't wait for timed-out calls; their threads end when the tool returns.
+            executor.shutdown(wait=False)
+        return {"messages": results}
+
+
+def create_tool_node_with_fallback(tools: list, concurrent_tools=None) -> ParallelToolNode:
+    return ParallelToolNode(tools, concurrent_tools=concurrent_tools)
+
+
+# Per-step model selection. The fast tier handles triage (intent
+# classification + casual replies), slot extraction and the opening tool
+# routing turn; the strong tier is kept for SQL synthesis and final answers.
+LLM_MODEL_FAST = os.getenv("LLM_MODEL_FAST", "gpt-4o-mini")
+LLM_MODEL_STRONG = os.getenv("LLM_MODEL_STRONG", "gpt-4o")
+STEP_DEFAULT_MODELS = {
+    "classify": LLM_MODEL_FAST,
+    "slots": LLM_MODEL_FAST,
+    "route": LLM_MODEL_FAST,
+    "sql": LLM_MODEL_STRONG,
+}
+
+
+def model_for_step(step: str) -> str:
+    """LLM_MODEL_<STEP> overrides the tier default for a single step."""
+    return os.getenv(f"LLM_MODEL_{step.upper()}", STEP_DEFAULT_MODELS.get(step, LLM_MODEL_STRONG))
+
+
+class LLMRateLimiter(BaseRateLimiter):
+    """LangChain adapter over the shared per-model quota in admission."""
+
+    def __init__(self, model: str):
+        self.quota = get_llm_quota(model)
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        return self.quota.acquire(blocking)
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        import asyncio
+
+        return await asyncio.get_running_loop().run_in_executor(None, self.quota.acquire, blocking)
+
+
+def _default_chat_model_factory(step: str, model: str):
+    # Calls are paced by the shared RPM/TPM limiter, so client retries are kept
+    # low; they would otherwise multiply a rate-limit storm.
+    return ChatOpenAI(model=model,
+                      temperature=0,
+                      max_tokens = None,
+                      timeout=LLM_TIMEOUT_SECONDS,
+                      max_retries=LLM_MAX_RETRIES,
+                      rate_limiter=LLMRateLimiter(model),
+                      api_key=openia_api_key)
+
+
+_chat_model_factory = _default_chat_model_factory
+_chat_models = {}
+_chat_models_lock = threading.Lock()
+
+
+def set_chat_model_factory(factory) -> None:
+    """
+    Swap how chat models are built, e.g. a fake chat model for offline tests.
+    `factory(step, model_name)` must return a LangChain chat model.
+    """
+    global _chat_model_factory
+    with _chat_models_lock:
+        _chat_model_factory = factory or _default_chat_model_factory
+        _chat_models.clear()
+
+
+def get_llm(step: str):
+    model = model_for_step(step)
+    key = (step, model)
+    with _chat_models_lock:
+        if key not in _chat_models:
+            _chat_models[key] = _chat_model_factory(step, model)
+        return _chat_models[key]
+
+
+def bind_tools_if_supported(llm, tools: list):
+    try:
+        return llm.bind_tools(tools)
+    except NotImplementedError:
+        # Fake/test chat models don't implement tool binding.
+        return llm
+
+
+_model_usage = {}
+_model_usage_lock = threading.Lock()
+
+
+def record_model_usage(step: str, message, budget=None) -> None:
+    model = model_for_step(step)
+    usage = getattr(message, "usage_metadata", None) or {}
+    with _model_usage_lock:
+        entry = _model_usage.setdefault(
+            step, {"model": model, "calls": 0, "input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+        )
+        entry["model"] = model
+        entry["calls"] += 1
+        for key in ("input_tokens", "output_tokens", "total_tokens"):
+            entry[key] += usage.get(key) or 0
+    get_llm_quota(model).settle(usage.get("total_tokens") or 0)
+    if budget:
+        budget.record_llm_turn(message, step=step, model=model)
+
+
+def get_model_usage_metrics() -> dict:
+    with _model_usage_lock:
+        return {step: dict(entry) for step, entry in _model_usage.items()}
@@ -0,0 +1,219 @@
+import difflib
+import heapq
+import logging
+import os
+import re
+import threading
+import time
+
+from cache import get_cache
+from freshness import on_data_change, register_cache_namespace
+from db import with_sqlserver_cursor
+
+logger = logging.getLogger(__name__)
+
+TABLE = "[dbo].[ConsolidateData_PBI]"
+VALUE_INDEX_ENABLED = os.getenv("VALUE_INDEX_ENABLED", "1").lower() not in {"0", "false", "no"}
+VALUE_INDEX_COLUMNS = [
+    c.strip() for c in os.getenv("VALUE_INDEX_COLUMNS", "Region_Name,Company_Name,Profitcenter_Name,STATUS").split(",")
+    if c.strip()
+]
+VALUE_INDEX_REFRESH_SECONDS = int(os.getenv("VALUE_INDEX_REFRESH_SECONDS", "900"))
+# Columns with more distinct values than this are not low-cardinality and are left out.
+VALUE_INDEX_MAX_VALUES = int(os.getenv("VALUE_INDEX_MAX_VALUES", "5000"))
+VALUE_INDEX_MIN_SCORE = float(os.getenv("VALUE_INDEX_MIN_SCORE", "0.45"))
+
+# Only the best trigram candidates get the (slower) edit-distance score.
+VALUE_INDEX_RERANK = 50
+
+COLUMN_RE = re.compile(r"^[A-Za-z0-9_]+$")
+NON_ALNUM_RE = re.compile(r"[^a-z0-9]+")
+
+_shared_values = get_cache("value_index", VALUE_INDEX_REFRESH_SECONDS)
+register_cache_namespace("value_index")
+
+_metrics_lock = threading.Lock()
+_metrics = {"lookups": 0, "matched": 0, "unmatched": 0, "refreshes": 0, "refresh_errors": 0}
+
+
+def _normalize(value: str) -> str:
+    return NON_ALNUM_RE.sub(" ", value.lower()).strip()
+
+
+def _trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ColumnIndex:
+    """Distinct values of one column with a trigram inverted index for candidate lookup."""
+
+    def __init__(self, column: str, values):
+        self.column = column
+        self.values = sorted({v.strip() for v in values if v and v.strip()})
+        self.normalized = [_normalize(v) for v in self.values]
+        self.grams = [_trigrams(n) for n in self.normalized]
+        self.postings = {}
+        for i, grams in enumerate(self.grams):
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(i)
+
+    def match(self, query: str, limit: int = 5):
+        """Return [(value, score)] best first; score blends trigram overlap and edit similarity."""
+        needle = _normalize(query)
+        if not needle:
+            return []
+        needle_grams = _trigrams(needle)
+        overlap = {}
+        for gram in needle_grams:
+            for i in self.postings.get(gram, ()):
+                overlap[i] = overlap.get(i, 0) + 1
+
+        jaccards = {
+            i: shared / (len(needle_grams) + len(self.grams[i]) - shared) for i, shared in overlap.items()
+        }
+        scored = []
+        for i in heapq.nlargest(VALUE_INDEX_RERANK, jaccards, key=jaccards.get):
+            candidate = self.normalized[i]
+            jaccard = jaccards[i]
+            edit = difflib.SequenceMatcher(None, needle, candidate, autojunk=False).ratio()
+            score = max(jaccard, edit)
+            if candidate == needle:
+                score = 1.0
+            elif needle in candidate.split() or candidate.startswith(needle):
+                score = max(score, 0.9)
+            scored.append((round(score, 3), self.values[i]))
+        scored.sort(key=lambda s: (-s[0], s[1]))
+        return [(value, score) for score, value in scored[:limit]]
+
+
+class ValueIndex:
+    def __init__(self, columns=None):
+        self.columns = list(columns or VALUE_INDEX_COLUMNS)
+        self._indexes = {}
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._refresher = None
+
+    def _column_name(self, column: str):
+        wanted = column.strip().strip("[]").lower()
+        for name in self.columns:
+            if name.lower() == wanted:
+                return name
+        return None
+
+    def _load_values(self) -> dict:
+        values_by_column = {}
+        with with_sqlserver_cursor(isolation="probe") as (conn, cur):
+            for column in self.columns:
+                if not COLUMN_RE.match(column):
+                    logger.warning("Skipping invalid value index column %r", column)
+                    continue
+                cur.execute(
+                    f"SELECT DISTINCT TOP ({VALUE_INDEX_MAX_VALUES + 1}) LTRIM(RTRIM([{column}])) "
+                    f"FROM {TABLE} WHERE [{column}] IS NOT NULL"
+                )
+                values = [row[0] for row in cur.fetchall() if isinstance(row[0], str)]
+                if len(values) > VALUE_INDEX_MAX_VALUES:
+                    logger.info("Value index: %s has more than %d distinct values, skipped.", column, VALUE_INDEX_MAX_VALUES)
+                    continue
+                values_by_column[column] = values
+        return values_by_column
+
+    def refresh(self) -> None:
+        # Workers share the distinct values, so only one of them scans the table per refresh period.
+        key = ",".join(self.columns)
+        values_by_column = _shared_values.get(key)
+        if values_by_column is None:
+            values_by_column = self._load_values()
+            _shared_values.set(key, values_by_column)
+        indexes = {column: ColumnIndex(column, values) for column, values in values_by_column.items()}
+        with self._lock:
+            self._indexes = indexes
+            self._loaded_at = time.monotonic()
+        with _metrics_lock:
+            _metrics["refreshes"] += 1
+
+    def _refresh_loop(self) -> None:
+        while True:
+            time.sleep(VALUE_INDEX_REFRESH_SECONDS)
+            try:
+                self.refresh()
+            except Exception as e:
+                with _metrics_lock:
+                    _metrics["refresh_errors"] += 1
+                logger.warning("Value index refresh failed, keeping the previous values: %s", e)
+
+    def ensure_loaded(self) -> bool:
+        """Load synchronously the first time, then keep refreshing on a daemon thread."""
+        with self._load_lock:
+            with self._lock:
+                loaded = bool(self._indexes)
+            if not loaded:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    with _metrics_lock:
+                        _metrics["refresh_errors"] += 1
+                    logger.warning("Value index load failed: %s", e)
+                    return False
+        with self._lock:
+            if self._refresher is None:
+                self._refresher = threading.Thread(target=self._refresh_loop, name="value-index-refresh", daemon=True)
+                self._refresher.start()
+        return True
+
+    def match(self, column: str, value: str, limit: int = 5):
+        name = self._column_name(column)
+        if name is None:
+            raise KeyError(column)
+        self.ensure_loaded()
+        with self._lock:
+            index = self._indexes.get(name)
+        matches = index.match(value, limit) if index else []
+        matches = [m for m in matches if m[1] >= VALUE_INDEX_MIN_SCORE]
+        with _metrics_lock:
+            _metrics["lookups"] += 1
+            _metrics["matched" if matches else "unmatched"] += 1
+        return matches
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "columns": {name: len(index.values) for name, index in self._indexes.items()},
+                "age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at else None,
+            }
+
+
+_index = ValueIndex()
+
+
+def _refresh_on_data_change(old_watermark, new_watermark):
+    if _index.stats()["age_seconds"] is not None:
+        _index.refresh()
+
+
+on_data_change(_refresh_on_data_change)
+
+
+def _reset_after_fork():
+    # The refresh thread doesn't survive fork; let the worker start its own.
+    _index._lock = threading.Lock()
+    _index._load_lock = threading.Lock()
+    _index._refresher = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_value_index() -> ValueIndex:
+    return _index
+
+
+def get_value_index_metrics() -> dict:
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    metrics.update(_index.stats())
+    return metrics